@@ -42,6 +42,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Removes itself unless QUIZ_INSTRUMENTATION is enabled
+    'quizzes.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -120,3 +122,109 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/3.0/howto/static-files/
 
 STATIC_URL = '/static/'
+
+# Uploaded files, quiz CSVs wait here while they are imported and feedback PDFs are stored here
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+MEDIA_URL = '/media/'
+
+
+# File uploads
+# https://docs.djangoproject.com/en/3.0/ref/settings/#file-upload-settings
+
+# Uploads bigger than FILE_UPLOAD_MAX_MEMORY_SIZE are spooled to a temporary file on disk,
+# quiz CSVs are then streamed from that file into the importer chunk by chunk.
+FILE_UPLOAD_HANDLERS = [
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+
+FILE_UPLOAD_MAX_MEMORY_SIZE = 1024 * 1024
+
+# Number of CSV rows handed to the quiz importer at a time
+QUIZ_IMPORT_BATCH_SIZE = 1000
+
+# Who runs quiz CSV import jobs: 'thread' (a pool inside the web process),
+# 'command' (manage.py run_import_jobs) or 'sync' (the upload request)
+QUIZ_IMPORT_RUNNER = 'thread'
+
+QUIZ_IMPORT_WORKERS = 2
+
+# Seconds without a heartbeat after which a running import job is taken to be dead, its runner having
+# crashed or restarted, and is imported again. A running job beats every quarter of this.
+QUIZ_IMPORT_STALE_AFTER = 60 * 10
+
+# Who renders feedback PDFs: 'process' (a pool of worker processes next to the web process),
+# 'command' (manage.py render_feedback_pdfs) or 'sync' (the request that needs the PDF)
+QUIZ_PDF_RUNNER = 'process'
+
+QUIZ_PDF_WORKERS = 2
+
+# Most responses a merged feedback PDF export takes, the merged document is built in memory.
+# ZIP exports stream any number of responses.
+QUIZ_PDF_MERGE_MAX_RESPONSES = 200
+
+# Where the progress of a quiz being taken is kept: 'session' (the session store, flushed when a quiz starts)
+# or 'signed' (a signed token in the question urls and forms, taking a quiz doesn't touch the session)
+QUIZ_PROGRESS_BACKEND = 'session'
+
+# Seconds a signed progress token stays valid
+QUIZ_PROGRESS_TOKEN_MAX_AGE = 60 * 60 * 24
+
+# Buffer finished responses in memory and write them to the database in batches from a background thread,
+# see quizzes/writebehind.py. With a spool directory buffered responses survive a crash of the web process
+QUIZ_WRITE_BEHIND = False
+
+QUIZ_WRITE_BEHIND_SPOOL_DIR = os.path.join(BASE_DIR, 'spool')
+
+QUIZ_WRITE_BEHIND_BATCH_SIZE = 500
+
+# Seconds between writes of the buffer
+QUIZ_WRITE_BEHIND_INTERVAL = 1.0
+
+# Flushes a buffered response may fail to be written in before it is moved to the dead-letter file of the spool
+QUIZ_WRITE_BEHIND_MAX_ATTEMPTS = 5
+
+# Quizzes with more questions than this are edited a category and a question at a time in the admin,
+# instead of with every question and answer inline on the quiz page
+QUIZ_ADMIN_MAX_INLINE_QUESTIONS = 100
+
+# Number of buckets of the per-category score histograms kept by quizzes/analytics.py.
+# Run `manage.py rebuild_quiz_analytics` after changing it
+QUIZ_ANALYTICS_BINS = 10
+
+# Serve the quiz-taking and feedback pages with the async views of quizzes/async_views.py.
+# Only worth it when the project runs under an ASGI server (ExampleProject/asgi.py), e.g. uvicorn or daphne
+QUIZ_ASYNC_VIEWS = False
+
+
+# Caches
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+
+# Compiled quizzes and rendered feedback pages are cached. Every web process should share these caches,
+# local memory is only shared by the threads of one process. Use a file or database cache locally
+# and Redis or Memcached in production, for example:
+#     'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+#     'LOCATION': os.path.join(BASE_DIR, 'cache'),
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+# Cache aliases used by the quizzes app
+QUIZ_TREE_CACHE = 'default'
+
+QUIZ_FEEDBACK_CACHE = 'default'
+
+# Seconds a superseded quiz snapshot is kept for the takers that started on it, before
+# `manage.py collect_quiz_snapshots` deletes it. Keep it at least as long as progress lives
+# (SESSION_COOKIE_AGE or QUIZ_PROGRESS_TOKEN_MAX_AGE)
+QUIZ_SNAPSHOT_RETENTION = 60 * 60 * 24 * 14
+
+# Per-request measurements of queries, database, template, pdf and session costs,
+# sent as Server-Timing headers and summarized at /quizzes/instrumentation/
+QUIZ_INSTRUMENTATION = False
+
+# Number of requests per view the instrumentation percentiles are taken over
+QUIZ_INSTRUMENTATION_WINDOW = 1000
@@ -1,6 +1,18 @@
+from django.conf import settings
 from django.contrib import admin
+from django.core.exceptions import PermissionDenied
+from django.shortcuts import get_object_or_404
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
+from django.utils.html import format_html
 import nested_admin
-from .models import Quiz, Category, Question, Answer, Feedback, UserResponse
+from .analytics import quiz_analytics
+from .compiled import get_quiz_tree
+from .models import Quiz, Category, Question, Answer, Feedback, UserResponse, ImportJob
+
+# Quizzes with more questions than this are edited a category and a question at a time,
+# instead of with every question and answer inline on the quiz page
+QUIZ_ADMIN_MAX_INLINE_QUESTIONS = getattr(settings, 'QUIZ_ADMIN_MAX_INLINE_QUESTIONS', 100)
 
 
 class AnswerInline(nested_admin.NestedTabularInline):
@@ -44,6 +56,22 @@ class CategoryInline(nested_admin.NestedTabularInline):
     extra = 0
 
 
+class CategoryLinkInline(CategoryInline):
+    """
+    The Category input section of quizzes too large to edit on one page, see QUIZ_ADMIN_MAX_INLINE_QUESTIONS.
+    Questions are edited from each category's own page and the Question admin.
+    """
+    inlines = []
+    show_change_link = True
+
+
+def questions_link(count, **filters):
+    """Link to the Question admin showing the questions of a quiz or a category"""
+    query = '&'.join('%s=%s' % (field, value) for field, value in filters.items())
+    return format_html('<a href="{}?{}">{} question{}</a>', reverse('admin:quizzes_question_changelist'), query,
+                       count, '' if count == 1 else 's')
+
+
 class QuizAdmin(nested_admin.NestedModelAdmin):
     """
     This is the Quiz Admin view.
@@ -53,6 +81,49 @@ class QuizAdmin(nested_admin.NestedModelAdmin):
     inputs to all appear on the same page.
     """
     inlines = [CategoryInline,]
+    list_display = ['name', 'pub_date', 'active_quiz', 'completions', 'analytics_link']
+    search_fields = ['^name']
+    readonly_fields = ['questions']
+    # The completion counts come along with the quizzes, in the same query
+    list_select_related = ['analytics']
+
+    def get_urls(self):
+        return [
+            path('<int:quiz_id>/analytics/', self.admin_site.admin_view(self.analytics_view),
+                 name='quizzes_quiz_analytics'),
+        ] + super().get_urls()
+
+    def get_inlines(self, request, obj):
+        # Every question and answer of a large quiz would be a form on one page, with queries for each
+        if obj is not None and len(get_quiz_tree(obj.id).questions) > QUIZ_ADMIN_MAX_INLINE_QUESTIONS:
+            return [CategoryLinkInline]
+        return self.inlines
+
+    def questions(self, quiz):
+        if quiz.id is None:
+            return '-'
+        return questions_link(len(get_quiz_tree(quiz.id).questions), parent_quiz__id__exact=quiz.id)
+
+    def completions(self, quiz):
+        analytics = getattr(quiz, 'analytics', None)
+        return analytics.completions if analytics is not None else 0
+
+    def analytics_link(self, quiz):
+        return format_html('<a href="{}">Analytics</a>', reverse('admin:quizzes_quiz_analytics', args=(quiz.id,)))
+    analytics_link.short_description = 'Analytics'
+
+    def analytics_view(self, request, quiz_id):
+        """Shows the answer picks and category score histograms of a quiz, from the analytics tables"""
+        quiz = get_object_or_404(Quiz, pk=quiz_id)
+        if not self.has_view_or_change_permission(request, quiz):
+            raise PermissionDenied
+        return TemplateResponse(request, 'admin/quizzes/quiz/analytics.html', {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'original': quiz,
+            'title': 'Analytics of %s' % quiz,
+            'analytics': quiz_analytics(quiz.id),
+        })
 
 
 class FeedbackInline(admin.TabularInline):
@@ -60,15 +131,70 @@ class FeedbackInline(admin.TabularInline):
     inlines = [Feedback,]
 
 
+class CategoryAdmin(admin.ModelAdmin):
+    list_display = ['category_name', 'parent_quiz']
+    list_select_related = ['parent_quiz']
+    list_filter = ['parent_quiz']
+    search_fields = ['^category_name']
+    raw_id_fields = ['parent_quiz']
+    readonly_fields = ['questions']
+
+    def questions(self, category):
+        if category.id is None:
+            return '-'
+        return questions_link(category.question_set.count(), parent_category__id__exact=category.id)
+
+
+class QuestionAdmin(nested_admin.NestedModelAdmin):
+    """Questions of large quizzes are edited here with their answers, one question per page"""
+    list_display = ['question_text', 'parent_category', 'parent_quiz']
+    list_select_related = ['parent_category', 'parent_quiz']
+    list_filter = ['parent_quiz']
+    search_fields = ['^question_text']
+    raw_id_fields = ['parent_quiz', 'parent_category']
+    inlines = [AnswerInline,]
+
+
+class AnswerAdmin(admin.ModelAdmin):
+    list_display = ['answer_text', 'answer_weight', 'parent_question', 'parent_quiz']
+    list_select_related = ['parent_question', 'parent_quiz']
+    list_filter = ['parent_quiz']
+    search_fields = ['^answer_text']
+    raw_id_fields = ['parent_quiz', 'parent_category', 'parent_question']
+
+
+class FeedbackAdmin(admin.ModelAdmin):
+    list_display = ['feedback_text', 'parent_answer', 'parent_quiz']
+    list_select_related = ['parent_answer', 'parent_quiz']
+    list_filter = ['parent_quiz']
+    search_fields = ['^feedback_text']
+    raw_id_fields = ['parent_quiz', 'parent_category', 'parent_question', 'parent_answer']
+
+
 class UserResponseAdmin(admin.ModelAdmin):
     list_display = ['response_id', 'parent_quiz']
+    list_select_related = ['parent_quiz']
+    list_filter = ['parent_quiz']
     ordering = ['parent_quiz']
+    # Response ids are unique, so a search is one index lookup
+    search_fields = ['=response_id']
+    raw_id_fields = ['parent_quiz']
+    # Counting every response of a large table on each page is skipped
+    show_full_result_count = False
     model = UserResponse
 
 
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ['quiz_name', 'status', 'rows_processed', 'rows_total', 'created', 'finished']
+    list_filter = ['status']
+    readonly_fields = ['quiz', 'status', 'rows_processed', 'rows_total', 'error_message', 'created', 'finished']
+    model = ImportJob
+
+
 admin.site.register(Quiz, QuizAdmin)
-admin.site.register(Category)
-admin.site.register(Question)
-admin.site.register(Answer)
-admin.site.register(Feedback)
+admin.site.register(Category, CategoryAdmin)
+admin.site.register(Question, QuestionAdmin)
+admin.site.register(Answer, AnswerAdmin)
+admin.site.register(Feedback, FeedbackAdmin)
 admin.site.register(UserResponse, UserResponseAdmin)
+admin.site.register(ImportJob, ImportJobAdmin)
@@ -0,0 +1,220 @@
+import functools
+import operator
+from collections import Counter, defaultdict
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, FloatField, IntegerField, Q, Value, When
+from django.utils import timezone
+from .compiled import get_quiz_tree
+from .models import AnswerPickCount, CategoryScoreBucket, QuizAnalytics, UserResponse
+from .scoring import get_score_range, get_scorer
+from .utils import iter_batches
+
+# Aggregates over the finalized responses of every quiz, kept in their own tables so reports never have to
+# load the response data: completions per quiz, picks per answer, and a histogram plus the score sum per
+# category. They are updated with the difference a response makes every time one is finalized or rescored,
+# in a fixed number of queries, and read back with one query per table.
+#
+# Scores are binned into QUIZ_ANALYTICS_BINS buckets over QUIZ_SCORE_RANGE. After changing either,
+# or to count responses stored before the analytics existed, run `manage.py rebuild_quiz_analytics`.
+
+QUIZ_ANALYTICS_BINS = getattr(settings, 'QUIZ_ANALYTICS_BINS', 10)
+
+# Number of buckets updated per query
+BUCKET_BATCH_SIZE = 100
+
+
+def score_bucket(score, score_range, bins=QUIZ_ANALYTICS_BINS):
+    """Returns the histogram bucket of a score, the highest score falls in the last bucket"""
+    low, high = score_range
+    if high <= low:
+        return 0
+    return min(max(int((score - low) / (high - low) * bins), 0), bins - 1)
+
+
+class MissingRows(Exception):
+    pass
+
+
+class Tally:
+    """Changes to the aggregates of one compiled quiz, added up in memory and written at once by save()"""
+
+    def __init__(self, quiz):
+        self.quiz = quiz
+        self.scorer = get_scorer(quiz)
+        self.score_range = get_score_range()
+        self.category_ids = {category.name: category.id for category in quiz.categories}
+        self.completions = 0
+        self.picks = Counter()
+        # {(category_id, bucket): [responses, score sum]}
+        self.buckets = defaultdict(lambda: [0, 0.0])
+
+    def add(self, response_data, sign=1):
+        """Counts the response data of a finalized response, or takes it back out with a `sign` of -1"""
+        if not response_data:
+            return
+        self.completions += sign
+        for answer_id in self.scorer.stored_answer_ids(response_data):
+            if answer_id:
+                self.picks[answer_id] += sign
+        for name, score in (response_data.get('quiz_norm_scores') or {}).items():
+            category_id = self.category_ids.get(name)
+            if category_id is None or score is None:
+                continue
+            bucket = self.buckets[category_id, score_bucket(score, self.score_range)]
+            bucket[0] += sign
+            bucket[1] += sign * score
+
+    def save(self):
+        """
+        Adds the changes to the stored aggregates, with one update per table when their rows exist.
+        When rows are missing the updates are rolled back and run again after the rows are created.
+        """
+        try:
+            with transaction.atomic():
+                self.write(create_rows=False)
+        except MissingRows:
+            with transaction.atomic():
+                self.write(create_rows=True)
+
+    def write(self, create_rows):
+        picks = {answer_id: picks for answer_id, picks in self.picks.items() if picks}
+        buckets = {key: totals for key, totals in self.buckets.items() if totals[0] or totals[1]}
+        tables = [
+            (QuizAnalytics, ['quiz_id'], [(self.quiz.id,)] if self.completions else [], self.add_completions),
+            (AnswerPickCount, ['answer_id'], [(answer_id,) for answer_id in picks],
+             lambda keys: self.add_picks(picks, keys)),
+            (CategoryScoreBucket, ['category_id', 'bucket'], list(buckets),
+             lambda keys: self.add_buckets(buckets, keys)),
+        ]
+        for model, key_fields, keys, update in tables:
+            if not keys:
+                continue
+            if create_rows:
+                # Rows another process created in the meantime are left as they are
+                model.objects.bulk_create(
+                    [model(**{'quiz_id': self.quiz.id, **dict(zip(key_fields, key))}) for key in keys],
+                    ignore_conflicts=True)
+            if update(keys) != len(keys):
+                raise MissingRows
+
+    def add_completions(self, keys):
+        return QuizAnalytics.objects.filter(quiz_id=self.quiz.id).update(
+            completions=F('completions') + self.completions, updated_at=timezone.now())
+
+    def add_picks(self, picks, keys):
+        # One query per distinct change, a single finalized response only has +1
+        by_change = defaultdict(list)
+        for answer_id, in keys:
+            by_change[picks[answer_id]].append(answer_id)
+        updated = 0
+        for change, answer_ids in by_change.items():
+            for batch in iter_batches(answer_ids, BUCKET_BATCH_SIZE * 10):
+                updated += AnswerPickCount.objects.filter(answer_id__in=batch).update(picks=F('picks') + change)
+        return updated
+
+    def add_buckets(self, buckets, keys):
+        updated = 0
+        for batch in iter_batches(keys, BUCKET_BATCH_SIZE):
+            conditions = [(key_filter(['category_id', 'bucket'], [key]),) + tuple(buckets[key]) for key in batch]
+            updated += CategoryScoreBucket.objects.filter(key_filter(['category_id', 'bucket'], batch)).update(
+                responses=F('responses') + Case(
+                    *[When(condition, then=Value(responses)) for condition, responses, score_sum in conditions],
+                    default=Value(0), output_field=IntegerField()),
+                score_sum=F('score_sum') + Case(
+                    *[When(condition, then=Value(score_sum)) for condition, responses, score_sum in conditions],
+                    default=Value(0.0), output_field=FloatField()),
+            )
+        return updated
+
+
+def key_filter(key_fields, keys):
+    """A filter matching the rows of `keys`, tuples of the values of `key_fields`"""
+    if len(key_fields) == 1:
+        return Q(**{key_fields[0] + '__in': [key[0] for key in keys]})
+    return functools.reduce(operator.or_, [Q(**dict(zip(key_fields, key))) for key in keys])
+
+
+def update_analytics(quiz, changes):
+    """
+    Updates the aggregates of a compiled quiz or a quiz id for responses that were finalized or rescored.
+    `changes` are (old response_data, new response_data) pairs, old is None for a newly finalized response.
+    """
+    if not hasattr(quiz, 'version'):
+        quiz = get_quiz_tree(quiz)
+    tally = Tally(quiz)
+    for old_data, new_data in changes:
+        tally.add(old_data, -1)
+        tally.add(new_data)
+    tally.save()
+
+
+def rebuild_analytics(quiz_id, chunk_size=2000):
+    """
+    Works out the aggregates of a quiz again from all of its finalized responses.
+    Returns the number of responses counted
+    """
+    tally = Tally(get_quiz_tree(quiz_id))
+    for response_data in UserResponse.objects.filter(parent_quiz_id=quiz_id, response_data__isnull=False).order_by(
+            'id').values_list('response_data', flat=True).iterator(chunk_size=chunk_size):
+        tally.add(response_data)
+    with transaction.atomic():
+        QuizAnalytics.objects.filter(quiz_id=quiz_id).delete()
+        AnswerPickCount.objects.filter(quiz_id=quiz_id).delete()
+        CategoryScoreBucket.objects.filter(quiz_id=quiz_id).delete()
+        tally.save()
+    return tally.completions
+
+
+def quiz_analytics(quiz):
+    """
+    Returns the aggregates of a compiled quiz or a quiz id, read from the aggregate tables only, formatted:
+    {'completions': count, 'bucket_starts': [score], 'categories': [{'average': score, 'histogram': [count], ...}],
+     'questions': [{'answers': [{'picks': count, ...}], 'most_picked': answer_id, ...}], ...}
+    """
+    if not hasattr(quiz, 'version'):
+        quiz = get_quiz_tree(quiz)
+    low, high = get_score_range()
+    completions = QuizAnalytics.objects.filter(quiz_id=quiz.id).values_list('completions', flat=True).first()
+    picks = dict(AnswerPickCount.objects.filter(quiz_id=quiz.id).values_list('answer_id', 'picks'))
+    histograms = defaultdict(lambda: [0] * QUIZ_ANALYTICS_BINS)
+    score_sums = defaultdict(float)
+    for category_id, bucket, responses, score_sum in CategoryScoreBucket.objects.filter(
+            quiz_id=quiz.id).values_list('category_id', 'bucket', 'responses', 'score_sum'):
+        if bucket < QUIZ_ANALYTICS_BINS:
+            histograms[category_id][bucket] += responses
+        score_sums[category_id] += score_sum
+
+    categories = []
+    for category in quiz.categories:
+        responses = sum(histograms[category.id])
+        categories.append({
+            'id': category.id,
+            'name': category.name,
+            'responses': responses,
+            'average': round(score_sums[category.id] / responses, 2) if responses else None,
+            'histogram': histograms[category.id],
+        })
+    questions = []
+    for question in quiz.questions:
+        answers = [{'id': answer.id, 'text': answer.text, 'picks': picks.get(answer.id, 0)}
+                   for answer in question.answers]
+        most_picked = max(answers, key=lambda answer: answer['picks'], default=None)
+        questions.append({
+            'id': question.id,
+            'text': question.text,
+            'category_id': question.category_id,
+            'answers': answers,
+            'most_picked': most_picked['id'] if most_picked and most_picked['picks'] else None,
+        })
+    return {
+        'quiz': {'id': quiz.id, 'name': quiz.name},
+        'completions': completions or 0,
+        'score_range': [low, high],
+        'bins': QUIZ_ANALYTICS_BINS,
+        # Lowest score of every histogram bucket
+        'bucket_starts': [round(low + (high - low) * bucket / QUIZ_ANALYTICS_BINS, 2)
+                          for bucket in range(QUIZ_ANALYTICS_BINS)],
+        'categories': categories,
+        'questions': questions,
+    }
@@ -0,0 +1,109 @@
+import json
+from urllib.parse import urlencode
+from django.http import JsonResponse
+from django.urls import reverse
+from django.views.decorators.csrf import ensure_csrf_cookie
+from django.views.decorators.http import condition, require_GET, require_POST
+from .compiled import get_quiz_tree_or_404
+from .progress import QuizProgress
+from .scoring import get_scorer
+from .views import store_finished_response
+
+# A JSON API to take a quiz in two requests instead of two per question:
+#   GET  /quizzes/api/<quiz_id>/         the whole compiled quiz, without answer weights or feedback
+#   POST /quizzes/api/<quiz_id>/submit/  {"answers": {"<question_id>": <answer_id>, ...}} with every question
+# The submission is scored in one pass and stored as a finalized UserResponse, no session is involved.
+# The submit_url of the quiz pins the version that was sent, so it can still be submitted after an edit.
+# With QUIZ_WRITE_BEHIND the response goes through the write-behind buffer like any finished quiz.
+# Submissions are CSRF protected like the forms of the per-question pages, which stay as the fallback:
+# the quiz GET sets the csrftoken cookie, send it back in the X-CSRFToken header.
+
+
+def quiz_json(quiz):
+    """The parts of a compiled quiz a participant gets to see"""
+    return {
+        'id': quiz.id,
+        'name': quiz.name,
+        'description': quiz.description,
+        'version': quiz.version,
+        'categories': [{
+            'id': category.id,
+            'name': category.name,
+            'description': category.description,
+            'questions': [{
+                'id': question.id,
+                'text': question.text,
+                'answers': [{'id': answer.id, 'text': answer.text} for answer in question.answers],
+            } for question in category.questions],
+        } for category in quiz.categories],
+        'submit_url': reverse('quizzes:submit_quiz_api', args=(quiz.id,)) + '?' + urlencode({'version': quiz.version}),
+    }
+
+
+def quiz_api_etag(request, quiz_id):
+    return get_quiz_tree_or_404(quiz_id).version
+
+
+@require_GET
+@ensure_csrf_cookie
+@condition(etag_func=quiz_api_etag)
+def quiz_api(request, quiz_id):
+    """
+    Returns the whole quiz as JSON, with the version of the compiled quiz as ETag
+    """
+    return JsonResponse(quiz_json(get_quiz_tree_or_404(quiz_id)))
+
+
+def parse_submission(request, quiz):
+    """
+    Returns the QuizProgress of a submission with an answer to every question of the quiz,
+    or a dictionary of what is wrong with it
+    """
+    try:
+        answers = json.loads(request.body.decode('utf-8'))['answers']
+        if not isinstance(answers, dict):
+            raise TypeError
+    except (UnicodeDecodeError, ValueError, TypeError, KeyError):
+        return {'error': 'The body must be a JSON object with the answers as {"<question_id>": <answer_id>}'}
+
+    progress = QuizProgress(quiz, None)
+    unknown = []
+    for question_id, answer_id in answers.items():
+        try:
+            question = quiz.get_question(int(question_id))
+            answer = question.get_answer(int(answer_id)) if question is not None else None
+        except (ValueError, TypeError):
+            answer = None
+        if answer is None:
+            unknown.append(question_id)
+        else:
+            progress.select(question, answer)
+    missing = [question.id for question, answer_id in zip(quiz.questions, progress.answers) if not answer_id]
+    if unknown or missing:
+        return {
+            'error': 'Every question needs one of its answers',
+            'unknown_questions': unknown,
+            'missing_questions': missing,
+        }
+    return progress
+
+
+@require_POST
+def submit_quiz_api(request, quiz_id):
+    """
+    Scores a submission with every answer of a quiz and stores it as a finalized UserResponse.
+    Returns the scores and the feedback urls of the response, with status 201
+    """
+    quiz = get_quiz_tree_or_404(quiz_id, request.GET.get('version'))
+    progress = parse_submission(request, quiz)
+    if not isinstance(progress, QuizProgress):
+        return JsonResponse(progress, status=400)
+
+    response_data = progress.response_data(get_scorer(quiz))
+    response_id = store_finished_response(quiz.id, None, response_data)
+    return JsonResponse({
+        'response_id': response_id,
+        'scores': response_data['quiz_norm_scores'],
+        'feedback_url': reverse('quizzes:feedback', args=(response_id,)),
+        'pdf_url': reverse('quizzes:get_feedback_pdf', args=(response_id,)),
+    }, status=201)
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class QuizzesConfig(AppConfig):
     name = 'quizzes'
+
+    def ready(self):
+        # Keeps the compiled quiz trees in step with admin edits
+        from . import signals  # noqa: F401
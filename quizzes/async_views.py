@@ -0,0 +1,161 @@
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse, HttpResponseRedirect
+from django.shortcuts import get_object_or_404, render
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from .models import Quiz, UserResponse
+from .compiled import get_quiz_tree_or_404
+from .progress import progress_backend
+from .pdfs import queue_feedback_pdf
+from .writebehind import pending_response, write_behind_enabled
+from . import views
+
+# Native async versions of the quiz-taking and feedback views, routed in place of the views module when
+# QUIZ_ASYNC_VIEWS is enabled and the project is served over ASGI (ExampleProject/asgi.py).
+# The views run on the event loop, so a request waiting on a slow client holds a coroutine, not a worker thread.
+#
+# Django 3 has no async ORM, session or cache API yet. Database, session and cache access is gathered into
+# as few sync_to_async calls per request as possible, pages of the compiled quiz are rendered on the loop.
+# Finalizing a response and rendering its pdf run in threads and, with the 'process' runner, in the pdf
+# worker processes, see the pdfs module.
+
+
+aget_quiz_tree_or_404 = sync_to_async(get_quiz_tree_or_404)
+
+# Reading the progress loads the whole session, or the snapshot of the quiz version it is pinned to,
+# later reads and writes stay in memory
+aget_session_data = sync_to_async(views.get_session_data)
+
+
+@sync_to_async
+def render_from_database(request, template_name, context):
+    """Renders a template whose context reads related objects lazily, in the database thread"""
+    return render(request, template_name, context)
+
+
+async def index(request):
+    """Async version of views.IndexView"""
+    latest_quiz_list = await sync_to_async(list)(Quiz.objects.filter(active_quiz=True).order_by('-pub_date')[:5])
+    return await render_from_database(request, 'quizzes/index.html', {'latest_quiz_list': latest_quiz_list})
+
+
+async def quiz_detail(request, pk):
+    """Async version of views.QuizDetailView"""
+    quiz = await sync_to_async(get_object_or_404)(Quiz, pk=pk, active_quiz=True)
+    return await render_from_database(request, 'quizzes/quiz_detail.html', {'quiz': quiz, 'object': quiz})
+
+
+async def take_quiz(request, quiz_id, category_id, question_id):
+    """Async version of views.take_quiz, the page is rendered from the compiled quiz on the event loop"""
+    quiz = await aget_quiz_tree_or_404(quiz_id, request.GET.get('v'))
+    question = quiz.get_question(question_id)
+    if question is None:
+        raise Http404('No Question matches the given query.')
+    return render(request, 'quizzes/take_quiz.html', {
+        'quiz': quiz, 'category': category_id, 'question': question,
+        'progress_token': request.GET.get('progress'),
+    })
+
+
+async def select_answer(request, quiz_id, category_id, question_id):
+    """Async version of views.select_answer"""
+    quiz, progress = await aget_session_data(request, quiz_id)
+    question = quiz.get_question(question_id)
+    if question is None:
+        raise Http404('No Question matches the given query.')
+
+    try:  # Check if an answer is selected
+        selected_answer = question.get_answer(int(request.POST['answer']))
+    except (KeyError, ValueError):
+        selected_answer = None
+    if selected_answer is None:
+        return render(request, 'quizzes/take_quiz.html', {
+            'quiz': quiz,
+            'question': question,
+            'error_message': "You didn't select an answer.",
+            'progress_token': request.POST.get('progress'),
+        })
+
+    progress.select(question, selected_answer)
+    if progress_backend() == 'session':
+        progress.save(request.session)
+
+    next_question = quiz.next_question(question)
+    if next_question is None:
+        response_id = await sync_to_async(views.finish_quiz)(request, quiz, progress)
+        return HttpResponseRedirect(reverse('quizzes:feedback', args=(response_id,)))
+    return HttpResponseRedirect(views.take_quiz_url(quiz, next_question, progress))
+
+
+@sync_to_async
+def load_feedback_validators(request, user_id):
+    if progress_backend() == 'session':
+        request.session.set_expiry(1)
+    return views.finished_response_validators(user_id)
+
+
+async def feedback(request, user_id):
+    """Async version of views.feedback"""
+    if write_behind_enabled():
+        response = await sync_to_async(views.pending_feedback_response)(user_id)
+        if response is not None:
+            return response
+    try:
+        response_pk, updated_at = await load_feedback_validators(request, user_id)
+    except Http404:
+        response = await sync_to_async(views.unwritten_feedback_response)(request, user_id)
+        if response is None:
+            raise
+        return response
+    etag, last_modified = views.feedback_validators(user_id, updated_at)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        return response
+    page = await sync_to_async(views.feedback_page)(response_pk, updated_at, user_id)
+    return views.feedback_page_response(page, etag, last_modified)
+
+
+@sync_to_async
+def load_feedback_pdf(user_id):
+    """
+    Returns the finalized UserResponse of `user_id`, queueing its pdf when it has none yet,
+    or None while the response waits in the write-behind buffer.
+    With the 'sync' runner the pdf is rendered here, in the database thread.
+    """
+    if pending_response(user_id) is not None:
+        return None
+    user = UserResponse.objects.filter(response_id=user_id).first()
+    if user is None or not user.is_finalized():
+        if views.response_unwritten(user_id, user is not None):
+            return None
+        raise Http404('This quiz was not finished.')
+    if not user.feedback_pdf and not user.feedback_pdf_failed:
+        queue_feedback_pdf(user.pk)
+        user.refresh_from_db(fields=['feedback_pdf', 'feedback_pdf_hash', 'feedback_pdf_failed'])
+    return user
+
+
+@sync_to_async(thread_sensitive=False)
+def read_feedback_pdf(user):
+    with user.feedback_pdf.open('rb') as pdf_file:
+        return pdf_file.read()
+
+
+async def get_feedback_pdf(request, user_id):
+    """
+    Async version of views.get_feedback_pdf. The stored pdf is read in a thread of its own
+    and sent from memory, feedback pdfs are a few dozen KiB.
+    """
+    user = await load_feedback_pdf(user_id)
+    if user is not None and user.feedback_pdf_failed:
+        return views.feedback_pdf_failed(request, user_id)
+    if user is None or not user.feedback_pdf:
+        return views.feedback_pdf_pending(request, user_id)
+
+    etag = quote_etag(user.feedback_pdf_hash)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(await read_feedback_pdf(user), content_type='application/pdf')
+    response['ETag'] = etag
+    return response
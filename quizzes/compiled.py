@@ -0,0 +1,375 @@
+import functools
+import hashlib
+import json
+import re
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+from typing import NamedTuple, Optional, Tuple
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef
+from django.http import Http404
+from django.utils import timezone
+from .models import Quiz, Category, Question, Answer, Feedback, QuizSnapshot
+
+
+# The quiz-taking views read quizzes through a compiled, immutable copy of the quiz tree instead of
+# querying Quiz, Category, Question and Answer rows on every page. A compiled quiz is built once per
+# quiz version and kept both in Django's cache framework (shared by every process) and in a small
+# in-process LRU.
+#
+# Every version is published as a QuizSnapshot row holding the serialized tree, numbered per quiz and
+# named '<number>.<start of the sha256 of the content>'. Quizzes are only published by the code that changes
+# them: the importer publishes in its own transaction, and the model signals publish the quiz once the
+# transaction that changed it commits, once per quiz. Publishing reuses the latest snapshot when nothing in it
+# changed. Reading a quiz never writes: the current version is the latest snapshot, cached along with the
+# publish generation it was read in. Publishing bumps the generation, so a version a reader cached from before
+# the publish never becomes current. Versions never change content, so takers pin the version they started on
+# (see the progress module) and finish on it even after the quiz was edited or uploaded again, and
+# anything derived from a compiled quiz can be cached by version without invalidation.
+# Superseded snapshots are deleted by `manage.py collect_quiz_snapshots` after QUIZ_SNAPSHOT_RETENTION.
+
+QUIZ_TREE_CACHE = getattr(settings, 'QUIZ_TREE_CACHE', 'default')
+QUIZ_TREE_TIMEOUT = getattr(settings, 'QUIZ_TREE_TIMEOUT', 60 * 60 * 24)
+QUIZ_TREE_LRU_SIZE = getattr(settings, 'QUIZ_TREE_LRU_SIZE', 64)
+
+# Seconds a superseded snapshot is kept for the takers pinned to it, as long as progress can live
+QUIZ_SNAPSHOT_RETENTION = getattr(settings, 'QUIZ_SNAPSHOT_RETENTION', 60 * 60 * 24 * 14)
+
+# Attempts at numbering a new snapshot while other processes publish the same quiz
+SNAPSHOT_ATTEMPTS = 5
+
+VERSION_RE = re.compile(r'^(\d+)\.([0-9a-f]{12})$')
+
+# Depth of the quiz_signals_muted blocks running in this thread
+_muted = threading.local()
+
+
+class CompiledAnswer(NamedTuple):
+    id: int
+    text: str
+    weight: float
+    feedback: Optional[str]
+
+
+class CompiledQuestion(NamedTuple):
+    id: int
+    text: str
+    category_id: int
+    answers: Tuple[CompiledAnswer, ...]
+
+    def get_answer(self, answer_id):
+        for answer in self.answers:
+            if answer.id == answer_id:
+                return answer
+        return None
+
+
+class CompiledCategory(NamedTuple):
+    id: int
+    name: str
+    description: Optional[str]
+    questions: Tuple[CompiledQuestion, ...]
+
+
+class CompiledQuiz(NamedTuple):
+    """
+    Read-only copy of a quiz and everything in it.
+    Questions are in quiz order: grouped by category, categories in the order they were created.
+    """
+    id: int
+    name: str
+    description: Optional[str]
+    active_quiz: bool
+    version: str
+    categories: Tuple[CompiledCategory, ...]
+    questions: Tuple[CompiledQuestion, ...]
+    # {question_id: position in questions}
+    question_index: dict
+    # {category_id: position in categories}
+    category_index: dict
+
+    def get_category(self, category_id):
+        index = self.category_index.get(category_id)
+        return None if index is None else self.categories[index]
+
+    def get_question(self, question_id):
+        index = self.question_index.get(question_id)
+        return None if index is None else self.questions[index]
+
+    def next_question(self, question):
+        """Returns the question after `question`, or None on the last question"""
+        index = self.question_index[question.id] + 1
+        return self.questions[index] if index < len(self.questions) else None
+
+
+def build_quiz_tree(quiz_id, version=''):
+    """
+    Builds the CompiledQuiz for a quiz with one query per level.
+    Children are reached through their parent links, so rows created in the admin without
+    a parent_quiz are included too.
+    """
+    quiz = Quiz.objects.get(pk=quiz_id)
+    feedback = {}
+    for answer_id, feedback_text in Feedback.objects.filter(
+            parent_answer__parent_question__parent_category__parent_quiz=quiz).order_by('-id').values_list(
+            'parent_answer_id', 'feedback_text'):
+        feedback[answer_id] = feedback_text
+
+    answers = {}
+    for answer_id, question_id, answer_text, answer_weight in Answer.objects.filter(
+            parent_question__parent_category__parent_quiz=quiz).order_by('id').values_list(
+            'id', 'parent_question_id', 'answer_text', 'answer_weight'):
+        answers.setdefault(question_id, []).append(
+            CompiledAnswer(answer_id, answer_text, answer_weight, feedback.get(answer_id)))
+
+    questions = {}
+    for question_id, category_id, question_text in Question.objects.filter(
+            parent_category__parent_quiz=quiz).order_by('id').values_list(
+            'id', 'parent_category_id', 'question_text'):
+        questions.setdefault(category_id, []).append(
+            CompiledQuestion(question_id, question_text, category_id, tuple(answers.get(question_id, ()))))
+
+    categories = tuple(
+        CompiledCategory(category_id, category_name, description, tuple(questions.get(category_id, ())))
+        for category_id, category_name, description in Category.objects.filter(parent_quiz=quiz).order_by(
+            'id').values_list('id', 'category_name', 'description')
+    )
+    return compile_quiz(quiz.id, quiz.name, quiz.description, quiz.active_quiz, version, categories)
+
+
+def compile_quiz(quiz_id, name, description, active_quiz, version, categories):
+    ordered_questions = tuple(question for category in categories for question in category.questions)
+    return CompiledQuiz(
+        id=quiz_id,
+        name=name,
+        description=description,
+        active_quiz=active_quiz,
+        version=version,
+        categories=categories,
+        questions=ordered_questions,
+        question_index={question.id: i for i, question in enumerate(ordered_questions)},
+        category_index={category.id: i for i, category in enumerate(categories)},
+    )
+
+
+def serialize_quiz_tree(tree):
+    """The content of a snapshot: everything in a compiled quiz but its version, as JSON"""
+    return json.dumps([tree.id, tree.name, tree.description, tree.active_quiz, tree.categories],
+                      separators=(',', ':'))
+
+
+def deserialize_quiz_tree(content, version):
+    quiz_id, name, description, active_quiz, categories = json.loads(content)
+    return compile_quiz(quiz_id, name, description, active_quiz, version, tuple(
+        CompiledCategory(category_id, category_name, category_description, tuple(
+            CompiledQuestion(question_id, text, question_category_id,
+                             tuple(CompiledAnswer(*answer) for answer in answers))
+            for question_id, text, question_category_id, answers in questions))
+        for category_id, category_name, category_description, questions in categories))
+
+
+def snapshot_version(number, content_hash):
+    return '%d.%s' % (number, content_hash[:12])
+
+
+def tree_cache():
+    return caches[QUIZ_TREE_CACHE]
+
+
+def version_key(quiz_id):
+    return 'quizzes:tree_version:%s' % quiz_id
+
+
+def tree_key(quiz_id, version):
+    return 'quizzes:tree:%s:%s' % (quiz_id, version)
+
+
+def generation_key(quiz_id):
+    return 'quizzes:tree_generation:%s' % quiz_id
+
+
+def publish_quiz(quiz_id):
+    """
+    Builds the CompiledQuiz of a quiz from the database and stores it as a new snapshot, unless the latest one has
+    the same content. The snapshot becomes the current version once the transaction commits.
+    Raises Quiz.DoesNotExist for unknown quizzes.
+    """
+    # The quiz row is locked until the snapshot is stored, so snapshots are numbered in the order the states of
+    # the quiz they were built from were committed, and the latest one is always the current state
+    with transaction.atomic():
+        Quiz.objects.select_for_update().filter(pk=quiz_id).values_list('pk').get()
+        tree = build_quiz_tree(quiz_id)
+        content = serialize_quiz_tree(tree)
+        content_hash = hashlib.sha256(content.encode('utf-8')).hexdigest()
+        for attempt in range(SNAPSHOT_ATTEMPTS):
+            latest = latest_snapshot(quiz_id)
+            if latest is not None and latest[1] == content_hash:
+                number = latest[0]
+                break
+            number = latest[0] + 1 if latest is not None else 1
+            try:
+                with transaction.atomic():
+                    QuizSnapshot.objects.create(quiz_id=quiz_id, number=number, content_hash=content_hash,
+                                                content=content)
+                break
+            except IntegrityError:
+                # Another process took the number first, on backends that don't lock the row
+                if attempt == SNAPSHOT_ATTEMPTS - 1:
+                    raise
+    tree = tree._replace(version=snapshot_version(number, content_hash))
+    cache = tree_cache()
+    cache.set(tree_key(quiz_id, tree.version), tree, QUIZ_TREE_TIMEOUT)
+    # Readers go back to the latest snapshot until the commit, so one is read even when this process never gets
+    # to make it current
+    cache.delete(version_key(quiz_id))
+    transaction.on_commit(lambda: make_current(quiz_id, tree.version))
+    return tree
+
+
+def make_current(quiz_id, version):
+    """Bumps the publish generation of a quiz, so versions cached before are read again, and caches `version`"""
+    cache = tree_cache()
+    try:
+        generation = cache.incr(generation_key(quiz_id))
+    except ValueError:  # Never published since the cache was cleared
+        if cache.add(generation_key(quiz_id), 1, None):
+            generation = 1
+        else:
+            generation = cache.incr(generation_key(quiz_id))
+    cache.set(version_key(quiz_id), (generation, version), None)
+
+
+def latest_snapshot(quiz_id):
+    """(number, content_hash) of the latest snapshot of a quiz, None when it was never published"""
+    return QuizSnapshot.objects.filter(quiz_id=quiz_id).order_by('-number').values_list(
+        'number', 'content_hash').first()
+
+
+def get_quiz_version(quiz_id):
+    """
+    The version of the current snapshot of a quiz, from the cache or else from the latest snapshot.
+    None for a quiz that was never published
+    """
+    cache = tree_cache()
+    values = cache.get_many([version_key(quiz_id), generation_key(quiz_id)])
+    generation = values.get(generation_key(quiz_id), 0)
+    current = values.get(version_key(quiz_id))
+    if current is not None and current[0] == generation:
+        return current[1]
+    latest = latest_snapshot(quiz_id)
+    if latest is None:
+        return None
+    version = snapshot_version(*latest)
+    # Stored under the generation it was read in, a publish in the meantime bumped it
+    cache.set(version_key(quiz_id), (generation, version), None)
+    return version
+
+
+@functools.lru_cache(maxsize=QUIZ_TREE_LRU_SIZE)
+def load_quiz_tree(quiz_id, version):
+    """
+    Returns a version of a compiled quiz from the cache, or from its snapshot.
+    Raises QuizSnapshot.DoesNotExist for versions that don't exist (anymore).
+    """
+    cache = tree_cache()
+    tree = cache.get(tree_key(quiz_id, version))
+    if tree is None:
+        match = VERSION_RE.match(version)
+        if match is None:
+            raise QuizSnapshot.DoesNotExist('%r is not a quiz version' % version)
+        content_hash, content = QuizSnapshot.objects.filter(quiz_id=quiz_id, number=int(match.group(1))).values_list(
+            'content_hash', 'content').get()
+        if not content_hash.startswith(match.group(2)):
+            raise QuizSnapshot.DoesNotExist('Quiz %s has no version %s' % (quiz_id, version))
+        tree = deserialize_quiz_tree(content, version)
+        cache.set(tree_key(quiz_id, version), tree, QUIZ_TREE_TIMEOUT)
+    return tree
+
+
+def get_quiz_tree(quiz_id, version=None):
+    """
+    Returns the CompiledQuiz for a quiz, read from the cache or from its current snapshot.
+    With a `version` that snapshot of the quiz is returned instead, or the current one when there is no
+    such snapshot (anymore).
+    Raises Quiz.DoesNotExist for unknown quizzes.
+    """
+    current = get_quiz_version(quiz_id)
+    if current is None:
+        # Never published, as with quizzes created before there were snapshots (see `manage.py publish_quizzes`).
+        # Built for this request only, without a version to pin
+        return build_quiz_tree(quiz_id)
+    if version and version != current:
+        try:
+            return load_quiz_tree(quiz_id, version)
+        except QuizSnapshot.DoesNotExist:
+            pass
+    try:
+        return load_quiz_tree(quiz_id, current)
+    except QuizSnapshot.DoesNotExist:
+        # The snapshot went away under a cached version, the latest one is read again
+        tree_cache().delete(version_key(quiz_id))
+        return get_quiz_tree(quiz_id)
+
+
+def get_quiz_tree_or_404(quiz_id, version=None):
+    try:
+        return get_quiz_tree(quiz_id, version)
+    except Quiz.DoesNotExist:
+        raise Http404('No Quiz matches the given query.')
+
+
+class PublishOnCommit:
+    """on_commit callback publishing a quiz, told apart from the others so a quiz is published once per commit"""
+
+    def __init__(self, quiz_id):
+        self.quiz_id = quiz_id
+
+    def __call__(self):
+        try:
+            publish_quiz(self.quiz_id)
+        except Quiz.DoesNotExist:  # Deleted by the transaction
+            pass
+
+
+def invalidate_quiz_tree(quiz_id):
+    """
+    Publishes a quiz once the current transaction commits, or right away outside of one.
+    Changes to several rows of a quiz in one transaction publish it once.
+    """
+    connection = transaction.get_connection()
+    if connection.in_atomic_block and any(isinstance(callback, PublishOnCommit) and callback.quiz_id == quiz_id
+                                          for sids, callback in connection.run_on_commit):
+        return
+    transaction.on_commit(PublishOnCommit(quiz_id))
+
+
+@contextmanager
+def quiz_signals_muted():
+    """
+    Mutes the invalidation the model signals send for every saved or deleted row (see signals.quiz_changed)
+    in this thread, for writers that publish the quiz once for all of their changes.
+    """
+    _muted.depth = getattr(_muted, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        _muted.depth -= 1
+
+
+def quiz_signals_are_muted():
+    return getattr(_muted, 'depth', 0) > 0
+
+
+def collect_snapshots(retention=QUIZ_SNAPSHOT_RETENTION):
+    """
+    Deletes the snapshots superseded more than `retention` seconds ago, every taker pinned to them
+    has run out of time by then. Returns the number of snapshots deleted
+    """
+    cutoff = timezone.now() - timedelta(seconds=retention)
+    superseded = QuizSnapshot.objects.filter(quiz_id=OuterRef('quiz_id'), number__gt=OuterRef('number'),
+                                             created__lt=cutoff)
+    deleted, per_model = QuizSnapshot.objects.filter(Exists(superseded)).delete()
+    return deleted
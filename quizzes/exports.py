@@ -0,0 +1,169 @@
+import csv
+from itertools import groupby
+from operator import itemgetter
+from .models import ResponseAnswer, ResponseCategoryScore, UserResponse
+from .utils import iter_batches
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # Only CSV exports are available
+    pyarrow = None
+
+# Streamed exports of the finalized responses of a quiz, read from the selection tables (see the selections
+# module) with iterator(), so memory stays the same whatever the number of responses. Two layouts:
+#   responses  one row per response: its scores per category, then its answer to every question
+#   answers    one row per (response, question)
+# as CSV or, with pyarrow installed (the 'export' extra), as Parquet written one row group at a time.
+# Responses finalized before the selection tables existed need `manage.py build_response_tables` first.
+
+EXPORT_LAYOUTS = ('responses', 'answers')
+EXPORT_FORMATS = ('csv', 'parquet')
+CONTENT_TYPES = {'csv': 'text/csv', 'parquet': 'application/vnd.apache.parquet'}
+
+# Rows per CSV chunk and per Parquet row group
+EXPORT_BATCH_SIZE = 2000
+
+
+def export_formats():
+    """The export formats available in this installation"""
+    return EXPORT_FORMATS if pyarrow is not None else ('csv',)
+
+
+def export_columns(quiz, layout):
+    """
+    Returns (name, type) of the columns of an export of a compiled quiz.
+    Types are 'int', 'float', 'str' or 'time'
+    """
+    if layout == 'answers':
+        return [('response_id', 'int'), ('updated_at', 'time'), ('category', 'str'), ('question_id', 'int'),
+                ('question', 'str'), ('answer_id', 'int'), ('answer', 'str'), ('weight', 'float')]
+    categories = {category.id: category.name for category in quiz.categories}
+    return ([('response_id', 'int'), ('updated_at', 'time')] +
+            [('%s score' % category.name, 'float') for category in quiz.categories] +
+            [('%s / %s' % (categories[question.category_id], question.text), 'str') for question in quiz.questions])
+
+
+class ResponseGroups:
+    """The rows of an iterator ordered by response pk, handed out one response at a time"""
+
+    def __init__(self, rows):
+        self.groups = groupby(rows, key=itemgetter(0))
+        self.current = next(self.groups, None)
+
+    def pop(self, pk):
+        """Returns the rows of response `pk`, skipping the rows of responses before it"""
+        while self.current is not None and self.current[0] < pk:
+            self.current = next(self.groups, None)
+        if self.current is None or self.current[0] != pk:
+            return []
+        rows = list(self.current[1])
+        self.current = next(self.groups, None)
+        return rows
+
+
+def iter_export_rows(quiz, layout, chunk_size=EXPORT_BATCH_SIZE):
+    """Yields the rows of an export of a compiled quiz, in the order of export_columns"""
+    if layout == 'answers':
+        categories = {category.id: category.name for category in quiz.categories}
+        rows = ResponseAnswer.objects.filter(quiz_id=quiz.id).order_by('response_id', 'id').values_list(
+            'response__response_id', 'response__updated_at', 'question_id', 'answer_id', 'weight'
+        ).iterator(chunk_size=chunk_size)
+        for response_id, updated_at, question_id, answer_id, weight in rows:
+            question = quiz.get_question(question_id)
+            answer = question.get_answer(answer_id) if question is not None else None
+            yield [response_id, updated_at, categories[question.category_id] if question is not None else None,
+                   question_id, question.text if question is not None else None, answer_id,
+                   answer.text if answer is not None else None, weight]
+        return
+
+    # The responses and their answers and scores are read side by side, each ordered by response
+    responses = UserResponse.objects.filter(parent_quiz_id=quiz.id, response_data__isnull=False).order_by(
+        'id').values_list('id', 'response_id', 'updated_at').iterator(chunk_size=chunk_size)
+    answers = ResponseGroups(ResponseAnswer.objects.filter(quiz_id=quiz.id).order_by('response_id').values_list(
+        'response_id', 'question_id', 'answer_id').iterator(chunk_size=chunk_size))
+    scores = ResponseGroups(ResponseCategoryScore.objects.filter(quiz_id=quiz.id).order_by(
+        'response_id').values_list('response_id', 'category_id', 'score').iterator(chunk_size=chunk_size))
+    for pk, response_id, updated_at in responses:
+        response_answers = {question_id: answer_id for row_pk, question_id, answer_id in answers.pop(pk)}
+        response_scores = {category_id: score for row_pk, category_id, score in scores.pop(pk)}
+        row = [response_id, updated_at]
+        row.extend(response_scores.get(category.id) for category in quiz.categories)
+        for question in quiz.questions:
+            answer = question.get_answer(response_answers.get(question.id))
+            row.append(answer.text if answer is not None else None)
+        yield row
+
+
+class Echo:
+    """A file that hands back what is written to it, for csv.writer"""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(columns, rows):
+    """Yields the header and then the rows as CSV, EXPORT_BATCH_SIZE rows per chunk"""
+    writer = csv.writer(Echo())
+    yield writer.writerow([name for name, column_type in columns])
+    for batch in iter_batches(rows, EXPORT_BATCH_SIZE):
+        yield ''.join(writer.writerow(row) for row in batch)
+
+
+class ChunkSink:
+    """A write-only file whose contents are taken out as they are streamed"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def parquet_schema(columns):
+    types = {'int': pyarrow.int64(), 'float': pyarrow.float64(), 'str': pyarrow.string(),
+             'time': pyarrow.timestamp('us', tz='UTC')}
+    return pyarrow.schema([(name, types[column_type]) for name, column_type in columns])
+
+
+def stream_parquet(columns, rows):
+    """Yields the rows as a Parquet file, one row group of EXPORT_BATCH_SIZE rows at a time"""
+    schema = parquet_schema(columns)
+    sink = ChunkSink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema)
+    try:
+        for batch in iter_batches(rows, EXPORT_BATCH_SIZE):
+            writer.write_table(pyarrow.Table.from_arrays(
+                [pyarrow.array(values, type=field.type) for values, field in zip(zip(*batch), schema)],
+                schema=schema))
+            yield sink.take()
+    finally:
+        writer.close()
+    yield sink.take()
+
+
+def stream_export(quiz, layout, export_format):
+    """Yields the chunks of an export of a compiled quiz"""
+    columns = export_columns(quiz, layout)
+    rows = iter_export_rows(quiz, layout)
+    if export_format == 'parquet':
+        return stream_parquet(columns, rows)
+    return stream_csv(columns, rows)
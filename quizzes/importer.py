@@ -0,0 +1,312 @@
+import codecs
+import csv
+import datetime
+from collections import OrderedDict
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+from .compiled import publish_quiz, quiz_signals_muted
+from .models import Quiz, Category, Question, Answer, Feedback
+from .utils import ID_BATCH_SIZE, iter_batches
+
+
+# The CSV import runs in three steps: the whole file is parsed and validated first,
+# the parsed tree is then diffed against the quiz already in the database, and the
+# differences are written with bulk queries inside one transaction. A bad row
+# anywhere in the file leaves the stored quiz exactly as it was.
+
+CSV_DELIMITER = ','
+CSV_QUOTECHAR = '|'
+
+# Rows are handed from the CSV reader to the importer this many at a time
+IMPORT_BATCH_SIZE = getattr(settings, 'QUIZ_IMPORT_BATCH_SIZE', 1000)
+
+
+class QuizImportError(ValueError):
+    """Raised when an uploaded quiz CSV is not formatted correctly"""
+
+
+def quiz_csv_reader(lines):
+    return csv.reader(lines, delimiter=CSV_DELIMITER, quotechar=CSV_QUOTECHAR)
+
+
+def iter_upload_lines(uploaded_file, chunk_size=None, encoding='utf-8-sig'):
+    """
+    Yields the text lines of an uploaded file, reading it chunk by chunk through an incremental decoder
+    so the file is never held in memory as a whole. Works the same for in-memory and disk-spooled uploads.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    pending = ''
+    for chunk in uploaded_file.chunks(chunk_size):
+        lines = (pending + decoder.decode(chunk)).split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line + '\n'
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+
+def parse_pub_date(value):
+    """
+    Parses the pub_date of the CSV header. The full datetime format '%Y-%m-%d %H:%M:%S.%f' is tried first,
+    anything else is left to the model field, which also accepts a plain YYYY-MM-DD date.
+    """
+    try:
+        pub_date = datetime.datetime.strptime(value, '%Y-%m-%d %H:%M:%S.%f')
+    except ValueError:
+        try:
+            pub_date = Quiz._meta.get_field('pub_date').to_python(value)
+        except ValidationError:
+            pub_date = None
+    if pub_date is None:
+        raise QuizImportError("Line 1: '%s' is not a valid date" % value)
+    if timezone.is_naive(pub_date):
+        pub_date = timezone.make_aware(pub_date)
+    return pub_date
+
+
+def check_length(model, field_name, value, line_num):
+    max_length = model._meta.get_field(field_name).max_length
+    if len(value) > max_length:
+        raise QuizImportError('Line %d: %s is longer than %d characters' % (line_num, field_name, max_length))
+    return value
+
+
+class QuizImporter:
+    """
+    Builds or updates a quiz from the rows of a quiz CSV.
+
+    Rows are parsed into an ordered tree of
+    {category_name: {question_text: {answer_text: (answer_weight, feedback_text)}}}
+    by add_rows(), and save() writes that tree to the database.
+    """
+
+    def __init__(self, header):
+        if len(header) < 3:
+            raise QuizImportError('Line 1: the header should be Quiz name, pub_date, description')
+        self.name = check_length(Quiz, 'name', header[0], 1)
+        self.pub_date = parse_pub_date(header[1])
+        self.description = check_length(Quiz, 'description', header[2], 1)
+        self.tree = OrderedDict()
+        self.line_num = 1
+        self.quiz = None
+
+    def add_rows(self, rows):
+        """Parses and validates CSV rows, adding them to the quiz tree"""
+        for row in rows:
+            self.line_num += 1
+            if not any(row):
+                continue
+            if len(row) < 6:
+                raise QuizImportError('Line %d: expected 6 columns but found %d' % (self.line_num, len(row)))
+            try:
+                answer_weight = float(row[4])
+            except ValueError:
+                raise QuizImportError("Line %d: answer weight '%s' is not a number" % (self.line_num, row[4]))
+            category_name = check_length(Category, 'category_name', row[1], self.line_num)
+            question_text = check_length(Question, 'question_text', row[2], self.line_num)
+            answer_text = check_length(Answer, 'answer_text', row[3], self.line_num)
+            feedback_text = check_length(Feedback, 'feedback_text', row[5], self.line_num)
+            questions = self.tree.setdefault(category_name, OrderedDict())
+            answers = questions.setdefault(question_text, OrderedDict())
+            answers[answer_text] = (answer_weight, feedback_text)
+
+    @transaction.atomic
+    def save(self):
+        """
+        Creates the quiz, or diffs the parsed tree against the stored quiz when it already exists.
+        Every level is loaded with a single query, then rows are removed, created and updated in bulk.
+        """
+        # Bulk queries don't send model signals, and the deletes would send one per row, so they are muted and
+        # the quiz is published once at the end, in the same transaction
+        with quiz_signals_muted():
+            # The quiz row stays locked until the import commits, so imports of the same quiz don't interleave
+            self.quiz, created = Quiz.objects.select_for_update().get_or_create(
+                name=self.name,
+                pub_date=self.pub_date,
+                description=self.description,
+                active_quiz=True,
+            )
+            category_ids = self._save_categories()
+            question_ids = self._save_questions(category_ids)
+            answer_ids = self._save_answers(category_ids, question_ids)
+            self._save_feedback(category_ids, question_ids, answer_ids)
+        publish_quiz(self.quiz.id)
+        return self.quiz
+
+    def _save_categories(self):
+        existing = {}
+        stale = []
+        for category in Category.objects.filter(parent_quiz=self.quiz).order_by('id'):
+            if category.category_name in self.tree and category.category_name not in existing:
+                existing[category.category_name] = category
+            else:
+                stale.append(category.id)
+        delete_ids(Category, stale)
+
+        new_categories = []
+        moved_categories = []
+        for order, category_name in enumerate(self.tree):
+            category = existing.get(category_name)
+            if category is None:
+                new_categories.append(Category(parent_quiz=self.quiz, category_name=category_name,
+                                               order=order, description='', score=0))
+            elif category.order != order:
+                category.order = order
+                moved_categories.append(category)
+        Category.objects.bulk_update(moved_categories, ['order'])
+        if not new_categories:
+            return {name: category.id for name, category in existing.items()}
+        Category.objects.bulk_create(new_categories)
+        return dict(Category.objects.filter(parent_quiz=self.quiz).values_list('category_name', 'id'))
+
+    def _save_questions(self, category_ids):
+        wanted = set(
+            (category_ids[category_name], question_text)
+            for category_name, questions in self.tree.items()
+            for question_text in questions
+        )
+        existing = {}
+        stale = []
+        for question_id, category_id, question_text in (
+                Question.objects.filter(parent_quiz=self.quiz).order_by('id')
+                .values_list('id', 'parent_category_id', 'question_text')):
+            key = (category_id, question_text)
+            if key in wanted and key not in existing:
+                existing[key] = question_id
+            else:
+                stale.append(question_id)
+        delete_ids(Question, stale)
+
+        new_questions = [
+            Question(parent_quiz=self.quiz, parent_category_id=category_ids[category_name],
+                     question_text=question_text)
+            for category_name, questions in self.tree.items()
+            for question_text in questions
+            if (category_ids[category_name], question_text) not in existing
+        ]
+        if not new_questions:
+            return existing
+        Question.objects.bulk_create(new_questions)
+        return {
+            (category_id, question_text): question_id
+            for question_id, category_id, question_text in
+            Question.objects.filter(parent_quiz=self.quiz).values_list('id', 'parent_category_id', 'question_text')
+        }
+
+    def _iter_answers(self, category_ids, question_ids):
+        for category_name, questions in self.tree.items():
+            category_id = category_ids[category_name]
+            for question_text, answers in questions.items():
+                question_id = question_ids[(category_id, question_text)]
+                for answer_text, (answer_weight, feedback_text) in answers.items():
+                    yield category_id, question_id, answer_text, answer_weight, feedback_text
+
+    def _save_answers(self, category_ids, question_ids):
+        wanted = {
+            (question_id, answer_text): answer_weight
+            for category_id, question_id, answer_text, answer_weight, feedback_text
+            in self._iter_answers(category_ids, question_ids)
+        }
+        existing = {}
+        stale = []
+        reweighted = []
+        for answer in Answer.objects.filter(parent_quiz=self.quiz).order_by('id').only(
+                'id', 'parent_question_id', 'answer_text', 'answer_weight'):
+            key = (answer.parent_question_id, answer.answer_text)
+            if key in wanted and key not in existing:
+                existing[key] = answer.id
+                if answer.answer_weight != wanted[key]:
+                    answer.answer_weight = wanted[key]
+                    reweighted.append(answer)
+            else:
+                stale.append(answer.id)
+        delete_ids(Answer, stale)
+        Answer.objects.bulk_update(reweighted, ['answer_weight'])
+
+        new_answers = [
+            Answer(parent_quiz=self.quiz, parent_category_id=category_id, parent_question_id=question_id,
+                   answer_text=answer_text, answer_selected=False, answer_weight=answer_weight)
+            for category_id, question_id, answer_text, answer_weight, feedback_text
+            in self._iter_answers(category_ids, question_ids)
+            if (question_id, answer_text) not in existing
+        ]
+        if not new_answers:
+            return existing
+        Answer.objects.bulk_create(new_answers)
+        return {
+            (question_id, answer_text): answer_id
+            for answer_id, question_id, answer_text in
+            Answer.objects.filter(parent_quiz=self.quiz).values_list('id', 'parent_question_id', 'answer_text')
+        }
+
+    def _save_feedback(self, category_ids, question_ids, answer_ids):
+        wanted = {}
+        for category_id, question_id, answer_text, answer_weight, feedback_text in self._iter_answers(
+                category_ids, question_ids):
+            answer_id = answer_ids[(question_id, answer_text)]
+            wanted[answer_id] = (category_id, question_id, feedback_text)
+
+        existing = set()
+        stale = []
+        rewritten = []
+        for feedback in Feedback.objects.filter(parent_quiz=self.quiz).order_by('id').only(
+                'id', 'parent_answer_id', 'feedback_text'):
+            answer_id = feedback.parent_answer_id
+            if answer_id in wanted and answer_id not in existing:
+                existing.add(answer_id)
+                feedback_text = wanted[answer_id][2]
+                if feedback.feedback_text != feedback_text:
+                    feedback.feedback_text = feedback_text
+                    rewritten.append(feedback)
+            else:
+                stale.append(feedback.id)
+        delete_ids(Feedback, stale)
+        Feedback.objects.bulk_update(rewritten, ['feedback_text'])
+
+        Feedback.objects.bulk_create([
+            Feedback(parent_quiz=self.quiz, parent_category_id=category_id, parent_question_id=question_id,
+                     parent_answer_id=answer_id, feedback_type='', feedback_text=feedback_text)
+            for answer_id, (category_id, question_id, feedback_text) in wanted.items()
+            if answer_id not in existing
+        ])
+
+
+def delete_ids(model, ids):
+    for batch in iter_batches(ids, ID_BATCH_SIZE):
+        model.objects.filter(id__in=batch).delete()
+
+
+def read_quiz_header(reader):
+    """Returns a QuizImporter for the header line of a quiz CSV reader, without reading any further"""
+    try:
+        header = next(reader, None)
+    except csv.Error as e:
+        raise QuizImportError('Line 1: %s' % e)
+    if header is None:
+        raise QuizImportError('The file is empty')
+    return QuizImporter(header)
+
+
+def import_quiz_csv(lines, batch_size=IMPORT_BATCH_SIZE, progress=None):
+    """
+    Imports a quiz from an iterable of CSV lines, the first line being the quiz header.
+    Lines are read lazily and parsed in batches of `batch_size` rows, so passing iter_upload_lines()
+    streams the upload straight into the importer. `progress`, if given, is called with the number
+    of rows parsed so far after every batch.
+    Raises QuizImportError without writing anything if any line is malformed.
+
+    Returns the created or updated Quiz object
+    """
+    reader = quiz_csv_reader(lines)
+    importer = read_quiz_header(reader)
+    try:
+        for batch in iter_batches(reader, batch_size):
+            importer.add_rows(batch)
+            if progress is not None:
+                progress(importer.line_num - 1)
+    except csv.Error as e:
+        raise QuizImportError('Line %d: %s' % (reader.line_num, e))
+    return importer.save()
@@ -0,0 +1,209 @@
+import asyncio
+import contextvars
+import math
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from django.conf import settings
+from django.contrib.sessions.backends.base import SessionBase
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.base import Template
+
+# Opt-in per-request instrumentation of the quizzes views, enabled with QUIZ_INSTRUMENTATION = True.
+# For every request it records the number of SQL queries and the time spent in the database, the bytes
+# of session data read and written, and the time spent rendering templates and PDFs. The numbers are
+# sent back in a Server-Timing header and kept in a rolling in-process aggregate per view, the
+# instrumentation_report view shows their percentiles.
+#
+# InstrumentationMiddleware should come first in MIDDLEWARE so the session save is measured too. It works
+# in front of sync and async views alike, queries are counted on every connection of every thread.
+# When instrumentation is disabled the middleware removes itself and the hooks are never installed,
+# timer() then only checks a context variable.
+
+METRICS = ('total', 'queries', 'db', 'template', 'pdf', 'session_read', 'session_write')
+
+_current = contextvars.ContextVar('quizzes_request_metrics', default=None)
+_hooks_installed = False
+_hooks_lock = threading.Lock()
+
+
+class RequestMetrics:
+    """The measurements of one request, times in milliseconds and session data in bytes"""
+
+    def __init__(self):
+        self.view = None
+        self.values = dict.fromkeys(METRICS, 0)
+        self.running = set()
+
+
+@contextmanager
+def timer(name):
+    """
+    Adds the time spent in the block to the `name` metric of the request being measured.
+    Nested blocks for the same metric are only counted once.
+    """
+    metrics = _current.get()
+    if metrics is None or name in metrics.running:
+        yield
+        return
+    metrics.running.add(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.values[name] += (time.perf_counter() - start) * 1000
+        metrics.running.discard(name)
+
+
+def count(name, amount):
+    """Adds `amount` to the `name` metric of the request being measured"""
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.values[name] += amount
+
+
+def query_timer(execute, sql, params, many, context):
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        count('db', (time.perf_counter() - start) * 1000)
+        count('queries', 1)
+
+
+def add_query_timer(sender=None, connection=None, **kwargs):
+    if query_timer not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_timer)
+
+
+def install_hooks():
+    """
+    Wraps template rendering, session encoding and the queries of every database connection
+    so they are measured, once per process
+    """
+    global _hooks_installed
+    with _hooks_lock:
+        if _hooks_installed:
+            return
+        # The async views query from threads of their own, so the timer goes on every connection when it's opened
+        connection_created.connect(add_query_timer)
+        for connection in connections.all():
+            add_query_timer(connection=connection)
+        render, decode, encode = Template.render, SessionBase.decode, SessionBase.encode
+
+        def timed_render(self, context):
+            with timer('template'):
+                return render(self, context)
+
+        def counted_decode(self, session_data):
+            count('session_read', len(session_data or ''))
+            return decode(self, session_data)
+
+        def counted_encode(self, session_dict):
+            session_data = encode(self, session_dict)
+            count('session_write', len(session_data))
+            return session_data
+
+        Template.render, SessionBase.decode, SessionBase.encode = timed_render, counted_decode, counted_encode
+        _hooks_installed = True
+
+
+def percentile(ordered, percent):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(len(ordered) * percent / 100) - 1))]
+
+
+class MetricsAggregate:
+    """The last QUIZ_INSTRUMENTATION_WINDOW requests of every view"""
+
+    def __init__(self, window):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(lambda: deque(maxlen=window))
+
+    def add(self, metrics):
+        with self.lock:
+            self.samples[metrics.view].append(tuple(metrics.values[name] for name in METRICS))
+
+    def clear(self):
+        with self.lock:
+            self.samples.clear()
+
+    def percentiles(self, percents=(50, 90, 99)):
+        """
+        Percentiles of every metric per view formatted:
+        {view_name: {'requests': count, metric: {'p50': value, ...}}}
+        """
+        with self.lock:
+            samples = {view: list(view_samples) for view, view_samples in self.samples.items()}
+        report = {}
+        for view, view_samples in sorted(samples.items()):
+            report[view] = {'requests': len(view_samples)}
+            for index, name in enumerate(METRICS):
+                ordered = sorted(sample[index] for sample in view_samples)
+                report[view][name] = {'p%d' % percent: round(percentile(ordered, percent), 2)
+                                      for percent in percents}
+        return report
+
+
+aggregate = MetricsAggregate(getattr(settings, 'QUIZ_INSTRUMENTATION_WINDOW', 1000))
+
+
+def server_timing(metrics):
+    values = metrics.values
+    return ', '.join([
+        'total;dur=%.2f' % values['total'],
+        'db;dur=%.2f;desc="%d queries"' % (values['db'], values['queries']),
+        'template;dur=%.2f' % values['template'],
+        'pdf;dur=%.2f' % values['pdf'],
+        'session;desc="read %d B, write %d B"' % (values['session_read'], values['session_write']),
+    ])
+
+
+class InstrumentationMiddleware:
+    """Measures every request while QUIZ_INSTRUMENTATION is enabled, see the top of this module"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'QUIZ_INSTRUMENTATION', False):
+            raise MiddlewareNotUsed
+        install_hooks()
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Marks the middleware as async, like Django's MiddlewareMixin
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.values['total'] = (time.perf_counter() - start) * 1000
+            _current.reset(token)
+        return self.finish(request, response, metrics)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.values['total'] = (time.perf_counter() - start) * 1000
+            _current.reset(token)
+        return self.finish(request, response, metrics)
+
+    def finish(self, request, response, metrics):
+        match = getattr(request, 'resolver_match', None)
+        metrics.view = match.view_name if match else 'unresolved'
+        aggregate.add(metrics)
+        response['Server-Timing'] = server_timing(metrics)
+        return response
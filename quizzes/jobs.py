@@ -0,0 +1,239 @@
+import logging
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, connection, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from .importer import QuizImportError, import_quiz_csv, iter_upload_lines, quiz_csv_reader, read_quiz_header
+from .models import ImportJob
+
+logger = logging.getLogger(__name__)
+
+# Quiz CSV uploads are imported by ImportJobs so a large file doesn't hold a request worker for its
+# full length. QUIZ_IMPORT_RUNNER picks who runs the jobs:
+#   'thread'  - a pool of QUIZ_IMPORT_WORKERS threads inside the web process (default)
+#   'command' - `manage.py run_import_jobs`, the upload view only queues the job
+#   'sync'    - the upload request itself, as before
+# Jobs for different quizzes run in parallel, jobs for the same quiz are run one after the other, in the
+# order they were uploaded.
+#
+# A running job updates its heartbeat from a thread of its own for as long as it runs, the import itself is
+# written in one transaction that can take a while on large quizzes. A job whose runner died with it, in a crash
+# or a restart,
+# is put back in the queue once its heartbeat stopped for QUIZ_IMPORT_STALE_AFTER seconds: imports are
+# written in one transaction, so it left nothing behind. The 'thread' runner picks up jobs it lost in a
+# restart when their status is polled, or when the next upload of the same quiz comes in.
+
+QUIZ_IMPORT_STALE_AFTER = getattr(settings, 'QUIZ_IMPORT_STALE_AFTER', 60 * 10)
+
+# Seconds between two heartbeats of a running job
+HEARTBEAT_INTERVAL = QUIZ_IMPORT_STALE_AFTER / 4
+
+_executor = None
+_executor_lock = threading.Lock()
+_quiz_locks = defaultdict(threading.Lock)
+# Jobs handed to the thread pool of this process and not run yet
+_dispatched = set()
+
+
+def import_runner():
+    return getattr(settings, 'QUIZ_IMPORT_RUNNER', 'thread')
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=getattr(settings, 'QUIZ_IMPORT_WORKERS', 2),
+                                           thread_name_prefix='quiz-import')
+        return _executor
+
+
+def enqueue_import(csv_file):
+    """
+    Saves an uploaded quiz CSV as a pending ImportJob and hands it to the configured runner.
+    The header line is checked straight away so an obviously broken file is rejected in the request.
+
+    Returns the ImportJob object
+    """
+    importer = read_quiz_header(quiz_csv_reader(iter_upload_lines(csv_file)))
+    job = ImportJob.objects.create(csv_file=csv_file, quiz_name=importer.name)
+    dispatch_pending(job.quiz_name)
+    return job
+
+
+def dispatch_job(job_id):
+    runner = import_runner()
+    if runner == 'sync':
+        run_import_job(job_id)
+    elif runner == 'thread':
+        with _executor_lock:
+            if job_id in _dispatched:
+                return
+            _dispatched.add(job_id)
+        transaction.on_commit(lambda: get_executor().submit(run_thread_job, job_id))
+
+
+def dispatch_pending(quiz_name):
+    """
+    Hands the oldest pending job for a quiz to the runner, after putting back the jobs of runners that died.
+    Jobs after it follow one by one as each one finishes
+    """
+    recover_stale_jobs(quiz_name)
+    job_id = ImportJob.objects.filter(status=ImportJob.PENDING, quiz_name=quiz_name).order_by(
+        'created', 'id').values_list('id', flat=True).first()
+    if job_id is not None:
+        dispatch_job(job_id)
+
+
+def run_thread_job(job_id):
+    try:
+        return run_import_job(job_id)
+    except Exception:
+        logger.exception('Quiz import job %s crashed', job_id)
+    finally:
+        _dispatched.discard(job_id)
+        close_old_connections()
+
+
+def recover_stale_jobs(quiz_name=None):
+    """
+    Puts running jobs that showed no progress for QUIZ_IMPORT_STALE_AFTER seconds back in the queue,
+    for one quiz or all of them. Returns the number of jobs put back
+    """
+    cutoff = timezone.now() - timedelta(seconds=QUIZ_IMPORT_STALE_AFTER)
+    jobs = ImportJob.objects.filter(status=ImportJob.RUNNING).filter(
+        Q(heartbeat__lt=cutoff) | Q(heartbeat__isnull=True, created__lt=cutoff))
+    if quiz_name is not None:
+        jobs = jobs.filter(quiz_name=quiz_name)
+    recovered = jobs.update(status=ImportJob.PENDING, rows_processed=0, heartbeat=None)
+    if recovered:
+        logger.warning('Put %d stale quiz import job(s) back in the queue', recovered)
+    return recovered
+
+
+def claim_job(job_id):
+    """
+    Marks a pending job as running. Returns False if the job was claimed by someone else,
+    if another job for the same quiz is still running or if an older one is still pending.
+    """
+    blocking = ImportJob.objects.filter(quiz_name=OuterRef('quiz_name')).filter(
+        Q(status=ImportJob.RUNNING) |
+        Q(status=ImportJob.PENDING, created__lt=OuterRef('created')) |
+        Q(status=ImportJob.PENDING, created=OuterRef('created'), id__lt=OuterRef('id')))
+    return ImportJob.objects.filter(pk=job_id, status=ImportJob.PENDING).filter(~Exists(blocking)).update(
+        status=ImportJob.RUNNING, heartbeat=timezone.now()) == 1
+
+
+def touch_job(job_id):
+    ImportJob.objects.filter(pk=job_id, status=ImportJob.RUNNING).update(heartbeat=timezone.now())
+
+
+@contextmanager
+def heartbeat(job_id):
+    """
+    Keeps the heartbeat of a running job going while the block runs, from a thread with a database connection
+    of its own: updates made on the connection of the import would only be seen once its transaction commits.
+    """
+    stop = threading.Event()
+
+    def beat():
+        try:
+            while not stop.wait(HEARTBEAT_INTERVAL):
+                try:
+                    touch_job(job_id)
+                except DatabaseError:
+                    logger.warning('Could not update the heartbeat of quiz import job %s', job_id, exc_info=True)
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=beat, name='quiz-import-heartbeat', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def count_rows(csv_file):
+    rows = -1
+    chunk = b''
+    with csv_file.open('rb'):
+        for chunk in csv_file.chunks():
+            rows += chunk.count(b'\n')
+        if chunk and not chunk.endswith(b'\n'):
+            rows += 1
+    return max(rows, 0)
+
+
+def run_import_job(job_id):
+    """
+    Imports the CSV of a pending ImportJob, reporting progress on the job as it goes.
+    Does nothing if the job can't be claimed, it is picked up again once the running job
+    for the same quiz is finished.
+
+    Returns the ImportJob object, or None when it wasn't run
+    """
+    job = ImportJob.objects.get(pk=job_id)
+    quiz_lock = _quiz_locks[job.quiz_name]
+    if not quiz_lock.acquire(blocking=False):
+        return None
+    try:
+        if not claim_job(job_id):
+            return None
+        job.refresh_from_db()
+        try:
+            job.rows_total = count_rows(job.csv_file)
+            ImportJob.objects.filter(pk=job.id).update(rows_total=job.rows_total)
+
+            def progress(rows):
+                ImportJob.objects.filter(pk=job.id).update(rows_processed=min(rows, job.rows_total))
+
+            with heartbeat(job.id), job.csv_file.open('rb'):
+                job.quiz = import_quiz_csv(iter_upload_lines(job.csv_file), progress=progress)
+        except QuizImportError as e:
+            job.status = ImportJob.FAILED
+            job.error_message = str(e)[:2000]
+        except UnicodeDecodeError:
+            job.status = ImportJob.FAILED
+            job.error_message = 'The file is not UTF-8 encoded'
+        except Exception as e:
+            job.status = ImportJob.FAILED
+            job.error_message = 'The import failed unexpectedly: %s' % str(e)[:1900]
+            logger.exception('Quiz import job %s failed', job.id)
+        else:
+            job.status = ImportJob.DONE
+            job.rows_processed = job.rows_total
+            job.csv_file.delete(save=False)
+        job.finished = timezone.now()
+        job.save()
+    finally:
+        quiz_lock.release()
+
+    # The next job for the same quiz, held back while this one ran, can go now
+    if import_runner() != 'command':
+        dispatch_pending(job.quiz_name)
+    return job
+
+
+def run_pending_jobs(workers=1):
+    """
+    Runs every pending job, `workers` at a time, after putting back the jobs of runners that died.
+    Used by the run_import_jobs management command. A job for a quiz that has an older one in the same round
+    waits for the next round.
+
+    Returns the number of jobs that were run
+    """
+    recover_stale_jobs()
+    job_ids = list(ImportJob.objects.filter(status=ImportJob.PENDING).order_by('created').values_list(
+        'id', flat=True))
+    if workers <= 1:
+        return len([job for job in map(run_import_job, job_ids) if job is not None])
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return len([job for job in executor.map(run_thread_job, job_ids) if job is not None])
+
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+from quizzes.models import Quiz, UserResponse
+from quizzes.selections import build_selections
+
+
+class Command(BaseCommand):
+    help = ('Writes the answer and category score rows of finished responses again from their response data, '
+            'for responses finalized before those tables existed.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('quiz_ids', nargs='*', type=int, metavar='QUIZ_ID',
+                            help='Quizzes whose responses are written, every quiz with responses if left out')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Number of responses read and written at a time')
+
+    def handle(self, *args, **options):
+        quiz_ids = options['quiz_ids'] or list(
+            UserResponse.objects.exclude(parent_quiz=None).order_by('parent_quiz_id').values_list(
+                'parent_quiz_id', flat=True).distinct())
+        for quiz_id in quiz_ids:
+            try:
+                written = build_selections(quiz_id, options['chunk_size'])
+            except Quiz.DoesNotExist:
+                raise CommandError('Quiz %s does not exist' % quiz_id)
+            self.stdout.write('Quiz %s: %d finished responses written' % (quiz_id, written))
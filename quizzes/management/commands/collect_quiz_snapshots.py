@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from quizzes.compiled import QUIZ_SNAPSHOT_RETENTION, collect_snapshots
+
+
+class Command(BaseCommand):
+    help = ('Deletes the quiz snapshots superseded longer than QUIZ_SNAPSHOT_RETENTION ago. '
+            'The current snapshot of every quiz is always kept, run this from cron.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--retention', type=int, default=QUIZ_SNAPSHOT_RETENTION,
+                            help='Seconds a superseded snapshot is kept, QUIZ_SNAPSHOT_RETENTION by default')
+
+    def handle(self, *args, **options):
+        deleted = collect_snapshots(options['retention'])
+        self.stdout.write('%d superseded snapshot%s deleted' % (deleted, '' if deleted == 1 else 's'))
@@ -0,0 +1,83 @@
+import datetime
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from quizzes.models import Quiz, Category, Question, Answer, UserResponse, generate_response_id
+
+
+class Command(BaseCommand):
+    help = ('Prints the query plans of the lookups the quiz views make. '
+            'Run it before and after migrating to compare plans, --seed fills the database with test data first.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0, metavar='RESPONSES',
+                            help='Create synthetic quizzes and this many responses before explaining')
+        parser.add_argument('--quizzes', type=int, default=10,
+                            help='Number of synthetic quizzes the seeded responses are spread over')
+
+    def handle(self, *args, **options):
+        if options['seed']:
+            self.seed(options['seed'], options['quizzes'])
+
+        quiz = Quiz.objects.order_by('id').last()
+        response = UserResponse.objects.order_by('id').last()
+        if quiz is None or response is None:
+            self.stderr.write('Nothing to explain, create a quiz and a response first or pass --seed')
+            return
+        category = Category.objects.filter(parent_quiz=quiz).first()
+        question = Question.objects.filter(parent_category=category).first()
+
+        lookups = [
+            ('feedback, get_feedback_pdf, save_user_feedback: response by id',
+             UserResponse.objects.filter(response_id=response.response_id)),
+            ('create_user_response: response of a quiz by id',
+             UserResponse.objects.filter(parent_quiz=quiz, response_id=response.response_id)),
+            ('export_responses, rescore_responses: responses of a quiz in id order',
+             UserResponse.objects.filter(parent_quiz=quiz).order_by('id')),
+            ('IndexView: latest active quizzes',
+             Quiz.objects.filter(active_quiz=True).order_by('-pub_date')[:5]),
+            ('quiz_upload: quiz from the CSV header',
+             Quiz.objects.filter(name=quiz.name, pub_date=quiz.pub_date, description=quiz.description,
+                                 active_quiz=True)),
+            ('quiz_upload: category by name',
+             Category.objects.filter(parent_quiz=quiz, category_name='Category 1')),
+            ('quiz_upload: question by text',
+             Question.objects.filter(parent_category=category, question_text='Question 1')),
+            ('quiz_upload: answer by text',
+             Answer.objects.filter(parent_question=question, answer_text='Answer 1')),
+        ]
+        for title, queryset in lookups:
+            self.stdout.write(self.style.MIGRATE_HEADING(title))
+            self.stdout.write(queryset.explain())
+            self.stdout.write('')
+
+    @transaction.atomic
+    def seed(self, responses, quizzes):
+        self.stdout.write('Seeding %d quizzes and %d responses' % (quizzes, responses))
+        now = timezone.now()
+        quiz_objs = [
+            Quiz.objects.create(name='Seeded quiz %d' % i, pub_date=now - datetime.timedelta(days=i),
+                                description='Synthetic quiz for query plans', active_quiz=i % 2 == 0)
+            for i in range(quizzes)
+        ]
+        for quiz in quiz_objs:
+            Category.objects.bulk_create([
+                Category(parent_quiz=quiz, category_name='Category %d' % c, order=c) for c in range(5)
+            ])
+            for category in Category.objects.filter(parent_quiz=quiz):
+                Question.objects.bulk_create([
+                    Question(parent_quiz=quiz, parent_category=category, question_text='Question %d' % q)
+                    for q in range(10)
+                ])
+            Answer.objects.bulk_create([
+                Answer(parent_quiz=quiz, parent_category_id=question.parent_category_id, parent_question=question,
+                       answer_text='Answer %d' % a, answer_weight=a / 2)
+                for question in Question.objects.filter(parent_quiz=quiz)
+                for a in range(3)
+            ])
+        UserResponse.objects.bulk_create(
+            (UserResponse(parent_quiz=quiz_objs[i % quizzes], response_id=generate_response_id(),
+                          response_data={'quiz_data': {}, 'quiz_norm_scores': {}, 'feedback_data': {}})
+             for i in range(responses)),
+            batch_size=1000,
+        )
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+from quizzes.compiled import get_quiz_tree
+from quizzes.exports import EXPORT_LAYOUTS, export_formats, stream_export
+from quizzes.models import Quiz
+
+
+class Command(BaseCommand):
+    help = ('Streams the finished responses of a quiz to a CSV or Parquet file, one row per response '
+            'or per answer. See quizzes/exports.py.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('quiz_id', type=int)
+        parser.add_argument('--layout', choices=EXPORT_LAYOUTS, default='responses',
+                            help='One row per response, or per answer of a response')
+        parser.add_argument('--format', choices=('csv', 'parquet'), default='csv',
+                            help='Parquet needs pyarrow, the export extra')
+        parser.add_argument('--output', help='File written to, the CSV goes to stdout if left out')
+
+    def handle(self, *args, **options):
+        if options['format'] not in export_formats():
+            raise CommandError('%s exports need pyarrow to be installed' % options['format'])
+        if options['format'] == 'parquet' and not options['output']:
+            raise CommandError('Parquet exports need an --output file')
+        try:
+            quiz = get_quiz_tree(options['quiz_id'])
+        except Quiz.DoesNotExist:
+            raise CommandError('Quiz %s does not exist' % options['quiz_id'])
+
+        chunks = stream_export(quiz, options['layout'], options['format'])
+        if not options['output']:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+        if options['format'] == 'parquet':
+            output = open(options['output'], 'wb')
+        else:
+            output = open(options['output'], 'w', encoding='utf-8', newline='')
+        with output:
+            for chunk in chunks:
+                output.write(chunk)
+        self.stderr.write('Exported %s responses of %s to %s' % (options['layout'], quiz.name, options['output']))
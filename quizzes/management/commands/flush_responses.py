@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from quizzes.writebehind import get_buffer
+
+
+class Command(BaseCommand):
+    help = ('Writes the finished responses left in write-behind spool files to the database, '
+            'for example those of a web process that crashed. See QUIZ_WRITE_BEHIND_SPOOL_DIR.')
+
+    def handle(self, *args, **options):
+        buffer = get_buffer()
+        if buffer.spool_dir:
+            buffer.take_over_spools()
+        written = buffer.flush()
+        self.stdout.write('Wrote %d buffered response(s)' % written)
@@ -0,0 +1,172 @@
+import asyncio
+import statistics
+import sys
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import include, path, reverse
+from quizzes.compiled import get_quiz_tree
+from quizzes.models import Quiz
+from quizzes.urls import quiz_urlpatterns
+
+# Serves the same quiz pages with the sync views under the WSGI handler and with the async views under the
+# ASGI handler, in process, and compares their throughput. Every simulated client takes --client-delay
+# milliseconds to read a response: a WSGI worker thread waits for it, the event loop serves other clients.
+
+
+def quiz_urlconf(name, use_async):
+    urlconf = types.ModuleType(name)
+    urlconf.urlpatterns = [path('quizzes/', include((quiz_urlpatterns(use_async), 'quizzes')))]
+    return urlconf
+
+
+SYNC_URLCONF = quiz_urlconf('quizzes_load_test_sync_urls', use_async=False)
+ASYNC_URLCONF = quiz_urlconf('quizzes_load_test_async_urls', use_async=True)
+
+
+class LoadTestWSGIHandler(WSGIHandler):
+    def get_response(self, request):
+        request.urlconf = SYNC_URLCONF
+        return super().get_response(request)
+
+
+class LoadTestASGIHandler(ASGIHandler):
+    async def get_response_async(self, request):
+        request.urlconf = ASYNC_URLCONF
+        return await super().get_response_async(request)
+
+
+class Command(BaseCommand):
+    help = ('Compares the throughput of the quiz pages served by the sync views under WSGI and by the async '
+            'views under ASGI, with simulated slow clients.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('quiz_id', type=int, nargs='?',
+                            help='Quiz whose pages are requested, the newest quiz by default')
+        parser.add_argument('--requests', type=int, default=500, help='Number of requests per server')
+        parser.add_argument('--clients', type=int, default=50, help='Number of clients sending requests at once')
+        parser.add_argument('--threads', type=int, default=8, help='Number of WSGI worker threads')
+        parser.add_argument('--client-delay', type=float, default=50.0,
+                            help='Milliseconds every client takes to read a response')
+        parser.add_argument('--host', default='localhost', help='Host header of the requests')
+        parser.add_argument('--server', choices=('wsgi', 'asgi'), action='append',
+                            help='Only run against this server, can be given twice')
+
+    def handle(self, *args, **options):
+        quiz = Quiz.objects.filter(pk=options['quiz_id']) if options['quiz_id'] else Quiz.objects.order_by('-id')
+        quiz = quiz.first()
+        if quiz is None:
+            raise CommandError('There is no quiz to load test')
+        tree = get_quiz_tree(quiz.id)
+        paths = [reverse('quizzes:index', urlconf=SYNC_URLCONF),
+                 reverse('quizzes:quiz_detail', args=(quiz.id,), urlconf=SYNC_URLCONF)]
+        paths.extend(reverse('quizzes:take_quiz', args=(quiz.id, question.category_id, question.id),
+                             urlconf=SYNC_URLCONF) for question in tree.questions)
+        paths = [paths[index % len(paths)] for index in range(options['requests'])]
+
+        self.stdout.write('%d requests to %d pages of %s, %d clients reading for %g ms each' % (
+            len(paths), len(set(paths)), quiz.name, options['clients'], options['client_delay']))
+        self.stdout.write('%-6s %8s %8s %9s %9s %9s' % ('server', 'errors', 'seconds', 'req/s', 'p50 ms', 'p99 ms'))
+        for server in options['server'] or ('wsgi', 'asgi'):
+            run = self.run_wsgi if server == 'wsgi' else self.run_asgi
+            start = time.perf_counter()
+            results = run(paths, options)
+            elapsed = time.perf_counter() - start
+            latencies = sorted(latency for status, latency in results)
+            self.stdout.write('%-6s %8d %8.2f %9.1f %9.2f %9.2f' % (
+                server, len([status for status, latency in results if status != 200]), elapsed,
+                len(results) / elapsed, statistics.median(latencies),
+                latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]))
+
+    def run_wsgi(self, paths, options):
+        """Returns (status, latency in ms) per request, served by --threads threads"""
+        handler = LoadTestWSGIHandler()
+        delay = options['client_delay'] / 1000
+
+        def request(path):
+            start = time.perf_counter()
+            statuses = []
+            result = handler(wsgi_environ(path, options['host']), lambda status, headers, exc_info=None:
+                             statuses.append(int(status.split()[0])))
+            for chunk in result:
+                pass
+            # The worker thread writes to the socket until the client has read the response
+            time.sleep(delay)
+            result.close()
+            return statuses[0], (time.perf_counter() - start) * 1000
+
+        # The clients beyond the number of threads wait in the pool's queue, as in the server's backlog.
+        # That wait isn't part of the latencies, it shows in the throughput
+        with ThreadPoolExecutor(max_workers=options['threads']) as pool:
+            return list(pool.map(request, paths))
+
+    def run_asgi(self, paths, options):
+        """Returns (status, latency in ms) per request, served by one event loop"""
+        handler = LoadTestASGIHandler()
+        delay = options['client_delay'] / 1000
+
+        async def request(path, clients):
+            async with clients:
+                start = time.perf_counter()
+                statuses = []
+
+                async def receive():
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+                async def send(message):
+                    if message['type'] == 'http.response.start':
+                        statuses.append(message['status'])
+                    elif not message.get('more_body'):
+                        # Only this request waits for the client to read the response
+                        await asyncio.sleep(delay)
+
+                await handler(asgi_scope(path, options['host']), receive, send)
+                return statuses[0], (time.perf_counter() - start) * 1000
+
+        async def run():
+            clients = asyncio.Semaphore(options['clients'])
+            return await asyncio.gather(*[request(path, clients) for path in paths])
+
+        return asyncio.run(run())
+
+
+def wsgi_environ(path, host):
+    return {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': path,
+        'SCRIPT_NAME': '',
+        'QUERY_STRING': '',
+        'SERVER_NAME': host,
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': host,
+        'REMOTE_ADDR': '127.0.0.1',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+
+
+def asgi_scope(path, host):
+    return {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': b'',
+        'root_path': '',
+        'headers': [(b'host', host.encode())],
+        'client': ('127.0.0.1', 0),
+        'server': (host, 80),
+    }
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from quizzes.compiled import publish_quiz
+from quizzes.models import Quiz
+
+
+class Command(BaseCommand):
+    help = ('Publishes a snapshot of quizzes that changed without one being published, like quizzes created '
+            'before there were snapshots or edited with raw SQL. Quizzes without changes keep their version.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('quiz_ids', nargs='*', type=int, metavar='QUIZ_ID',
+                            help='Quizzes to publish, every quiz if left out')
+
+    def handle(self, *args, **options):
+        quiz_ids = options['quiz_ids'] or list(Quiz.objects.order_by('id').values_list('id', flat=True))
+        for quiz_id in quiz_ids:
+            try:
+                tree = publish_quiz(quiz_id)
+            except Quiz.DoesNotExist:
+                raise CommandError('Quiz %s does not exist' % quiz_id)
+            self.stdout.write('%s: version %s' % (tree.name, tree.version))
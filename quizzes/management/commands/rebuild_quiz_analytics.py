@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from quizzes.analytics import rebuild_analytics
+from quizzes.models import Quiz
+
+
+class Command(BaseCommand):
+    help = ('Works out the analytics of quizzes again from all of their finished responses, after '
+            'QUIZ_ANALYTICS_BINS or QUIZ_SCORE_RANGE changed or for responses stored before the analytics existed.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('quiz_ids', nargs='*', type=int, metavar='QUIZ_ID',
+                            help='Quizzes to rebuild, every quiz if left out')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Number of responses read at a time')
+
+    def handle(self, *args, **options):
+        quiz_ids = options['quiz_ids'] or list(Quiz.objects.order_by('id').values_list('id', flat=True))
+        for quiz_id in quiz_ids:
+            try:
+                completions = rebuild_analytics(quiz_id, options['chunk_size'])
+            except Quiz.DoesNotExist:
+                raise CommandError('Quiz %s does not exist' % quiz_id)
+            self.stdout.write('Quiz %s: %d finished responses counted' % (quiz_id, completions))
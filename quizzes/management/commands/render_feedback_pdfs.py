@@ -0,0 +1,25 @@
+import time
+from django.core.management.base import BaseCommand
+from quizzes.pdfs import render_pending_pdfs
+
+
+class Command(BaseCommand):
+    help = ('Renders the feedback PDFs of finished responses that don\'t have one yet. '
+            'Use with QUIZ_PDF_RUNNER = "command".')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of processes rendering PDFs in parallel')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep polling for new responses instead of exiting once every PDF is rendered')
+        parser.add_argument('--interval', type=float, default=5.0,
+                            help='Seconds to wait between polls when --loop is given')
+
+    def handle(self, *args, **options):
+        while True:
+            rendered = render_pending_pdfs(workers=options['workers'])
+            if rendered:
+                self.stdout.write('Rendered %d feedback PDF(s)' % rendered)
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
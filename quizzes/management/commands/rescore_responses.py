@@ -0,0 +1,116 @@
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from quizzes.analytics import update_analytics
+from quizzes.compiled import publish_quiz
+from quizzes.models import Quiz, UserResponse
+from quizzes.pdfs import discard_feedback_pdfs
+from quizzes.reports import invalidate_feedback_pages
+from quizzes.scoring import QuizScorer, rescore_rows
+from quizzes.selections import write_selections
+
+class Command(BaseCommand):
+    help = ('Works out the normalized scores and feedback of stored responses again from their answers, '
+            'after the weights or feedback of a quiz were edited.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('quiz_ids', nargs='*', type=int, metavar='QUIZ_ID',
+                            help='Quizzes to rescore, every quiz with responses if left out')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='Number of responses read, scored and written at a time')
+        parser.add_argument('--processes', type=int, default=1,
+                            help='Number of processes scoring chunks in parallel')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Print what would change instead of saving it')
+
+    def handle(self, *args, **options):
+        quiz_ids = options['quiz_ids'] or list(
+            UserResponse.objects.exclude(parent_quiz=None).order_by('parent_quiz_id').values_list(
+                'parent_quiz_id', flat=True).distinct())
+        for quiz_id in quiz_ids:
+            try:
+                # Published straight from the database once per quiz, so edits that bypassed the cache
+                # invalidation are picked up too
+                quiz = publish_quiz(quiz_id)
+            except Quiz.DoesNotExist:
+                raise CommandError('Quiz %s does not exist' % quiz_id)
+            total, changed = self.rescore_quiz(quiz, options)
+            self.stdout.write('%s: %d of %d responses %s' % (
+                quiz.name, changed, total, 'would change' if options['dry_run'] else 'updated'))
+
+    def rescore_quiz(self, quiz, options):
+        scorer = QuizScorer(quiz)
+        total = changed = 0
+
+        if options['processes'] > 1:
+            # Spawned, not forked, so the workers don't inherit the database connections of this process.
+            # They only compute, Django is set up in them to unpickle the scorer and the chunks.
+            with ProcessPoolExecutor(max_workers=options['processes'], mp_context=multiprocessing.get_context('spawn'),
+                                     initializer=django.setup) as executor:
+                # Only a few chunks are in flight at a time, so memory doesn't grow with the number of responses
+                pending = deque()
+                for chunk in self.iter_chunks(quiz, options['chunk_size']):
+                    total += len(chunk)
+                    pending.append(executor.submit(rescore_rows, scorer, chunk))
+                    if len(pending) >= options['processes'] * 2:
+                        changed += self.save_rows(quiz, pending.popleft().result(), options['dry_run'])
+                while pending:
+                    changed += self.save_rows(quiz, pending.popleft().result(), options['dry_run'])
+        else:
+            for chunk in self.iter_chunks(quiz, options['chunk_size']):
+                total += len(chunk)
+                changed += self.save_rows(quiz, rescore_rows(scorer, chunk), options['dry_run'])
+        return total, changed
+
+    def iter_chunks(self, quiz, chunk_size):
+        """
+        Yields the (pk, response_data) of the finished responses of a quiz, `chunk_size` at a time. Every chunk is
+        read with a query of its own, paging by primary key, so no cursor over the table is open while the rows
+        of a chunk are saved. Responses of unfinished quizzes have nothing to rescore.
+        """
+        responses = UserResponse.objects.filter(parent_quiz_id=quiz.id, response_data__isnull=False).order_by('id')
+        last_pk = 0
+        while True:
+            chunk = list(responses.filter(id__gt=last_pk).values_list('id', 'response_data')[:chunk_size])
+            if not chunk:
+                return
+            yield chunk
+            last_pk = chunk[-1][0]
+
+    def save_rows(self, quiz, rows, dry_run):
+        if dry_run:
+            for pk, old_data, new_data in rows:
+                self.stdout.write(self.diff(pk, old_data or {}, new_data))
+        elif rows:
+            with transaction.atomic():
+                now = timezone.now()
+                UserResponse.objects.bulk_update(
+                    [UserResponse(pk=pk, response_data=new_data, updated_at=now) for pk, old_data, new_data in rows],
+                    ['response_data', 'updated_at'],
+                )
+                discard_feedback_pdfs([pk for pk, old_data, new_data in rows])
+                invalidate_feedback_pages([pk for pk, old_data, new_data in rows])
+                write_selections(quiz, [(pk, new_data) for pk, old_data, new_data in rows])
+                update_analytics(quiz, [(old_data, new_data) for pk, old_data, new_data in rows])
+        return len(rows)
+
+    def diff(self, pk, old_data, new_data):
+        lines = ['Response %s:' % pk]
+        old_scores = old_data.get('quiz_norm_scores') or {}
+        for category, score in new_data['quiz_norm_scores'].items():
+            if old_scores.get(category) != score:
+                lines.append('  %s score: %s -> %s' % (category, old_scores.get(category), score))
+        old_feedback = old_data.get('feedback_data') or {}
+        for category, feedback in new_data['feedback_data'].items():
+            for question in sorted(set(feedback) | set(old_feedback.get(category) or {})):
+                old_text = (old_feedback.get(category) or {}).get(question)
+                if old_text != feedback.get(question):
+                    lines.append('  %s / %s feedback: %r -> %r' % (category, question, old_text,
+                                                                   feedback.get(question)))
+        if old_data.get('answer_ids') != new_data['answer_ids']:
+            lines.append('  answer ids stored')
+        return '\n'.join(lines)
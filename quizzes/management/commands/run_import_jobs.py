@@ -0,0 +1,24 @@
+import time
+from django.core.management.base import BaseCommand
+from quizzes.jobs import run_pending_jobs
+
+
+class Command(BaseCommand):
+    help = 'Runs pending quiz CSV import jobs. Use with QUIZ_IMPORT_RUNNER = "command".'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of jobs to import in parallel, jobs for the same quiz never overlap')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep polling for new jobs instead of exiting once the queue is empty')
+        parser.add_argument('--interval', type=float, default=5.0,
+                            help='Seconds to wait between polls when --loop is given')
+
+    def handle(self, *args, **options):
+        while True:
+            ran = run_pending_jobs(workers=options['workers'])
+            if ran:
+                self.stdout.write('Ran %d import job(s)' % ran)
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
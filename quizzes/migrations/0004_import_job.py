@@ -0,0 +1,33 @@
+# Generated by Django 3.2.25 on 2026-10-17 22:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quizzes', '0003_auto_20200826_1516'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('csv_file', models.FileField(blank=True, null=True, upload_to='quiz_imports/')),
+                ('quiz_name', models.CharField(blank=True, max_length=200, null=True, verbose_name='Quiz Name')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('rows_total', models.IntegerField(default=0)),
+                ('rows_processed', models.IntegerField(default=0)),
+                ('error_message', models.CharField(blank=True, max_length=2000, null=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('quiz', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='quizzes.quiz')),
+            ],
+            options={
+                'verbose_name_plural': 'Import jobs',
+                'db_table': 'import_job',
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.2.25 on 2026-10-17 22:30
+
+from django.db import migrations, models
+import quizzes.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quizzes', '0004_import_job'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='userresponse',
+            name='response_id',
+            field=models.BigIntegerField(blank=True, default=quizzes.models.generate_response_id, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 3.2.25 on 2026-10-17 22:31
+
+from django.db import migrations, models
+
+
+def rename_duplicates(model, parent_field, name_field):
+    """
+    Renames every row whose name is taken by an older row under the same parent to 'name (2)', 'name (3)' and so on,
+    so the unique constraints below can be added. Nothing is merged, the quiz keeps every row and the names can
+    be fixed in the admin.
+    """
+    max_length = model._meta.get_field(name_field).max_length
+    rows = list(model.objects.exclude(**{parent_field: None}).exclude(**{name_field: None}).order_by('id').values_list(
+        'id', parent_field, name_field))
+    taken = set((parent_id, name) for pk, parent_id, name in rows)
+    seen = set()
+    for pk, parent_id, name in rows:
+        if (parent_id, name) not in seen:
+            seen.add((parent_id, name))
+            continue
+        number = 2
+        while True:
+            suffix = ' (%d)' % number
+            new_name = name[:max_length - len(suffix)] + suffix
+            if (parent_id, new_name) not in taken:
+                break
+            number += 1
+        taken.add((parent_id, new_name))
+        seen.add((parent_id, new_name))
+        model.objects.filter(pk=pk).update(**{name_field: new_name})
+
+
+def rename_duplicate_names(apps, schema_editor):
+    rename_duplicates(apps.get_model('quizzes', 'Category'), 'parent_quiz_id', 'category_name')
+    rename_duplicates(apps.get_model('quizzes', 'Question'), 'parent_category_id', 'question_text')
+    rename_duplicates(apps.get_model('quizzes', 'Answer'), 'parent_question_id', 'answer_text')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quizzes', '0005_response_id_allocator'),
+    ]
+
+    operations = [
+        migrations.RunPython(rename_duplicate_names, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='answer',
+            unique_together={('parent_question', 'answer_text')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='category',
+            unique_together={('parent_quiz', 'category_name')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='question',
+            unique_together={('parent_category', 'question_text')},
+        ),
+        migrations.AddIndex(
+            model_name='quiz',
+            index=models.Index(fields=['active_quiz', '-pub_date'], name='quiz_active_pub_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='quiz',
+            index=models.Index(fields=['name', 'pub_date'], name='quiz_name_pub_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userresponse',
+            index=models.Index(fields=['parent_quiz', 'response_id'], name='response_quiz_response_id_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-17 22:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quizzes', '0006_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userresponse',
+            name='feedback_pdf',
+            field=models.FileField(blank=True, null=True, upload_to='feedback_pdfs/'),
+        ),
+        migrations.AddField(
+            model_name='userresponse',
+            name='feedback_pdf_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-17 22:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quizzes', '0007_feedback_pdf'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userresponse',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, null=True),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 3.2.25 on 2026-10-17 23:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quizzes', '0008_response_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuizAnalytics',
+            fields=[
+                ('quiz', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='analytics', serialize=False, to='quizzes.quiz')),
+                ('completions', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Quiz analytics',
+                'db_table': 'quiz_analytics',
+            },
+        ),
+        migrations.CreateModel(
+            name='CategoryScoreBucket',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.SmallIntegerField()),
+                ('responses', models.IntegerField(default=0)),
+                ('score_sum', models.FloatField(default=0)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='quizzes.category')),
+                ('quiz', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='quizzes.quiz')),
+            ],
+            options={
+                'db_table': 'category_score_bucket',
+            },
+        ),
+        migrations.CreateModel(
+            name='AnswerPickCount',
+            fields=[
+                ('answer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='pick_count', serialize=False, to='quizzes.answer')),
+                ('picks', models.IntegerField(default=0)),
+                ('quiz', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='quizzes.quiz')),
+            ],
+            options={
+                'db_table': 'answer_pick_count',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='categoryscorebucket',
+            constraint=models.UniqueConstraint(fields=('category', 'bucket'), name='category_score_bucket_unique'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 3.2.25 on 2026-10-17 23:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quizzes', '0009_quiz_analytics'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResponseCategoryScore',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField(blank=True, null=True)),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='quizzes.category')),
+                ('quiz', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='quizzes.quiz')),
+                ('response', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='category_scores', to='quizzes.userresponse')),
+            ],
+            options={
+                'db_table': 'response_category_score',
+            },
+        ),
+        migrations.CreateModel(
+            name='ResponseAnswer',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('weight', models.FloatField(default=0)),
+                ('answer', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='quizzes.answer')),
+                ('question', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='quizzes.question')),
+                ('quiz', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='quizzes.quiz')),
+                ('response', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='answers', to='quizzes.userresponse')),
+            ],
+            options={
+                'db_table': 'response_answer',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='responsecategoryscore',
+            index=models.Index(fields=['category', 'score'], name='response_category_score_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='responsecategoryscore',
+            constraint=models.UniqueConstraint(fields=('response', 'category'), name='response_category_score_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='responseanswer',
+            constraint=models.UniqueConstraint(fields=('response', 'question'), name='response_answer_unique'),
+        ),
+    ]
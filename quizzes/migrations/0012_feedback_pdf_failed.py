@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-17 23:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quizzes', '0011_quiz_snapshots'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userresponse',
+            name='feedback_pdf_failed',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 00:04
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quizzes', '0013_import_job_heartbeat'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='userresponse',
+            name='response_quiz_response_id_idx',
+        ),
+    ]
@@ -1,4 +1,5 @@
 import datetime
+import secrets
 import uuid
 from django.db import models
 from django.utils import timezone
@@ -38,35 +39,21 @@ class Quiz(models.Model):
         """Return the last five published quizzes"""
         return Quiz.objects.filter(pub_date__lte=timezone.now()).order_by('-pub_date')[:5]
 
-    # The following are functions for session variables
-
     def get_quiz_questions(self):
         return self.question_set.all().select_subclasses()
 
     def get_quiz_categories(self):
         return self.category_set.all().select_subclasses()
 
-    def session_question_list(self):
-        return str(self.id) + "_quiz_question_list"
-
-    def session_quiz_data(self):
-        return str(self.id) + "_quiz_data"
-
-    def session_cat_data(self):
-        return str(self.id) + "_cat_data"
-
-    def session_norm_data(self):
-        return str(self.id) + "_norm_data"
-
-    def session_feedback(self):
-        return str(self.id) + "_feedback"
-
-    def session_response_id(self):
-        return str(self.id) + "_response_id"
-
     class Meta:
         verbose_name_plural = 'Quizzes'
         db_table = "quiz"
+        indexes = [
+            # Index and detail views list active quizzes newest first
+            models.Index(fields=['active_quiz', '-pub_date'], name='quiz_active_pub_date_idx'),
+            # quiz_upload finds the quiz to update by its CSV header
+            models.Index(fields=['name', 'pub_date'], name='quiz_name_pub_date_idx'),
+        ]
 
 
 class Category(models.Model):
@@ -87,6 +74,8 @@ class Category(models.Model):
     class Meta:
         db_table = "category"
         verbose_name_plural = 'Categories'
+        # Scores and responses are keyed by category name
+        unique_together = [['parent_quiz', 'category_name']]
 
 
 class Question(models.Model):
@@ -110,6 +99,8 @@ class Question(models.Model):
 
     class Meta:
         db_table = "question"
+        # Responses are keyed by question text within a category
+        unique_together = [['parent_category', 'question_text']]
 
 
 class Answer(models.Model):
@@ -132,6 +123,8 @@ class Answer(models.Model):
 
     class Meta:
         db_table = "answer"
+        # quiz_upload matches answers by their text within a question
+        unique_together = [['parent_question', 'answer_text']]
 
 
 class Feedback(models.Model):
@@ -158,15 +151,175 @@ class Feedback(models.Model):
         verbose_name_plural = 'Feedback'
 
 
+def generate_response_id():
+    """
+    Returns a random response_id. Ids are 53-bit so they stay exact in JavaScript,
+    which makes a collision unlikely enough that a retry on the unique index covers it.
+    """
+    return secrets.randbelow(2 ** 53 - 1) + 1
+
+
 class UserResponse(models.Model):
     """"""
     parent_quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE, blank=True, null=True)
-    response_id = models.IntegerField(blank=True, null=True)
+    response_id = models.BigIntegerField(unique=True, default=generate_response_id, blank=True, null=True)
     response_data = JSONField(null=True)
+    # Last change of the response data, feedback pages are revalidated against it
+    updated_at = models.DateTimeField(auto_now=True, blank=True, null=True)
+
+    # Feedback report, rendered once the response is finalized
+    feedback_pdf = models.FileField(upload_to='feedback_pdfs/', blank=True, null=True)
+    feedback_pdf_hash = models.CharField(max_length=64, blank=True, null=True)
+    # Set when the feedback PDF couldn't be rendered, it isn't tried again until the response data changes
+    feedback_pdf_failed = models.BooleanField(default=False)
 
     def __str__(self):
         return str(self.response_id)
 
+    def is_finalized(self):
+        return self.response_data is not None
+
     class Meta:
         db_table = "response"
         verbose_name_plural = 'Responses'
+
+
+class ImportJob(models.Model):
+    """
+    A quiz CSV upload that is imported in the background.
+    Progress is tracked as rows processed out of rows total.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, _('Pending')),
+        (RUNNING, _('Running')),
+        (DONE, _('Done')),
+        (FAILED, _('Failed')),
+    ]
+
+    csv_file = models.FileField(upload_to='quiz_imports/', blank=True, null=True)
+    quiz_name = models.CharField(_("Quiz Name"), max_length=200, blank=True, null=True)
+    quiz = models.ForeignKey(Quiz, on_delete=models.SET_NULL, blank=True, null=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    rows_total = models.IntegerField(default=0)
+    rows_processed = models.IntegerField(default=0)
+    error_message = models.CharField(max_length=2000, blank=True, null=True)
+    created = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(blank=True, null=True)
+    # Last sign of life of the runner of a running job, see QUIZ_IMPORT_STALE_AFTER
+    heartbeat = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return '%s (%s)' % (self.quiz_name, self.status)
+
+    def is_finished(self):
+        return self.status in (self.DONE, self.FAILED)
+
+    class Meta:
+        db_table = "import_job"
+        verbose_name_plural = 'Import jobs'
+
+
+class QuizAnalytics(models.Model):
+    """Number of finalized responses of a quiz, kept up to date by the analytics module"""
+    quiz = models.OneToOneField(Quiz, on_delete=models.CASCADE, primary_key=True, related_name='analytics')
+    completions = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return '%s: %d completions' % (self.quiz, self.completions)
+
+    class Meta:
+        db_table = "quiz_analytics"
+        verbose_name_plural = 'Quiz analytics'
+
+
+class AnswerPickCount(models.Model):
+    """Number of finalized responses that picked an answer"""
+    answer = models.OneToOneField(Answer, on_delete=models.CASCADE, primary_key=True, related_name='pick_count')
+    quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE)
+    picks = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = "answer_pick_count"
+
+
+class CategoryScoreBucket(models.Model):
+    """
+    One bar of the histogram of the scores of a category: the number of finalized responses whose score
+    falls in the bucket, and the sum of those scores for the average.
+    """
+    quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE)
+    # Position of the bucket in the score range, see QUIZ_ANALYTICS_BINS
+    bucket = models.SmallIntegerField()
+    responses = models.IntegerField(default=0)
+    score_sum = models.FloatField(default=0)
+
+    class Meta:
+        db_table = "category_score_bucket"
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'bucket'], name='category_score_bucket_unique'),
+        ]
+
+
+class ResponseAnswer(models.Model):
+    """
+    One answer of a finalized response, with the weight it had when the response was scored.
+    Written alongside the response data by the selections module, so answers can be filtered and counted in SQL.
+    """
+    response = models.ForeignKey(UserResponse, on_delete=models.CASCADE, related_name='answers')
+    quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE)
+    # Left empty when the question or answer is deleted from the quiz later
+    question = models.ForeignKey(Question, on_delete=models.SET_NULL, blank=True, null=True)
+    answer = models.ForeignKey(Answer, on_delete=models.SET_NULL, blank=True, null=True)
+    weight = models.FloatField(default=0)
+
+    class Meta:
+        db_table = "response_answer"
+        constraints = [
+            models.UniqueConstraint(fields=['response', 'question'], name='response_answer_unique'),
+        ]
+
+
+class ResponseCategoryScore(models.Model):
+    """The normalized score of one category of a finalized response, None when the category can't be scored"""
+    response = models.ForeignKey(UserResponse, on_delete=models.CASCADE, related_name='category_scores')
+    quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE)
+    category = models.ForeignKey(Category, on_delete=models.SET_NULL, blank=True, null=True)
+    score = models.FloatField(blank=True, null=True)
+
+    class Meta:
+        db_table = "response_category_score"
+        constraints = [
+            models.UniqueConstraint(fields=['response', 'category'], name='response_category_score_unique'),
+        ]
+        indexes = [
+            # Score distributions and ranges of a category across responses
+            models.Index(fields=['category', 'score'], name='response_category_score_idx'),
+        ]
+
+
+class QuizSnapshot(models.Model):
+    """
+    An immutable copy of a compiled quiz, published by the compiled module whenever the quiz changed.
+    Takers and caches pin the version, the number and the start of the hash of the content.
+    """
+    quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE, related_name='snapshots')
+    number = models.PositiveIntegerField()
+    # sha256 of the content
+    content_hash = models.CharField(max_length=64)
+    content = models.TextField()
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return '%s version %d' % (self.quiz, self.number)
+
+    class Meta:
+        db_table = "quiz_snapshot"
+        constraints = [
+            models.UniqueConstraint(fields=['quiz', 'number'], name='quiz_snapshot_unique'),
+        ]
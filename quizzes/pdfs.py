@@ -0,0 +1,284 @@
+import functools
+import hashlib
+import logging
+import multiprocessing
+import tempfile
+import threading
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.template.loader import get_template
+from django.utils import timezone
+from .instrumentation import timer
+from .models import UserResponse
+from .reports import build_feedback_report
+from .render import PDFRenderError, html_to_pdf, warm_up
+from .utils import ID_BATCH_SIZE, iter_batches
+
+logger = logging.getLogger(__name__)
+
+# Feedback PDFs are rendered once per finalized UserResponse and stored in its feedback_pdf field,
+# get_feedback_pdf only serves the stored file. QUIZ_PDF_RUNNER picks who renders them:
+#   'process' - a pool of QUIZ_PDF_WORKERS processes next to the web process (default)
+#   'command' - `manage.py render_feedback_pdfs`, the web process only serves finished PDFs
+#   'sync'    - the request or finalization that needs the PDF, as before
+# The template is rendered in the web process, only the xhtml2pdf work happens in the worker processes.
+# A PDF xhtml2pdf can't render is marked as failed on its response instead of being retried on every request.
+
+FEEDBACK_PDF_TEMPLATE = 'quizzes/get_feedback_pdf.html'
+
+# Most responses merged into one PDF by an export, a merged PDF is held in memory until it is written
+QUIZ_PDF_MERGE_MAX_RESPONSES = getattr(settings, 'QUIZ_PDF_MERGE_MAX_RESPONSES', 200)
+
+_process_pool = None
+_thread_pool = None
+_pool_lock = threading.Lock()
+_queued = set()
+
+
+def pdf_runner():
+    return getattr(settings, 'QUIZ_PDF_RUNNER', 'process')
+
+
+def get_pools():
+    global _process_pool, _thread_pool
+    with _pool_lock:
+        if _process_pool is None:
+            workers = getattr(settings, 'QUIZ_PDF_WORKERS', 2)
+            _process_pool = new_process_pool(workers)
+            # One thread per worker process waits for its PDF and stores it
+            _thread_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='feedback-pdf')
+        return _process_pool, _thread_pool
+
+
+def new_process_pool(workers):
+    # Spawned, not forked, so the workers don't inherit the web process' threads and connections.
+    # The workers live on between documents, so fonts and xhtml2pdf are only loaded once per worker.
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                               initializer=warm_up)
+
+
+def feedback_pdf_context(user):
+    return {
+        'user_id': user.response_id,
+        'today': timezone.now(),
+        'quiz': user.parent_quiz,
+        'report': build_feedback_report(user.response_data),
+    }
+
+
+def feedback_pdf_html(user, template=None):
+    return (template or get_template(FEEDBACK_PDF_TEMPLATE)).render(feedback_pdf_context(user))
+
+
+def store_feedback_pdf(user, pdf):
+    """Saves rendered PDF bytes as the feedback_pdf of a UserResponse, with their content hash"""
+    user.feedback_pdf_hash = hashlib.sha256(pdf).hexdigest()
+    user.feedback_pdf.save('feedback_%s.pdf' % user.response_id, ContentFile(pdf), save=False)
+    UserResponse.objects.filter(pk=user.pk).update(feedback_pdf=user.feedback_pdf.name,
+                                                   feedback_pdf_hash=user.feedback_pdf_hash)
+
+
+def mark_feedback_pdf_failed(user):
+    logger.exception('Feedback PDF of response %s could not be rendered', user.response_id)
+    user.feedback_pdf_failed = True
+    UserResponse.objects.filter(pk=user.pk).update(feedback_pdf_failed=True)
+
+
+def render_feedback_pdf(response_pk, process_pool=None):
+    """
+    Renders and stores the feedback PDF of a finalized UserResponse, in `process_pool` if given.
+    Returns the UserResponse, or None when it is gone, not finalized, already has its PDF or it failed
+    """
+    user = UserResponse.objects.select_related('parent_quiz').filter(pk=response_pk).first()
+    if user is None or not user.is_finalized() or user.feedback_pdf or user.feedback_pdf_failed:
+        return None
+    html = feedback_pdf_html(user)
+    try:
+        with timer('pdf'):
+            pdf = html_to_pdf(html) if process_pool is None else process_pool.submit(html_to_pdf, html).result()
+    except PDFRenderError:
+        mark_feedback_pdf_failed(user)
+        return None
+    store_feedback_pdf(user, pdf)
+    return user
+
+
+def run_pdf_job(response_pk):
+    try:
+        return render_feedback_pdf(response_pk, get_pools()[0])
+    except Exception:
+        logger.exception('Feedback PDF job for response %s crashed', response_pk)
+    finally:
+        _queued.discard(response_pk)
+        close_old_connections()
+
+
+def queue_feedback_pdf(response_pk):
+    """
+    Hands the feedback PDF of a UserResponse to the configured runner, unless it is already queued.
+    With the 'sync' runner the PDF is rendered before this returns.
+    """
+    runner = pdf_runner()
+    if runner == 'sync':
+        render_feedback_pdf(response_pk)
+    elif runner == 'process':
+        with _pool_lock:
+            if response_pk in _queued:
+                return
+            _queued.add(response_pk)
+        transaction.on_commit(lambda: get_pools()[1].submit(run_pdf_job, response_pk))
+
+
+def render_pending_pdfs(workers=1):
+    """
+    Renders the feedback PDFs of every finalized response that doesn't have one yet,
+    `workers` processes at a time. Used by the render_feedback_pdfs management command.
+
+    Returns the number of PDFs rendered
+    """
+    response_pks = list(UserResponse.objects.filter(response_data__isnull=False, feedback_pdf_failed=False).filter(
+        Q(feedback_pdf='') | Q(feedback_pdf__isnull=True)).order_by('id').values_list('id', flat=True))
+    if workers <= 1:
+        return len([user for user in map(render_feedback_pdf, response_pks) if user is not None])
+    with new_process_pool(workers) as pool, \
+            ThreadPoolExecutor(max_workers=workers) as threads:
+        def render(response_pk):
+            try:
+                return render_feedback_pdf(response_pk, pool)
+            finally:
+                close_old_connections()
+        return len([user for user in threads.map(render, response_pks) if user is not None])
+
+
+def discard_feedback_pdfs(response_pks):
+    """
+    Drops the stored feedback PDFs of responses whose data changed, they are rendered again when next needed,
+    failed ones included. The files are deleted once the transaction commits.
+    """
+    names = []
+    for batch in iter_batches(response_pks, ID_BATCH_SIZE):
+        responses = UserResponse.objects.filter(pk__in=batch)
+        names.extend(responses.exclude(Q(feedback_pdf='') | Q(feedback_pdf__isnull=True)).values_list(
+            'feedback_pdf', flat=True))
+        responses.exclude(Q(feedback_pdf='') | Q(feedback_pdf__isnull=True), feedback_pdf_failed=False).update(
+            feedback_pdf=None, feedback_pdf_hash=None, feedback_pdf_failed=False)
+    transaction.on_commit(lambda: [default_storage.delete(name) for name in names])
+
+
+def iter_responses(response_pks, batch_size=100):
+    """
+    Yields UserResponses by primary key, fetched `batch_size` at a time. Stored PDFs are written while
+    the responses are read, which a single open cursor over the same table doesn't allow on every database.
+    """
+    for batch in iter_batches(response_pks, batch_size):
+        responses = UserResponse.objects.select_related('parent_quiz').in_bulk(batch)
+        for pk in batch:
+            if pk in responses:
+                yield responses[pk]
+
+
+def iter_feedback_pdfs(responses, process_pool=None, window=None):
+    """
+    Yields (UserResponse, pdf bytes) for finalized responses, in order. Stored PDFs are read from storage,
+    missing ones are rendered in `process_pool` if given and stored for next time.
+    At most `window` documents are in flight, so memory doesn't grow with the number of responses.
+    Responses whose PDF can't be rendered are marked as failed and left out.
+    """
+    template = get_template(FEEDBACK_PDF_TEMPLATE)
+    window = window or getattr(settings, 'QUIZ_PDF_WORKERS', 2) * 2
+    pending = deque()
+
+    def finish(user, future):
+        if future is None:
+            with user.feedback_pdf.open('rb') as pdf_file:
+                return pdf_file.read()
+        try:
+            with timer('pdf'):
+                pdf = future.result() if process_pool is not None else future()
+        except PDFRenderError:
+            mark_feedback_pdf_failed(user)
+            return None
+        store_feedback_pdf(user, pdf)
+        return pdf
+
+    for user in responses:
+        if not user.is_finalized() or user.feedback_pdf_failed:
+            continue
+        if user.feedback_pdf:
+            future = None
+        elif process_pool is not None:
+            future = process_pool.submit(html_to_pdf, feedback_pdf_html(user, template))
+        else:
+            future = functools.partial(html_to_pdf, feedback_pdf_html(user, template))
+        pending.append((user, future))
+        if len(pending) >= window:
+            user, future = pending.popleft()
+            pdf = finish(user, future)
+            if pdf is not None:
+                yield user, pdf
+    while pending:
+        user, future = pending.popleft()
+        pdf = finish(user, future)
+        if pdf is not None:
+            yield user, pdf
+
+
+class StreamBuffer:
+    """Write-only file for zipfile, whatever was written so far is taken out with pop()"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_pdf_zip(documents):
+    """
+    Yields a ZIP archive of (UserResponse, pdf bytes) pairs piece by piece, one document at a time.
+    PDFs are compressed already, so they are stored as they are.
+    """
+    stream = StreamBuffer()
+    with zipfile.ZipFile(stream, 'w', zipfile.ZIP_STORED) as archive:
+        for user, pdf in documents:
+            archive.writestr('feedback_%s.pdf' % user.response_id, pdf)
+            yield stream.pop()
+    yield stream.pop()
+
+
+def stream_merged_pdf(documents, chunk_size=64 * 1024):
+    """
+    Yields one PDF with the pages of every (UserResponse, pdf bytes) pair.
+    A PDF can only be written once all its pages are known, so unlike the ZIP archive the merged document
+    is built in memory, which is why exports cap it at QUIZ_PDF_MERGE_MAX_RESPONSES documents. It is then
+    written to a temporary file and streamed from there.
+    """
+    try:
+        from pypdf import PdfReader, PdfWriter
+    except ImportError:  # Older xhtml2pdf releases depend on PyPDF2
+        from PyPDF2 import PdfReader, PdfWriter
+    writer = PdfWriter()
+    for user, pdf in documents:
+        for page in PdfReader(BytesIO(pdf)).pages:
+            writer.add_page(page)
+    with tempfile.TemporaryFile() as output:
+        writer.write(output)
+        output.seek(0)
+        for chunk in iter(lambda: output.read(chunk_size), b''):
+            yield chunk
@@ -0,0 +1,163 @@
+from urllib.parse import urlencode
+from django.conf import settings
+from django.core import signing
+from .compiled import get_quiz_tree
+
+# An in-progress quiz is kept as a small, id-based record instead of dictionaries keyed by
+# category names and question text:
+#     {'r': response_id, 'a': [answer ids in question order, 0 if unanswered], 's': [category sums],
+#      'v': version of the compiled quiz}
+# The text-keyed dictionaries stored on the UserResponse are only built once, when the quiz is finished.
+# The record is pinned to the quiz version it started on, so a quiz edited or uploaded again while it is
+# being taken doesn't end the attempt: it goes on with the snapshot of that version (see the compiled module).
+#
+# QUIZ_PROGRESS_BACKEND picks where the record is kept between questions:
+#   'session' - in the session, starting a quiz flushes the session (default)
+#   'signed'  - in a signed token that travels in the question urls and forms as `progress`. Taking a quiz
+#               then doesn't touch the session at all, the UserResponse is only created once the last
+#               answer is submitted. The token holds one id per question, so urls grow with the quiz.
+
+PROGRESS_TOKEN_SALT = 'quizzes.progress'
+
+# Seconds a signed progress token stays valid
+QUIZ_PROGRESS_TOKEN_MAX_AGE = getattr(settings, 'QUIZ_PROGRESS_TOKEN_MAX_AGE', 60 * 60 * 24)
+
+
+def progress_backend():
+    return getattr(settings, 'QUIZ_PROGRESS_BACKEND', 'session')
+
+
+def progress_session_key(quiz_id):
+    return str(quiz_id) + "_progress"
+
+
+class QuizProgress:
+    """
+    The answers selected so far in one attempt at a compiled quiz,
+    plus the running sum of answer weights for every category.
+    """
+
+    def __init__(self, quiz, response_id, answers=None, sums=None):
+        self.quiz = quiz
+        self.response_id = response_id
+        self.answers = answers if answers is not None else [0] * len(quiz.questions)
+        self.sums = sums if sums is not None else [0.0] * len(quiz.categories)
+
+    @classmethod
+    def from_data(cls, quiz, data):
+        """
+        Returns the progress of a stored record on the version of the quiz it is pinned to,
+        or None when there is none or it doesn't fit the quiz anymore
+        """
+        if data and data.get('v') and data['v'] != quiz.version:
+            quiz = get_quiz_tree(quiz.id, data['v'])
+        if not data or len(data['a']) != len(quiz.questions) or len(data['s']) != len(quiz.categories):
+            return None
+        return cls(quiz, data['r'], data['a'], data['s'])
+
+    @classmethod
+    def from_session(cls, session, quiz):
+        """Returns the progress stored in the session for a quiz, or None"""
+        return cls.from_data(quiz, session.get(progress_session_key(quiz.id)))
+
+    @classmethod
+    def from_token(cls, token, quiz):
+        """Returns the progress in a signed token for a quiz, or None when it is missing, tampered or expired"""
+        try:
+            data = signing.loads(token or '', salt=PROGRESS_TOKEN_SALT, max_age=QUIZ_PROGRESS_TOKEN_MAX_AGE)
+        except signing.BadSignature:
+            return None
+        if not isinstance(data, dict) or data.get('q') != quiz.id:
+            return None
+        return cls.from_data(quiz, data)
+
+    def data(self):
+        return {'r': self.response_id, 'a': self.answers, 's': self.sums, 'v': self.quiz.version}
+
+    def save(self, session):
+        session[progress_session_key(self.quiz.id)] = self.data()
+
+    def token(self):
+        """The progress as a signed token, see the top of this module"""
+        return signing.dumps(dict(self.data(), q=self.quiz.id), salt=PROGRESS_TOKEN_SALT, compress=True)
+
+    def select(self, question, answer):
+        """Records `answer` for `question`, replacing an earlier answer to the same question"""
+        index = self.quiz.question_index[question.id]
+        category_index = self.quiz.category_index[question.category_id]
+        previous = question.get_answer(self.answers[index])
+        if previous is not None:
+            self.sums[category_index] -= previous.weight
+        self.answers[index] = answer.id
+        self.sums[category_index] += answer.weight
+
+    def category_sums(self):
+        """Returns pairs of (category, sum of selected answer weights) in quiz order"""
+        return zip(self.quiz.categories, self.sums)
+
+    def selected_answers(self):
+        """Yields (category, question, answer) for every question in quiz order, answer is None if unanswered"""
+        answer_ids = iter(self.answers)
+        for category in self.quiz.categories:
+            for question, answer_id in zip(category.questions, answer_ids):
+                yield category, question, question.get_answer(answer_id)
+
+    def answer_ids(self):
+        """Selected answers formatted: {question_id: answer_id}"""
+        return {str(question.id): answer.id for category, question, answer in self.selected_answers() if answer}
+
+    def quiz_data(self):
+        """
+        Selected answers formatted:
+        {category_name: {question_text: answer_text} }
+        """
+        data = {category.name: {} for category in self.quiz.categories}
+        for category, question, answer in self.selected_answers():
+            data[category.name][question.text] = answer.text if answer is not None else None
+        return data
+
+    def feedback_data(self):
+        """
+        Feedback for the selected answers formatted:
+        {category_name: {question_text : feedback_text} }
+        """
+        data = {category.name: {} for category in self.quiz.categories}
+        for category, question, answer in self.selected_answers():
+            if answer is None:
+                continue
+            answer_feedback = answer.feedback
+            if answer.weight == 1 and answer_feedback == "No Feedback":
+                answer_feedback = None
+            if answer.weight <= 1:
+                data[category.name][question.text] = answer_feedback
+        return data
+
+    def response_data(self, scorer):
+        """The response data of the finished quiz, as stored on its UserResponse, scored by `scorer`"""
+        return {
+            'quiz_data': self.quiz_data(),
+            'quiz_norm_scores': scorer.score(self.answers),
+            'feedback_data': self.feedback_data(),
+            'answer_ids': self.answer_ids(),
+        }
+
+
+def load_progress(request, quiz):
+    """
+    Returns the QuizProgress of the request for a compiled quiz from the QUIZ_PROGRESS_BACKEND, or None.
+    Its quiz is the version the progress is pinned to, which may be older than `quiz`
+    """
+    if progress_backend() == 'signed':
+        return QuizProgress.from_token(request.POST.get('progress') or request.GET.get('progress'), quiz)
+    return QuizProgress.from_session(request.session, quiz)
+
+
+def progress_query(progress):
+    """
+    The query string that carries the progress to the next question: the pinned quiz version,
+    and the progress itself when it is signed
+    """
+    query = {'v': progress.quiz.version}
+    if progress_backend() == 'signed':
+        query['progress'] = progress.token()
+    return '?' + urlencode(query, safe=':')
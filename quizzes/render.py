@@ -7,15 +7,37 @@ import xhtml2pdf.pisa as pisa
 # https://codeburst.io/django-render-html-to-pdf-41a2b9c41d16
 
 
+class PDFRenderError(Exception):
+    """Raised when xhtml2pdf can't turn a document into a PDF"""
+
+
+def html_to_pdf(html: str):
+    """
+    Turns an HTML document into PDF bytes. Needs no Django setup,
+    so it can run in freshly spawned worker processes.
+    """
+    response = BytesIO()
+    pdf = pisa.pisaDocument(BytesIO(html.encode("UTF-8")), response)
+    if pdf.err:
+        raise PDFRenderError('xhtml2pdf reported %d error(s)' % pdf.err)
+    return response.getvalue()
+
+
+def warm_up():
+    """
+    Renders an empty document so a worker process has xhtml2pdf, reportlab and their fonts
+    loaded before its first real document. Used as a process pool initializer.
+    """
+    html_to_pdf('<html><body><p>&nbsp;</p></body></html>')
+
+
 class Render:
 
     @staticmethod
     def render(path: str, params: dict):
         template = get_template(path)
         html = template.render(params)
-        response = BytesIO()
-        pdf = pisa.pisaDocument(BytesIO(html.encode("UTF-8")), response)
-        if not pdf.err:
-            return HttpResponse(response.getvalue(), content_type='application/pdf')
-        else:
-            return HttpResponse("Error Rendering PDF", status=400)
\ No newline at end of file
+        try:
+            return HttpResponse(html_to_pdf(html), content_type='application/pdf')
+        except PDFRenderError:
+            return HttpResponse("Error Rendering PDF", status=400)
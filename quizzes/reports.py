@@ -0,0 +1,89 @@
+from typing import NamedTuple, Optional, Tuple
+from django.conf import settings
+from django.core.cache import caches
+
+
+# The feedback page and the feedback pdf render a FeedbackReport: the stored response data of a
+# UserResponse flattened once into categories in quiz order, each with its score and the answered
+# questions. The templates loop over it once instead of matching the stored dictionaries against
+# each other by position and text.
+
+# Number of lowest scoring categories shown on the feedback page
+FEEDBACK_SECTIONS = 2
+
+# Rendered feedback pages are cached per UserResponse in QUIZ_FEEDBACK_CACHE, which should be a backend every
+# web process shares (file or database cache locally, Redis or Memcached in production). An entry is
+# stored with the updated_at of the response it was rendered from and is dropped when the response changes.
+QUIZ_FEEDBACK_CACHE = getattr(settings, 'QUIZ_FEEDBACK_CACHE', 'default')
+QUIZ_FEEDBACK_CACHE_TIMEOUT = getattr(settings, 'QUIZ_FEEDBACK_CACHE_TIMEOUT', 60 * 60 * 24)
+
+
+class QuestionFeedback(NamedTuple):
+    question: str
+    answer: Optional[str]
+    feedback: Optional[str]
+    # Answers weighing more than 1 have no feedback entry at all, as opposed to an entry without text
+    has_feedback_entry: bool
+
+
+class CategoryFeedback(NamedTuple):
+    name: str
+    score: Optional[float]
+    questions: Tuple[QuestionFeedback, ...]
+
+    def questions_with_feedback(self):
+        return [question for question in self.questions if question.feedback is not None]
+
+
+class FeedbackReport(NamedTuple):
+    categories: Tuple[CategoryFeedback, ...]
+    # The FEEDBACK_SECTIONS categories with the lowest scores, lowest first
+    lowest_categories: Tuple[CategoryFeedback, ...]
+
+
+def score_sort_key(category):
+    """Sorts categories lowest score first, categories without a score last"""
+    return category.score is None, category.score or 0
+
+
+def build_feedback_report(response_data, sections=FEEDBACK_SECTIONS):
+    """Builds the FeedbackReport of the response data stored on a finished UserResponse"""
+    quiz_data = response_data.get('quiz_data') or {}
+    norm_scores = response_data.get('quiz_norm_scores') or {}
+    feedback_data = response_data.get('feedback_data') or {}
+
+    categories = []
+    for name in list(quiz_data) + [name for name in norm_scores if name not in quiz_data]:
+        category_feedback = feedback_data.get(name) or {}
+        categories.append(CategoryFeedback(name, norm_scores.get(name), tuple(
+            QuestionFeedback(question, answer, category_feedback.get(question), question in category_feedback)
+            for question, answer in (quiz_data.get(name) or {}).items()
+        )))
+    return FeedbackReport(
+        categories=tuple(categories),
+        lowest_categories=tuple(sorted(categories, key=score_sort_key)[:sections]),
+    )
+
+
+def feedback_cache():
+    return caches[QUIZ_FEEDBACK_CACHE]
+
+
+def feedback_page_key(response_pk):
+    return 'quizzes:feedback_page:%s' % response_pk
+
+
+def get_cached_feedback_page(response_pk, updated_at):
+    """Returns the cached feedback page of a response, or None if there is none for its current data"""
+    cached = feedback_cache().get(feedback_page_key(response_pk))
+    if cached is None or cached[0] != updated_at:
+        return None
+    return cached[1]
+
+
+def cache_feedback_page(response_pk, updated_at, page):
+    feedback_cache().set(feedback_page_key(response_pk), (updated_at, page), QUIZ_FEEDBACK_CACHE_TIMEOUT)
+
+
+def invalidate_feedback_pages(response_pks):
+    feedback_cache().delete_many([feedback_page_key(response_pk) for response_pk in response_pks])
@@ -0,0 +1,228 @@
+import functools
+from django.conf import settings
+from django.utils.module_loading import import_string
+from .compiled import QUIZ_TREE_LRU_SIZE, get_quiz_tree, load_quiz_tree
+from .progress import QuizProgress
+
+try:
+    import numpy
+except ImportError:  # The batch API falls back to scoring one response at a time
+    numpy = None
+
+
+# Category scores are normalized from the range a category can actually reach, the sum of the lowest
+# and of the highest answer weight of every question in it, onto QUIZ_SCORE_RANGE (0 - 10 by default).
+# QUIZ_SCORING_STRATEGY names the class that decides what an answer counts for and how a category's
+# position in its range maps onto the score range.
+
+
+def get_score_range():
+    low, high = getattr(settings, 'QUIZ_SCORE_RANGE', (0, 10))
+    return float(low), float(high)
+
+
+def get_scoring_strategy():
+    return import_string(getattr(settings, 'QUIZ_SCORING_STRATEGY', 'quizzes.scoring.LinearScoring'))()
+
+
+class LinearScoring:
+    """Answers count for their weight, category sums are mapped linearly onto the score range"""
+
+    def answer_weights(self, question):
+        """Returns the weight each answer of a compiled question counts for, in answer order"""
+        return [answer.weight for answer in question.answers]
+
+    def scale(self, fraction):
+        """
+        Maps the position of a category sum in its range, between 0 and 1, onto 0 - 1.
+        Gets a float, or a numpy array when responses are scored in batches.
+        """
+        return fraction
+
+
+class QuestionNormalizedScoring(LinearScoring):
+    """Every question counts the same, answer weights are rescaled to 0 - 1 within their question"""
+
+    def answer_weights(self, question):
+        weights = super().answer_weights(question)
+        if not weights:
+            return weights
+        low, high = min(weights), max(weights)
+        if low == high:
+            return [0.0 for weight in weights]
+        return [(weight - low) / (high - low) for weight in weights]
+
+
+class CurvedScoring(LinearScoring):
+    """Spreads out the top of the score range, a category halfway through its range scores a quarter"""
+    exponent = 2
+
+    def scale(self, fraction):
+        return fraction ** self.exponent
+
+
+class QuizScorer:
+    """
+    Scores responses to one compiled quiz.
+    Responses are given as answer ids in quiz question order, 0 or an unknown id for an unanswered question.
+    An unanswered question counts for its lowest answer weight.
+    """
+
+    def __init__(self, quiz, strategy=None, score_range=None):
+        self.quiz = quiz
+        self.strategy = strategy if strategy is not None else get_scoring_strategy()
+        self.low, self.high = score_range if score_range is not None else get_score_range()
+        self.category_names = [category.name for category in quiz.categories]
+
+        # {answer_id: weight}
+        self.weights = {}
+        # Per question in quiz order: position of its category, lowest weight
+        self.question_categories = []
+        self.question_minimums = []
+        # Per category: lowest and highest reachable sum
+        self.minimums = [0.0] * len(quiz.categories)
+        self.maximums = [0.0] * len(quiz.categories)
+        for category_index, category in enumerate(quiz.categories):
+            for question in category.questions:
+                weights = [float(weight) for weight in self.strategy.answer_weights(question)]
+                self.weights.update(zip((answer.id for answer in question.answers), weights))
+                self.question_categories.append(category_index)
+                self.question_minimums.append(min(weights, default=0.0))
+                self.minimums[category_index] += min(weights, default=0.0)
+                self.maximums[category_index] += max(weights, default=0.0)
+        self._text_index = None
+
+    def normalize(self, category_index, category_sum):
+        """Returns the score of a category sum, None if the category's range is empty"""
+        low, high = self.minimums[category_index], self.maximums[category_index]
+        if high <= low:
+            return None
+        fraction = min(max((category_sum - low) / (high - low), 0.0), 1.0)
+        return round(self.low + (self.high - self.low) * self.strategy.scale(fraction), 2)
+
+    def category_sums(self, answer_ids):
+        sums = [0.0] * len(self.category_names)
+        for category_index, minimum, answer_id in zip(self.question_categories, self.question_minimums, answer_ids):
+            sums[category_index] += self.weights.get(answer_id, minimum)
+        return sums
+
+    def score(self, answer_ids):
+        """
+        Scores one response.
+
+        Dictionary format: {category_name : normalized score}
+        """
+        return {
+            name: self.normalize(category_index, category_sum)
+            for category_index, (name, category_sum) in enumerate(zip(self.category_names,
+                                                                      self.category_sums(answer_ids)))
+        }
+
+    def score_many(self, rows):
+        """
+        Scores many responses at once, with numpy when it is installed.
+        Returns a list of {category_name : normalized score}, in the order of `rows`
+        """
+        rows = list(rows)
+        if numpy is None or not rows or not self.question_categories:
+            return [self.score(answer_ids) for answer_ids in rows]
+
+        question_count = len(self.question_categories)
+        selected = numpy.zeros((len(rows), question_count), dtype=numpy.int64)
+        for row, answer_ids in enumerate(rows):
+            answer_ids = list(answer_ids)[:question_count]
+            selected[row, :len(answer_ids)] = answer_ids
+
+        # Look the weights up by binary search over the sorted answer ids
+        known_ids = numpy.array(sorted(self.weights), dtype=numpy.int64)
+        known_weights = numpy.array([self.weights[answer_id] for answer_id in known_ids.tolist()], dtype=float)
+        if len(known_ids):
+            positions = numpy.clip(numpy.searchsorted(known_ids, selected), 0, len(known_ids) - 1)
+            found = known_ids[positions] == selected
+            weights = numpy.where(found, known_weights[positions], numpy.array(self.question_minimums))
+        else:
+            weights = numpy.zeros(selected.shape)
+
+        # Summing the weights per category is a product with the question/category membership matrix
+        membership = numpy.zeros((question_count, len(self.category_names)))
+        membership[numpy.arange(question_count), self.question_categories] = 1
+        sums = weights @ membership
+
+        minimums = numpy.array(self.minimums)
+        spans = numpy.array(self.maximums) - minimums
+        scorable = spans > 0
+        fractions = numpy.clip(numpy.divide(sums - minimums, spans, out=numpy.zeros_like(sums), where=scorable),
+                               0.0, 1.0)
+        scores = numpy.round(self.low + (self.high - self.low) * self.strategy.scale(fractions), 2)
+        return [
+            {name: score if ok else None for name, score, ok in zip(self.category_names, row, scorable.tolist())}
+            for row in scores.tolist()
+        ]
+
+    def stored_answer_ids(self, response_data):
+        """
+        Returns the answer ids of a stored response in quiz question order.
+        Uses the stored answer_ids, and falls back to matching the text-keyed quiz_data for
+        responses saved before answer ids were kept or whose answers have been recreated since.
+        """
+        response_data = response_data or {}
+        stored_ids = response_data.get('answer_ids') or {}
+        quiz_data = response_data.get('quiz_data') or {}
+        answer_ids = []
+        for category in self.quiz.categories:
+            for question in category.questions:
+                answer_id = stored_ids.get(str(question.id))
+                if answer_id not in self.weights:
+                    answer_text = (quiz_data.get(category.name) or {}).get(question.text)
+                    answer_id = self.text_index().get((question.id, answer_text), 0)
+                answer_ids.append(answer_id)
+        return answer_ids
+
+    def text_index(self):
+        if self._text_index is None:
+            self._text_index = {
+                (question.id, answer.text): answer.id
+                for question in self.quiz.questions
+                for answer in reversed(question.answers)
+            }
+        return self._text_index
+
+    def score_responses(self, responses):
+        """Scores stored UserResponse objects, returns a list of {category_name : normalized score}"""
+        return self.score_many(self.stored_answer_ids(response.response_data) for response in responses)
+
+
+@functools.lru_cache(maxsize=QUIZ_TREE_LRU_SIZE)
+def load_scorer(quiz_id, version, strategy, score_range):
+    return QuizScorer(load_quiz_tree(quiz_id, version), import_string(strategy)(), score_range)
+
+
+def get_scorer(quiz):
+    """
+    Returns the QuizScorer for a compiled quiz or a quiz id, with the configured strategy and score range.
+    Scorers are kept per quiz version, so the category ranges are only worked out once.
+    """
+    if not hasattr(quiz, 'version'):
+        quiz = get_quiz_tree(quiz)
+    strategy = getattr(settings, 'QUIZ_SCORING_STRATEGY', 'quizzes.scoring.LinearScoring')
+    return load_scorer(quiz.id, quiz.version, strategy, get_score_range())
+
+
+def rescore_rows(scorer, rows):
+    """
+    Works out the scores and feedback of stored responses again from their answers.
+    `rows` are (pk, response_data) pairs, returns (pk, old response_data, new response_data) for every row
+    whose data changed.
+    """
+    rows = list(rows)
+    answer_rows = [scorer.stored_answer_ids(response_data) for pk, response_data in rows]
+    changed = []
+    for (pk, response_data), answer_ids, scores in zip(rows, answer_rows, scorer.score_many(answer_rows)):
+        progress = QuizProgress(scorer.quiz, None, answer_ids)
+        new_data = dict(response_data or {})
+        new_data['quiz_norm_scores'] = scores
+        new_data['feedback_data'] = progress.feedback_data()
+        new_data['answer_ids'] = progress.answer_ids()
+        if new_data != response_data:
+            changed.append((pk, response_data, new_data))
+    return changed
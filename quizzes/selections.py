@@ -0,0 +1,106 @@
+from collections import defaultdict
+from django.db import transaction
+from .compiled import get_quiz_tree
+from .models import ResponseAnswer, ResponseCategoryScore, UserResponse
+from .progress import QuizProgress
+from .scoring import get_scorer
+from .utils import iter_batches
+
+# Normalized copies of the response data of finalized responses: one ResponseAnswer row per answered question
+# and one ResponseCategoryScore row per category. They are written in bulk whenever response data is stored,
+# by store_finished_response, the write-behind buffer and rescore_responses, so selections and scores can be
+# filtered, joined and aggregated in SQL instead of loading every response_data blob.
+#
+# The text-keyed response data stays on UserResponse for the feedback pages and pdfs, and can be derived
+# from the tables with derive_response_data. Responses finalized before the tables existed are copied
+# with `manage.py build_response_tables`.
+
+# Number of rows inserted per query
+BULK_BATCH_SIZE = 2000
+
+
+def selection_rows(quiz, responses):
+    """
+    Returns the ResponseAnswer and ResponseCategoryScore rows of (pk, response_data) pairs of a compiled quiz
+    """
+    scorer = get_scorer(quiz)
+    category_ids = {category.name: category.id for category in quiz.categories}
+    answers = []
+    scores = []
+    for pk, response_data in responses:
+        for question, answer_id in zip(quiz.questions, scorer.stored_answer_ids(response_data)):
+            answer = question.get_answer(answer_id)
+            if answer is not None:
+                answers.append(ResponseAnswer(response_id=pk, quiz_id=quiz.id, question_id=question.id,
+                                              answer_id=answer.id, weight=answer.weight))
+        for name, score in (response_data.get('quiz_norm_scores') or {}).items():
+            if name in category_ids:
+                scores.append(ResponseCategoryScore(response_id=pk, quiz_id=quiz.id, category_id=category_ids[name],
+                                                    score=score))
+    return answers, scores
+
+
+def write_selections(quiz, responses, replace=True):
+    """
+    Writes the rows of (pk, response_data) pairs of a compiled quiz or a quiz id in bulk.
+    With `replace` the rows the responses had before are deleted first, leave it off for new responses.
+    """
+    if not hasattr(quiz, 'version'):
+        quiz = get_quiz_tree(quiz)
+    responses = [(pk, response_data) for pk, response_data in responses if response_data]
+    if not responses:
+        return
+    answers, scores = selection_rows(quiz, responses)
+    if replace:
+        # A response is never left without rows in between
+        with transaction.atomic():
+            pks = [pk for pk, response_data in responses]
+            ResponseAnswer.objects.filter(response_id__in=pks).delete()
+            ResponseCategoryScore.objects.filter(response_id__in=pks).delete()
+            ResponseAnswer.objects.bulk_create(answers, batch_size=BULK_BATCH_SIZE)
+            ResponseCategoryScore.objects.bulk_create(scores, batch_size=BULK_BATCH_SIZE)
+    else:
+        ResponseAnswer.objects.bulk_create(answers, batch_size=BULK_BATCH_SIZE)
+        ResponseCategoryScore.objects.bulk_create(scores, batch_size=BULK_BATCH_SIZE)
+
+
+def derive_response_data(quiz, response_pks):
+    """
+    Builds the response data of finalized responses of a compiled quiz from their rows in two queries.
+    Returns {pk: response_data}, answers whose question or answer was deleted since are left out.
+    """
+    answer_rows = defaultdict(dict)
+    for pk, question_id, answer_id in ResponseAnswer.objects.filter(response_id__in=response_pks).values_list(
+            'response_id', 'question_id', 'answer_id'):
+        answer_rows[pk][question_id] = answer_id
+    score_rows = defaultdict(dict)
+    for pk, category_id, score in ResponseCategoryScore.objects.filter(response_id__in=response_pks).values_list(
+            'response_id', 'category_id', 'score'):
+        score_rows[pk][category_id] = score
+
+    derived = {}
+    for pk in set(answer_rows) | set(score_rows):
+        answers = answer_rows[pk]
+        progress = QuizProgress(quiz, None, [answers.get(question.id) or 0 for question in quiz.questions])
+        derived[pk] = {
+            'quiz_data': progress.quiz_data(),
+            'quiz_norm_scores': {category.name: score_rows[pk].get(category.id) for category in quiz.categories},
+            'feedback_data': progress.feedback_data(),
+            'answer_ids': progress.answer_ids(),
+        }
+    return derived
+
+
+def build_selections(quiz_id, chunk_size=2000):
+    """
+    Writes the rows of every finalized response of a quiz again from its response data.
+    Returns the number of responses written
+    """
+    quiz = get_quiz_tree(quiz_id)
+    written = 0
+    responses = UserResponse.objects.filter(parent_quiz_id=quiz_id, response_data__isnull=False).order_by(
+        'id').values_list('id', 'response_data').iterator(chunk_size=chunk_size)
+    for chunk in iter_batches(responses, chunk_size):
+        write_selections(quiz, chunk)
+        written += len(chunk)
+    return written
@@ -0,0 +1,52 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+from .compiled import invalidate_quiz_tree, quiz_signals_are_muted
+from .models import Quiz, Category, Question, Answer, Feedback
+from .pdfs import queue_feedback_pdf
+
+# Sent by store_finished_response, or by the write-behind buffer once it wrote the response (see the writebehind
+# module), when a taker has answered every question and the response data is stored.
+# Arguments: response, the finalized UserResponse
+response_finalized = Signal()
+
+
+def parent_quiz_id(instance):
+    """
+    Finds the quiz a Category, Question, Answer or Feedback belongs to.
+    Rows made through the admin inlines only link to their direct parent, so the parents are followed
+    until one links to a quiz.
+    """
+    if isinstance(instance, Quiz):
+        return instance.id
+    if instance.parent_quiz_id is not None:
+        return instance.parent_quiz_id
+    for field, model in (('parent_answer_id', Answer), ('parent_question_id', Question),
+                         ('parent_category_id', Category)):
+        parent_id = getattr(instance, field, None)
+        if parent_id is not None:
+            parent = model.objects.filter(pk=parent_id).first()
+            return parent_quiz_id(parent) if parent is not None else None
+    return None
+
+
+@receiver(post_save, sender=Quiz)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Question)
+@receiver(post_save, sender=Answer)
+@receiver(post_save, sender=Feedback)
+@receiver(post_delete, sender=Quiz)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Question)
+@receiver(post_delete, sender=Answer)
+@receiver(post_delete, sender=Feedback)
+def quiz_changed(sender, instance, **kwargs):
+    if quiz_signals_are_muted():
+        return
+    quiz_id = parent_quiz_id(instance)
+    if quiz_id is not None:
+        invalidate_quiz_tree(quiz_id)
+
+
+@receiver(response_finalized)
+def render_finalized_pdf(sender, response, **kwargs):
+    queue_feedback_pdf(response.pk)
@@ -0,0 +1,255 @@
+import csv
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+from unittest import skipUnless
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .compiled import get_quiz_tree
+from .models import Quiz
+
+# Benchmarks of the quiz-taking flow and of quiz_upload. Every request is timed and its queries counted,
+# one extra pass runs under tracemalloc for the peak memory. A test fails when an endpoint goes over
+# its budget in BENCHMARK_BUDGETS, which QUIZ_BENCHMARK_BUDGETS in the settings can override per endpoint.
+# They are skipped unless QUIZ_BENCHMARKS is set, the suite stays fast and its timings can't make it flaky.
+#
+# The size of the synthetic quizzes comes from the environment:
+#   QUIZ_BENCHMARK_SIZE         categories x questions per category x answers per question, default 4x10x4
+#   QUIZ_BENCHMARK_ROUNDS       number of times the whole quiz is taken, default 5
+#   QUIZ_BENCHMARK_UPLOAD_SIZE  size of the quiz CSV for quiz_upload, default 10x100x3 (3000 rows)
+#   QUIZ_BENCHMARK_REPORT       path of a JSON file the measurements are written to
+# Run them on their own with: QUIZ_BENCHMARKS=1 pytest quizzes/test_benchmarks.py -s
+# The measurements are printed as a table when the output isn't captured, as with -s.
+
+TEMPLATE_CSV = os.path.join(settings.BASE_DIR, 'Example CSV Files', 'Toaster.csv')
+
+# Query counts of the quiz-taking flow don't depend on the quiz size, those of quiz_upload grow with the
+# number of bulk query batches. finish_quiz writes the response, its selection rows (2 inserts) and the
+# analytics (3 updates in a savepoint) in one transaction, 15 queries with the session. A response that is
+# the first to pick an answer or to land in a score bucket also creates the missing analytics rows: the updates
+# are rolled back to their savepoint and run again after inserting the rows, 10 queries more. The rounds keep
+# picking answers nobody picked before, so the budget is that worst case.
+# Latencies are p99 in milliseconds, memory is the peak in KiB.
+BENCHMARK_BUDGETS = {
+    'start_new_quiz': {'queries': 8, 'p99_ms': 250, 'peak_kib': 2048},
+    'take_quiz': {'queries': 0, 'p99_ms': 100, 'peak_kib': 1024},
+    'select_answer': {'queries': 4, 'p99_ms': 100, 'peak_kib': 2048},
+    'finish_quiz': {'queries': 25, 'p99_ms': 3000, 'peak_kib': 16384},
+    'feedback': {'queries': 6, 'p99_ms': 250, 'peak_kib': 2048},
+    'get_feedback_pdf': {'queries': 2, 'p99_ms': 250, 'peak_kib': 2048},
+    'quiz_upload': {'queries': 100, 'p99_ms': 30000, 'peak_kib': 65536},
+    'quiz_upload_unchanged': {'queries': 40, 'p99_ms': 30000, 'peak_kib': 65536},
+}
+
+
+def benchmark_size(name, default):
+    return tuple(int(part) for part in os.environ.get(name, default).lower().split('x'))
+
+
+def synthetic_quiz_csv(name, categories, questions, answers, template=TEMPLATE_CSV):
+    """
+    Writes a quiz CSV of `categories` x `questions` x `answers` rows, built from the texts of a template CSV.
+    Answer weights are spread evenly from 1 down to 0 within every question.
+    """
+    with open(template, encoding='utf-8-sig', newline='') as template_file:
+        rows = list(csv.reader(template_file, delimiter=',', quotechar='|'))
+    header, rows = rows[0], rows[1:]
+
+    output = io.StringIO()
+    writer = csv.writer(output, delimiter=',', quotechar='|', quoting=csv.QUOTE_MINIMAL, lineterminator='\n')
+    writer.writerow([name, header[1], header[2]])
+    for c in range(categories):
+        for q in range(questions):
+            question_row = rows[(c * questions + q) % len(rows)]
+            for a in range(answers):
+                answer_row = rows[(c * questions * answers + q * answers + a) % len(rows)]
+                weight = 1 - a / (answers - 1) if answers > 1 else 1
+                writer.writerow([
+                    name,
+                    '%s %d' % (rows[c % len(rows)][1], c + 1),
+                    '%s (%d)' % (question_row[2], c * questions + q + 1),
+                    '%s (%d)' % (answer_row[3], a + 1),
+                    round(weight, 2),
+                    'No Feedback' if a == 0 else answer_row[5],
+                ])
+    return output.getvalue()
+
+
+class Measurements:
+    """Query counts, latencies and peak memory per endpoint"""
+
+    def __init__(self):
+        self.queries = defaultdict(list)
+        self.latencies = defaultdict(list)
+        self.peaks = defaultdict(int)
+        self.tracing = False
+
+    def request(self, endpoint, send):
+        if self.tracing:
+            tracemalloc.reset_peak()
+            response = send()
+            self.peaks[endpoint] = max(self.peaks[endpoint], tracemalloc.get_traced_memory()[1] // 1024)
+            return response
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = send()
+            self.latencies[endpoint].append((time.perf_counter() - start) * 1000)
+        self.queries[endpoint].append(len(queries))
+        return response
+
+    def summary(self):
+        summary = {}
+        for endpoint, latencies in self.latencies.items():
+            latencies = sorted(latencies)
+            summary[endpoint] = {
+                'requests': len(latencies),
+                'queries': max(self.queries[endpoint]),
+                'p50_ms': round(statistics.median(latencies), 2),
+                'p99_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))], 2),
+                'peak_kib': self.peaks[endpoint],
+            }
+        return summary
+
+
+@skipUnless(os.environ.get('QUIZ_BENCHMARKS'), 'Set QUIZ_BENCHMARKS=1 to run the benchmarks')
+@override_settings(QUIZ_IMPORT_RUNNER='sync', QUIZ_PDF_RUNNER='sync')
+class BenchmarkTestCase(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # Uploaded quizzes and rendered PDFs go to a media root of their own, removed with the class
+        cls.media_root = tempfile.TemporaryDirectory()
+        cls.media_settings = override_settings(MEDIA_ROOT=cls.media_root.name)
+        cls.media_settings.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        try:
+            super().tearDownClass()
+        finally:
+            cls.media_settings.disable()
+            cls.media_root.cleanup()
+
+    @staticmethod
+    def write_table(summary, output):
+        output.write('\n%-22s %8s %8s %9s %9s %9s\n' % (
+            'endpoint', 'requests', 'queries', 'p50 ms', 'p99 ms', 'peak KiB'))
+        for endpoint, result in summary.items():
+            output.write('%-22s %8d %8d %9.2f %9.2f %9d\n' % (
+                endpoint, result['requests'], result['queries'], result['p50_ms'], result['p99_ms'],
+                result['peak_kib']))
+
+    def assert_within_budgets(self, summary):
+        budgets = dict(BENCHMARK_BUDGETS)
+        budgets.update(getattr(settings, 'QUIZ_BENCHMARK_BUDGETS', {}))
+        report = os.environ.get('QUIZ_BENCHMARK_REPORT')
+        if report:
+            existing = {}
+            if os.path.exists(report):
+                with open(report) as report_file:
+                    existing = json.load(report_file)
+            existing.update(summary)
+            with open(report, 'w') as report_file:
+                json.dump(existing, report_file, indent=2)
+
+        if sys.stdout is sys.__stdout__:
+            self.write_table(summary, sys.stdout)
+        over = [
+            '%s %s: %s > %s' % (endpoint, measure, summary[endpoint][measure], limit)
+            for endpoint in summary
+            for measure, limit in budgets.get(endpoint, {}).items()
+            if summary[endpoint][measure] > limit
+        ]
+        self.assertFalse(over, 'Over budget: ' + ', '.join(over))
+
+
+class QuizFlowBenchmarks(BenchmarkTestCase):
+    def setUp(self):
+        categories, questions, answers = benchmark_size('QUIZ_BENCHMARK_SIZE', '4x10x4')
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        client = Client()
+        client.force_login(admin)
+        contents = synthetic_quiz_csv('Benchmark quiz', categories, questions, answers)
+        client.post(reverse('quiz_upload'), {'file': SimpleUploadedFile('bench.csv', contents.encode('UTF-8'))})
+        self.quiz = Quiz.objects.get(name='Benchmark quiz')
+
+    def take_quiz(self, measurements, round_number):
+        client = Client()
+        quiz = get_quiz_tree(self.quiz.id)
+        response = measurements.request('start_new_quiz', lambda: client.get(
+            reverse('quizzes:start_new_quiz', args=(quiz.id, 0))))
+        for question in quiz.questions:
+            measurements.request('take_quiz', lambda: client.get(response.url))
+            endpoint = 'finish_quiz' if quiz.next_question(question) is None else 'select_answer'
+            answer = question.answers[(round_number + question.id) % len(question.answers)]
+            response = measurements.request(endpoint, lambda: client.post(
+                reverse('quizzes:select_answer', args=(quiz.id, question.category_id, question.id)),
+                {'answer': answer.id}))
+        feedback_url = response.url
+        for repeat in range(2):
+            measurements.request('feedback', lambda: client.get(feedback_url))
+            response = measurements.request('get_feedback_pdf', lambda: client.get(feedback_url + 'pdf/'))
+            self.assertEqual(response.status_code, 200)
+
+    def test_quiz_flow(self):
+        """
+        start_new_quiz -> take_quiz -> select_answer -> feedback -> get_feedback_pdf stay within their budgets
+        """
+        measurements = Measurements()
+        rounds = benchmark_size('QUIZ_BENCHMARK_ROUNDS', '5')[0]
+        # The first round warms the compiled quiz and template caches
+        self.take_quiz(Measurements(), 0)
+        for round_number in range(rounds):
+            self.take_quiz(measurements, round_number)
+        measurements.tracing = True
+        tracemalloc.start()
+        try:
+            self.take_quiz(measurements, rounds)
+        finally:
+            tracemalloc.stop()
+        self.assert_within_budgets(measurements.summary())
+
+
+class QuizUploadBenchmarks(BenchmarkTestCase):
+    def setUp(self):
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+
+    def test_quiz_upload(self):
+        """
+        Uploading a multi-thousand-row quiz CSV, and uploading it again unchanged, stay within their budgets
+        """
+        categories, questions, answers = benchmark_size('QUIZ_BENCHMARK_UPLOAD_SIZE', '10x100x3')
+        measurements = Measurements()
+
+        def upload_twice(name):
+            contents = synthetic_quiz_csv(name, categories, questions, answers).encode('UTF-8')
+            for endpoint in ('quiz_upload', 'quiz_upload_unchanged'):
+                response = measurements.request(endpoint, lambda: self.client.post(
+                    reverse('quiz_upload'), {'file': SimpleUploadedFile('bench.csv', contents)}))
+                self.assertContains(response, 'The quiz was uploaded successfully')
+
+        upload_twice('Upload benchmark')
+        self.assertEqual(len(get_quiz_tree(Quiz.objects.get(name='Upload benchmark').id).questions),
+                         categories * questions)
+        measurements.tracing = True
+        tracemalloc.start()
+        try:
+            upload_twice('Traced upload benchmark')
+        finally:
+            tracemalloc.stop()
+        self.assert_within_budgets(measurements.summary())
@@ -1,20 +1,73 @@
 from django.test import TestCase
 
+import asyncio
+import csv
 import datetime
+import json
+import os
+import shutil
+import tempfile
+import threading
+import zipfile
+from contextlib import contextmanager
+from io import BytesIO, StringIO
+from unittest import mock, skipIf
+
+from asgiref.sync import sync_to_async
 
 from django.test import TestCase
 from django.utils import timezone
-from django.urls import reverse
-from django.test import Client
+from django.urls import include, path, resolve, reverse
+from django.utils.html import escape
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
 
-from .models import Quiz, Category, Question, Answer, Feedback, UserResponse
-from .views import create_user_response, save_user_feedback, feedback, get_feedback_pdf
+from .models import (Quiz, Category, Question, Answer, Feedback, UserResponse, ImportJob, ResponseAnswer,
+                     ResponseCategoryScore, QuizSnapshot)
+from .views import create_user_response, save_user_feedback, feedback, get_feedback_pdf, quiz_upload
+from .urls import quiz_urlpatterns
+from .importer import QuizImporter, import_quiz_csv, iter_upload_lines
+from . import jobs
+from .jobs import claim_job, run_pending_jobs
+from . import compiled
+from .compiled import get_quiz_tree
+from .progress import QuizProgress, progress_session_key
+from . import scoring
+from .scoring import QuizScorer, QuestionNormalizedScoring, get_scorer
+from .reports import build_feedback_report
+from .selections import derive_response_data
+from .pdfs import discard_feedback_pdfs
+from .render import PDFRenderError
+from . import exports
+from . import instrumentation, writebehind
+from .writebehind import ResponseBuffer
+from .signals import response_finalized
 
 
 # Built following alongside Django Software Foundation's Writing your first Django app Tutorial
 # https://docs.djangoproject.com/en/3.0/intro/tutorial01/
 # Making a change to trigger travis
 
+@contextmanager
+def committed():
+    """
+    Runs the on_commit callbacks added in the block as if its transaction committed, then the callbacks those add
+    in turn. The transaction of a test never commits, and captureOnCommitCallbacks doesn't run nested callbacks
+    """
+    start = len(connection.run_on_commit)
+    yield
+    while len(connection.run_on_commit) > start:
+        callbacks = connection.run_on_commit[start:]
+        del connection.run_on_commit[start:]
+        for sids, callback in callbacks:
+            callback()
+
+
 def create_quiz(quiz_name, days, active_level):
     """
     Create a quizzes with the given `quiz_name`, created the
@@ -23,18 +76,19 @@ def create_quiz(quiz_name, days, active_level):
     "active_level" is a boolean, with False meaning Inactive and True meaning active.
     """
     time = timezone.now() + datetime.timedelta(days=days)
-    quiz = Quiz.objects.create(name=quiz_name, pub_date=time, active_quiz=active_level)
-    category = Category.objects.create(parent_quiz=quiz, category_name="test catergory")
-    question = Question.objects.create(parent_quiz=quiz, parent_category=category,
-                                       question_text="How's this test question?")
-    answer_1h = Answer.objects.create(parent_quiz=quiz, parent_category=category, parent_question=question,
-                                      answer_text="Great!", answer_weight=1)
-    answer_1l = Answer.objects.create(parent_quiz=quiz, parent_category=category, parent_question=question,
-                                      answer_text="BOO!", answer_weight=0)
-    feedback_1h = Feedback.objects.create(parent_quiz=quiz, parent_category=category, parent_question=question,
-                                          parent_answer=answer_1h, feedback_text="No feedback")
-    feedback_1l = Feedback.objects.create(parent_quiz=quiz, parent_category=category, parent_question=question,
-                                          parent_answer=answer_1l, feedback_text="Give up, it be hopeless")
+    with committed():
+        quiz = Quiz.objects.create(name=quiz_name, pub_date=time, active_quiz=active_level)
+        category = Category.objects.create(parent_quiz=quiz, category_name="test catergory")
+        question = Question.objects.create(parent_quiz=quiz, parent_category=category,
+                                           question_text="How's this test question?")
+        answer_1h = Answer.objects.create(parent_quiz=quiz, parent_category=category, parent_question=question,
+                                          answer_text="Great!", answer_weight=1)
+        answer_1l = Answer.objects.create(parent_quiz=quiz, parent_category=category, parent_question=question,
+                                          answer_text="BOO!", answer_weight=0)
+        feedback_1h = Feedback.objects.create(parent_quiz=quiz, parent_category=category, parent_question=question,
+                                              parent_answer=answer_1h, feedback_text="No feedback")
+        feedback_1l = Feedback.objects.create(parent_quiz=quiz, parent_category=category, parent_question=question,
+                                              parent_answer=answer_1l, feedback_text="Give up, it be hopeless")
     return quiz, category, question, answer_1h, answer_1l, feedback_1h, feedback_1l
 
 
@@ -208,4 +262,1457 @@ class CreatingUserResponses(TestCase):
         quiz = create_quiz(quiz_name="test quiz", days=-5, active_level=True)[0]
         responseid = create_user_response(quiz.id)
         userresponse = UserResponse.objects.filter(response_id=responseid)[0]
-        self.assertEqual(userresponse.parent_quiz, quiz)
\ No newline at end of file
+        self.assertEqual(userresponse.parent_quiz, quiz)
+
+    def test_response_ids_unique(self):
+        """
+        Response ids are unique across quizzes, and a quiz isn't limited to 999 responses
+        """
+        quiz = create_quiz(quiz_name="test quiz", days=-5, active_level=True)[0]
+        other_quiz = create_quiz(quiz_name="other quiz", days=-5, active_level=True)[0]
+        ids = [create_user_response(quiz.id) for i in range(1000)] + [create_user_response(other_quiz.id)]
+        self.assertEqual(len(set(ids)), 1001)
+
+    def test_taken_response_id_retried(self):
+        """
+        When a random response id is already taken, another one is drawn
+        """
+        quiz = create_quiz(quiz_name="test quiz", days=-5, active_level=True)[0]
+        taken_id = create_user_response(quiz.id)
+        with mock.patch('quizzes.models.secrets.randbelow', side_effect=[taken_id - 1, taken_id]):
+            self.assertEqual(create_user_response(quiz.id), taken_id + 1)
+
+QUIZ_CSV = (
+    "Upload quiz,2020-08-26,|An uploaded quiz, for testing|\n"
+    "Upload quiz,Category 1,Question 1,Answer 1,1,No Feedback\n"
+    "Upload quiz,Category 1,Question 1,Answer 2,0,Answer 2 feedback\n"
+    "Upload quiz,Category 1,Question 2,Answer 1,1,No Feedback\n"
+    "Upload quiz,Category 1,Question 2,Answer 2,0,Answer 2 feedback\n"
+    "Upload quiz,Category 2,Question 3,Answer 1,1,No Feedback\n"
+    "Upload quiz,Category 2,Question 3,Answer 2,0.5,|Answer 2 feedback, with a comma|\n"
+)
+
+
+class MediaRootTestCase(TestCase):
+    """Uploads and rendered PDFs of these tests go to a media root of their own, removed with the class"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = tempfile.TemporaryDirectory()
+        cls.media_settings = override_settings(MEDIA_ROOT=cls.media_root.name)
+        cls.media_settings.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        try:
+            super().tearDownClass()
+        finally:
+            cls.media_settings.disable()
+            cls.media_root.cleanup()
+
+
+def upload_csv(client, contents, name='quiz.csv'):
+    csv_file = SimpleUploadedFile(name, contents.encode('UTF-8'), content_type='text/csv')
+    return client.post(reverse('quiz_upload'), {'file': csv_file})
+
+
+@override_settings(QUIZ_IMPORT_RUNNER='sync')
+class QuizUploadTests(MediaRootTestCase):
+    def setUp(self):
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+
+    def test_upload_new_quiz(self):
+        """
+        Uploading a CSV creates the quiz and every category, question, answer and feedback in it
+        """
+        response = upload_csv(self.client, QUIZ_CSV)
+        self.assertContains(response, 'The quiz was uploaded successfully')
+        quiz = Quiz.objects.get(name='Upload quiz')
+        self.assertEqual(quiz.description, 'An uploaded quiz, for testing')
+        self.assertEqual(quiz.category_set.count(), 2)
+        self.assertEqual(quiz.question_set.count(), 3)
+        self.assertEqual(quiz.answer_set.count(), 6)
+        self.assertEqual(quiz.feedback_set.count(), 6)
+        answer = Answer.objects.get(parent_question__question_text='Question 3', answer_text='Answer 2')
+        self.assertEqual(answer.answer_weight, 0.5)
+        self.assertEqual(answer.get_quiz_feedback().get().feedback_text, 'Answer 2 feedback, with a comma')
+
+    def test_reupload_diffs_quiz(self):
+        """
+        Uploading the same quiz again keeps unchanged rows, updates changed ones and removes missing ones
+        """
+        upload_csv(self.client, QUIZ_CSV)
+        kept = Answer.objects.get(parent_question__question_text='Question 1', answer_text='Answer 1')
+        edited = QUIZ_CSV.replace("Question 1,Answer 2,0,Answer 2 feedback", "Question 1,Answer 2,0.25,Try again")
+        edited = "\n".join(line for line in edited.split("\n") if "Category 2" not in line)
+        upload_csv(self.client, edited)
+
+        quiz = Quiz.objects.get(name='Upload quiz')
+        self.assertEqual(Quiz.objects.count(), 1)
+        self.assertEqual(list(quiz.category_set.values_list('category_name', flat=True)), ['Category 1'])
+        self.assertEqual(quiz.question_set.count(), 2)
+        self.assertEqual(quiz.answer_set.count(), 4)
+        self.assertEqual(quiz.feedback_set.count(), 4)
+        self.assertTrue(Answer.objects.filter(id=kept.id).exists())
+        answer = Answer.objects.get(parent_question__question_text='Question 1', answer_text='Answer 2')
+        self.assertEqual(answer.answer_weight, 0.25)
+        self.assertEqual(answer.get_quiz_feedback().get().feedback_text, 'Try again')
+
+    def test_reupload_invalidates_once(self):
+        """
+        A re-upload that removes rows publishes the quiz once, not once for every removed row
+        """
+        upload_csv(self.client, QUIZ_CSV)
+        replaced = QUIZ_CSV.replace('Question', 'Replaced question')
+        with mock.patch.object(compiled, 'build_quiz_tree', wraps=compiled.build_quiz_tree) as build, committed():
+            upload_csv(self.client, replaced)
+        self.assertEqual(build.call_count, 1)
+        self.assertEqual(Question.objects.filter(question_text__startswith='Replaced').count(), 3)
+
+    def test_bad_row_writes_nothing(self):
+        """
+        A malformed row anywhere in the file leaves no quiz behind and reports the line
+        """
+        response = upload_csv(self.client, QUIZ_CSV + "Upload quiz,Category 2,Question 4,Answer 1,heavy,Oops\n")
+        self.assertContains(response, 'Line 8')
+        self.assertFalse(Quiz.objects.exists())
+        self.assertFalse(Answer.objects.exists())
+
+    def test_bad_row_keeps_existing_quiz(self):
+        """
+        A malformed re-upload leaves the previously uploaded quiz untouched
+        """
+        upload_csv(self.client, QUIZ_CSV)
+        upload_csv(self.client, QUIZ_CSV.replace("Question 3,Answer 1,1,No Feedback", "Question 3,Answer 1"))
+        quiz = Quiz.objects.get(name='Upload quiz')
+        self.assertEqual(quiz.question_set.count(), 3)
+        self.assertEqual(quiz.feedback_set.count(), 6)
+
+    def test_not_csv(self):
+        """
+        Files without a .csv extension are rejected
+        """
+        response = upload_csv(self.client, QUIZ_CSV, name='quiz.txt')
+        self.assertContains(response, 'This is not a csv file')
+        self.assertFalse(Quiz.objects.exists())
+
+    def test_streamed_lines(self):
+        """
+        iter_upload_lines decodes uploads chunk by chunk, even when a line or a character spans two chunks
+        """
+        contents = '\ufeff' + QUIZ_CSV.replace('Answer 1', 'Answer é')
+        csv_file = SimpleUploadedFile('quiz.csv', contents.encode('UTF-8'))
+        lines = list(iter_upload_lines(csv_file, chunk_size=7))
+        self.assertEqual(''.join(lines), contents[1:])
+        self.assertEqual(len(lines), len(QUIZ_CSV.splitlines()))
+        quiz = import_quiz_csv(lines, batch_size=2)
+        self.assertEqual(quiz.answer_set.filter(answer_text='Answer é').count(), 3)
+
+
+@override_settings(QUIZ_IMPORT_RUNNER='command')
+class ImportJobTests(MediaRootTestCase):
+    def setUp(self):
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+
+    def test_upload_queues_job(self):
+        """
+        With the 'command' runner the upload only queues a job, which run_pending_jobs imports
+        """
+        response = upload_csv(self.client, QUIZ_CSV)
+        self.assertContains(response, 'The quiz is being imported')
+        job = ImportJob.objects.get()
+        self.assertEqual(job.status, ImportJob.PENDING)
+        self.assertFalse(Quiz.objects.exists())
+
+        self.assertEqual(run_pending_jobs(), 1)
+        status = self.client.get(reverse('quizzes:import_status', args=(job.id,))).json()
+        self.assertEqual(status['status'], ImportJob.DONE)
+        self.assertEqual(status['rows_processed'], 6)
+        self.assertEqual(status['rows_total'], 6)
+        self.assertEqual(Quiz.objects.get(id=status['quiz_id']).answer_set.count(), 6)
+
+    def test_failed_job(self):
+        """
+        A job with a malformed row fails with the line number and writes nothing
+        """
+        upload_csv(self.client, QUIZ_CSV + "Upload quiz,Category 2\n")
+        run_pending_jobs()
+        job = ImportJob.objects.get()
+        self.assertEqual(job.status, ImportJob.FAILED)
+        self.assertIn('Line 8', job.error_message)
+        self.assertFalse(Quiz.objects.exists())
+
+    def test_bad_header_rejected(self):
+        """
+        A file with a broken header is rejected in the request without queueing a job
+        """
+        response = upload_csv(self.client, "Upload quiz,not a date,Description\n")
+        self.assertContains(response, 'not a valid date')
+        self.assertFalse(ImportJob.objects.exists())
+
+    def test_same_quiz_not_claimed_twice(self):
+        """
+        A job isn't claimed while another job for the same quiz is running, jobs for other quizzes are
+        """
+        upload_csv(self.client, QUIZ_CSV)
+        upload_csv(self.client, QUIZ_CSV)
+        upload_csv(self.client, QUIZ_CSV.replace('Upload quiz', 'Other quiz'))
+        first, second, other = ImportJob.objects.order_by('id')
+        self.assertTrue(claim_job(first.id))
+        self.assertFalse(claim_job(second.id))
+        self.assertTrue(claim_job(other.id))
+
+    def test_claimed_in_upload_order(self):
+        """
+        A job for a quiz isn't claimed while an older upload of the same quiz is still pending
+        """
+        upload_csv(self.client, QUIZ_CSV)
+        upload_csv(self.client, QUIZ_CSV.replace('Answer 2 feedback', 'Newer feedback'))
+        first, second = ImportJob.objects.order_by('id')
+        self.assertFalse(claim_job(second.id))
+        self.assertEqual(run_pending_jobs(), 2)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertLessEqual(first.finished, second.finished)
+        self.assertTrue(Feedback.objects.filter(feedback_text='Newer feedback').exists())
+
+    def test_stale_job_recovered(self):
+        """
+        A running job that stopped showing progress is imported again, and no longer holds back its quiz
+        """
+        upload_csv(self.client, QUIZ_CSV)
+        upload_csv(self.client, QUIZ_CSV)
+        first, second = ImportJob.objects.order_by('id')
+        self.assertTrue(claim_job(first.id))
+        self.assertEqual(run_pending_jobs(), 0)
+
+        ImportJob.objects.filter(pk=first.id).update(
+            heartbeat=timezone.now() - datetime.timedelta(seconds=jobs.QUIZ_IMPORT_STALE_AFTER + 1))
+        self.assertEqual(run_pending_jobs(), 2)
+        self.assertEqual(set(ImportJob.objects.values_list('status', flat=True)), {ImportJob.DONE})
+
+    def test_heartbeat_during_save(self):
+        """
+        The heartbeat of a running job goes on while its quiz is saved, after the last row was read
+        """
+        upload_csv(self.client, QUIZ_CSV)
+        job = ImportJob.objects.get()
+        save = QuizImporter.save
+        beats = []
+        beating = threading.Event()
+
+        def beat(job_id):
+            beats.append(job_id)
+            if len(beats) >= 2:
+                beating.set()
+
+        def slow_save(importer):
+            self.assertTrue(beating.wait(5))
+            return save(importer)
+
+        with mock.patch.object(jobs, 'HEARTBEAT_INTERVAL', 0.01), \
+                mock.patch.object(jobs, 'touch_job', side_effect=beat), \
+                mock.patch.object(QuizImporter, 'save', autospec=True, side_effect=slow_save):
+            self.assertEqual(run_pending_jobs(), 1)
+        self.assertEqual(set(beats), {job.id})
+        self.assertEqual(ImportJob.objects.get().status, ImportJob.DONE)
+
+    @override_settings(QUIZ_IMPORT_RUNNER='thread')
+    def test_lost_job_dispatched_on_poll(self):
+        """
+        With the 'thread' runner a pending job that no thread has, after a restart, is dispatched when polled
+        """
+        with mock.patch.object(jobs, 'dispatch_job'):
+            upload_csv(self.client, QUIZ_CSV)
+        job = ImportJob.objects.get()
+        with mock.patch.object(jobs, 'get_executor') as get_executor, self.captureOnCommitCallbacks(execute=True):
+            self.client.get(reverse('quizzes:import_status', args=(job.id,)))
+            self.client.get(reverse('quizzes:import_status', args=(job.id,)))
+        get_executor.return_value.submit.assert_called_once_with(jobs.run_thread_job, job.id)
+        jobs._dispatched.discard(job.id)
+
+
+class CompiledQuizTests(TestCase):
+    def test_take_quiz_no_queries(self):
+        """
+        Once the quiz is compiled the question page is rendered without any database queries
+        """
+        quiz, category, question, answer_1h, answer_1l = create_quiz("test quiz", days=-5, active_level=True)[:5]
+        url = reverse('quizzes:take_quiz', args=(quiz.id, category.id, question.id))
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertContains(response, escape(question.question_text))
+        self.assertContains(response, answer_1l.answer_text)
+
+    def test_compiled_tree(self):
+        """
+        The compiled quiz holds categories, questions, answers with their weights and feedback
+        """
+        quiz, category, question, answer_1h, answer_1l, feedback_1h, feedback_1l = create_quiz(
+            "test quiz", days=-5, active_level=True)
+        tree = get_quiz_tree(quiz.id)
+        self.assertEqual([c.name for c in tree.categories], [category.category_name])
+        self.assertEqual(tree.get_question(question.id).text, question.question_text)
+        answer = tree.get_question(question.id).get_answer(answer_1l.id)
+        self.assertEqual((answer.text, answer.weight, answer.feedback), ('BOO!', 0, feedback_1l.feedback_text))
+        self.assertIsNone(tree.next_question(tree.get_question(question.id)))
+
+    def test_save_invalidates(self):
+        """
+        Saving any part of the quiz, in the admin or elsewhere, replaces the compiled quiz
+        """
+        quiz, category, question, answer_1h = create_quiz("test quiz", days=-5, active_level=True)[:4]
+        old_tree = get_quiz_tree(quiz.id)
+        answer_1h.answer_text = "Superb!"
+        with committed():
+            answer_1h.save()
+        tree = get_quiz_tree(quiz.id)
+        self.assertNotEqual(tree.version, old_tree.version)
+        self.assertEqual(tree.get_question(question.id).get_answer(answer_1h.id).text, "Superb!")
+
+        # Answers added in the admin only link to their question
+        with committed():
+            Answer.objects.create(parent_question=question, answer_text="Meh", answer_weight=0.5)
+        self.assertEqual(len(get_quiz_tree(quiz.id).get_question(question.id).answers), 3)
+
+
+def take_whole_quiz(client, quiz, pick, response=None):
+    """
+    Takes a quiz from start to finish with the test client, `pick` chooses the answer of every question.
+    Goes on from `response`, a redirect to a question, instead when given.
+    Returns the response of the last answer submitted.
+    """
+    if response is None:
+        response = client.get(reverse('quizzes:start_new_quiz', args=(quiz.id, 0)))
+    while '/feedback/' not in response.url:
+        page = client.get(response.url)
+        question = page.context['question']
+        data = {'answer': pick(question).id}
+        if page.context.get('progress_token'):
+            data['progress'] = page.context['progress_token']
+        response = client.post(reverse('quizzes:select_answer', args=(quiz.id, question.category_id, question.id)),
+                               data)
+    return response
+
+
+class SessionFeedbackTests(TestCase):
+    def setUp(self):
+        self.quiz = import_quiz_csv(QUIZ_CSV.splitlines())
+
+    def test_feedback_by_answer_id(self):
+        """
+        Feedback is found by the selected answer id, even when other questions have answers with the same text
+        """
+        response = take_whole_quiz(self.client, self.quiz, lambda question: question.answers[1])
+        user = UserResponse.objects.get(response_id=response.url.split('/')[-2])
+        self.assertEqual(user.response_data['feedback_data'], {
+            'Category 1': {'Question 1': 'Answer 2 feedback', 'Question 2': 'Answer 2 feedback'},
+            'Category 2': {'Question 3': 'Answer 2 feedback, with a comma'},
+        })
+        self.assertEqual(user.response_data['quiz_data']['Category 2'], {'Question 3': 'Answer 2'})
+
+    def test_last_answer_queries(self):
+        """
+        Submitting the last answer takes the same number of queries however many questions the quiz has
+        """
+        def count_last_answer_queries(quiz):
+            tree = get_quiz_tree(quiz.id)
+            self.client.get(reverse('quizzes:start_new_quiz', args=(quiz.id, 0)))
+            for question in tree.questions[:-1]:
+                self.client.post(reverse('quizzes:select_answer', args=(quiz.id, question.category_id, question.id)),
+                                 {'answer': question.answers[0].id})
+            question = tree.questions[-1]
+            with CaptureQueriesContext(connection) as queries:
+                self.client.post(reverse('quizzes:select_answer', args=(quiz.id, question.category_id, question.id)),
+                                 {'answer': question.answers[0].id})
+            return len(queries)
+
+        bigger_quiz = import_quiz_csv(QUIZ_CSV.replace('Upload quiz', 'Bigger quiz').splitlines() + [
+            "Bigger quiz,Category 2,Question %d,Answer 1,1,No Feedback" % i for i in range(4, 24)])
+        self.assertEqual(count_last_answer_queries(self.quiz), count_last_answer_queries(bigger_quiz))
+
+    def test_compact_session(self):
+        """
+        The session only holds answer ids and category sums, answering a question again replaces the old answer
+        """
+        tree = get_quiz_tree(self.quiz.id)
+        self.client.get(reverse('quizzes:start_new_quiz', args=(self.quiz.id, 0)))
+        first = tree.questions[0]
+        url = reverse('quizzes:select_answer', args=(self.quiz.id, first.category_id, first.id))
+        self.client.post(url, {'answer': first.answers[0].id})
+        self.client.post(url, {'answer': first.answers[1].id})
+
+        progress = self.client.session[progress_session_key(self.quiz.id)]
+        self.assertEqual(progress['a'], [first.answers[1].id, 0, 0])
+        self.assertEqual(progress['s'], [0.0, 0.0])
+        self.assertEqual([key for key in self.client.session.keys() if key.startswith(str(self.quiz.id))],
+                         [progress_session_key(self.quiz.id)])
+
+    def test_response_answer_ids(self):
+        """
+        The finalized response keeps the selected answer ids next to the text-keyed data
+        """
+        response = take_whole_quiz(self.client, self.quiz, lambda question: question.answers[0])
+        user = UserResponse.objects.get(response_id=response.url.split('/')[-2])
+        tree = get_quiz_tree(self.quiz.id)
+        self.assertEqual(user.response_data['answer_ids'],
+                         {str(question.id): question.answers[0].id for question in tree.questions})
+        self.assertEqual(user.response_data['quiz_norm_scores'], {'Category 1': 10.0, 'Category 2': 10.0})
+
+
+@override_settings(QUIZ_PROGRESS_BACKEND='signed')
+class SignedProgressTests(TestCase):
+    def setUp(self):
+        self.quiz = import_quiz_csv(QUIZ_CSV.splitlines())
+        self.tree = get_quiz_tree(self.quiz.id)
+
+    def test_sessionless_quiz(self):
+        """
+        With signed progress a quiz is taken without touching the session,
+        the response is only created with the last answer
+        """
+        session = self.client.session
+        session['unrelated'] = 'kept'
+        session.save()
+        session_data = Session.objects.get().session_data
+
+        with CaptureQueriesContext(connection) as queries:
+            response = take_whole_quiz(self.client, self.quiz, lambda question: question.answers[1])
+        self.assertEqual(len([query for query in queries if 'django_session' in query['sql']]), 0)
+        self.assertEqual(Session.objects.get().session_data, session_data)
+        self.assertEqual(self.client.session['unrelated'], 'kept')
+
+        user = UserResponse.objects.get()
+        self.assertEqual(response.url, reverse('quizzes:feedback', args=(user.response_id,)))
+        self.assertEqual(user.response_data['feedback_data']['Category 2'],
+                         {'Question 3': 'Answer 2 feedback, with a comma'})
+        self.assertEqual(self.client.get(response.url).status_code, 200)
+
+    def test_progress_in_token(self):
+        """
+        Every answer is carried to the next question in the token, a token can't be altered or used on another quiz
+        """
+        first, second = self.tree.questions[:2]
+        start = self.client.get(reverse('quizzes:start_new_quiz', args=(self.quiz.id, 0)))
+        token = start.url.split('progress=')[1]
+        self.assertEqual(self.client.get(start.url).context['progress_token'], token)
+        self.assertEqual(UserResponse.objects.count(), 0)
+
+        url = reverse('quizzes:select_answer', args=(self.quiz.id, first.category_id, first.id))
+        response = self.client.post(url, {'answer': first.answers[1].id, 'progress': token})
+        progress = QuizProgress.from_token(self.client.get(response.url).context['progress_token'], self.tree)
+        self.assertEqual(progress.answers, [first.answers[1].id, 0, 0])
+        self.assertEqual(progress.sums, [0.0, 0.0])
+
+        url = reverse('quizzes:select_answer', args=(self.quiz.id, second.category_id, second.id))
+        self.assertEqual(self.client.post(url, {'answer': second.answers[0].id}).status_code, 404)
+        tampered = token[:-1] + ('1' if token.endswith('0') else '0')
+        self.assertEqual(self.client.post(url, {'answer': second.answers[0].id,
+                                                'progress': tampered}).status_code, 404)
+        other_quiz = import_quiz_csv(QUIZ_CSV.replace('Upload quiz', 'Other quiz').splitlines())
+        self.assertIsNone(QuizProgress.from_token(token, get_quiz_tree(other_quiz.id)))
+        self.assertContains(self.client.post(url, {'progress': token}), 'name="progress" value="%s"' % token)
+
+
+WEIGHTED_QUIZ_CSV = (
+    "Weighted quiz,2020-08-26,Answer weights outside of 0 - 1\n"
+    "Weighted quiz,Category 1,Question 1,Answer 1,-1,No Feedback\n"
+    "Weighted quiz,Category 1,Question 1,Answer 2,3,No Feedback\n"
+    "Weighted quiz,Category 1,Question 2,Answer 1,2,No Feedback\n"
+    "Weighted quiz,Category 1,Question 2,Answer 2,5,No Feedback\n"
+    "Weighted quiz,Category 2,Question 3,Answer 1,4,No Feedback\n"
+    "Weighted quiz,Category 2,Question 3,Answer 2,4,No Feedback\n"
+)
+
+
+class ScoringTests(TestCase):
+    def setUp(self):
+        self.quiz = get_quiz_tree(import_quiz_csv(WEIGHTED_QUIZ_CSV.splitlines()).id)
+
+    def answer_ids(self, *picks):
+        return [question.answers[pick].id for question, pick in zip(self.quiz.questions, picks)]
+
+    def test_category_range_from_weights(self):
+        """
+        A category's range runs from the sum of the lowest to the sum of the highest answer weights of its questions,
+        a category whose answers all weigh the same has no score
+        """
+        scorer = QuizScorer(self.quiz)
+        self.assertEqual(scorer.minimums, [1.0, 4.0])
+        self.assertEqual(scorer.maximums, [8.0, 4.0])
+        self.assertEqual(scorer.score(self.answer_ids(0, 0, 0)), {'Category 1': 0.0, 'Category 2': None})
+        self.assertEqual(scorer.score(self.answer_ids(1, 0, 0)), {'Category 1': 5.71, 'Category 2': None})
+        self.assertEqual(scorer.score(self.answer_ids(1, 1, 1)), {'Category 1': 10.0, 'Category 2': None})
+
+    @override_settings(QUIZ_SCORE_RANGE=(1, 5), QUIZ_SCORING_STRATEGY='quizzes.scoring.QuestionNormalizedScoring')
+    def test_configured_range_and_strategy(self):
+        """
+        The score range and strategy come from the settings, question normalized scoring counts every question the same
+        """
+        scorer = get_scorer(self.quiz)
+        self.assertIsInstance(scorer.strategy, QuestionNormalizedScoring)
+        self.assertEqual(scorer.score(self.answer_ids(1, 0, 0)), {'Category 1': 3.0, 'Category 2': None})
+
+    def test_batch_matches_single(self):
+        """
+        Scoring responses in a batch gives the same scores as scoring them one by one, with or without numpy
+        """
+        scorer = QuizScorer(self.quiz)
+        rows = [self.answer_ids(0, 0, 0), self.answer_ids(1, 0, 1), self.answer_ids(0, 1, 0), [0, 0, 0], []]
+        expected = [scorer.score(row) for row in rows]
+        self.assertEqual(scorer.score_many(rows), expected)
+        with mock.patch.object(scoring, 'numpy', None):
+            self.assertEqual(scorer.score_many(rows), expected)
+
+    def test_score_stored_responses(self):
+        """
+        Stored responses are scored from their answer ids, or from the answer text when they have no answer ids
+        """
+        question = self.quiz.questions[0]
+        with_ids = UserResponse(response_data={'answer_ids': {str(question.id): question.answers[1].id}})
+        with_text = UserResponse(response_data={'quiz_data': {'Category 1': {'Question 1': 'Answer 2'}}})
+        scores = get_scorer(self.quiz.id).score_responses([with_ids, with_text])
+        self.assertEqual(scores, [{'Category 1': 5.71, 'Category 2': None}] * 2)
+
+
+class RescoreResponsesTests(TestCase):
+    def setUp(self):
+        self.quiz = import_quiz_csv(QUIZ_CSV.splitlines())
+        take_whole_quiz(self.client, self.quiz, lambda question: question.answers[0])
+        self.response = UserResponse.objects.get(parent_quiz=self.quiz)
+        # A weight and a feedback text are edited after the quiz was taken
+        answer = Answer.objects.get(parent_question__question_text='Question 1', answer_text='Answer 2')
+        answer.answer_weight = 2
+        with committed():
+            answer.save()
+        Feedback.objects.filter(parent_answer__parent_question__question_text='Question 3',
+                                parent_answer__answer_text='Answer 1').update(feedback_text='New feedback')
+
+    def test_rescore(self):
+        """
+        Stored scores and feedback are worked out again from the stored answers
+        """
+        self.assertEqual(self.response.response_data['quiz_norm_scores'], {'Category 1': 10.0, 'Category 2': 10.0})
+        out = StringIO()
+        call_command('rescore_responses', stdout=out)
+        self.assertIn('1 of 1 responses updated', out.getvalue())
+        self.response.refresh_from_db()
+        self.assertEqual(self.response.response_data['quiz_norm_scores'], {'Category 1': 5.0, 'Category 2': 10.0})
+        self.assertEqual(self.response.response_data['feedback_data']['Category 2'], {'Question 3': 'New feedback'})
+
+    def test_dry_run(self):
+        """
+        A dry run prints the changes without saving them
+        """
+        out = StringIO()
+        call_command('rescore_responses', self.quiz.id, '--dry-run', '--chunk-size', '1', stdout=out)
+        self.assertIn('Category 1 score: 10.0 -> 5.0', out.getvalue())
+        self.assertIn("Category 2 / Question 3 feedback: None -> 'New feedback'", out.getvalue())
+        self.assertIn('1 of 1 responses would change', out.getvalue())
+        self.response.refresh_from_db()
+        self.assertEqual(self.response.response_data['quiz_norm_scores'], {'Category 1': 10.0, 'Category 2': 10.0})
+
+    def test_processes(self):
+        """
+        Chunks scored in a pool of worker processes are saved the same as those scored in this one
+        """
+        # Taken after the edits, so already scored on them
+        take_whole_quiz(Client(), self.quiz, lambda question: question.answers[1])
+        out = StringIO()
+        call_command('rescore_responses', self.quiz.id, '--processes', '2', '--chunk-size', '1', stdout=out)
+        self.assertIn('1 of 2 responses updated', out.getvalue())
+        self.response.refresh_from_db()
+        self.assertEqual(self.response.response_data['quiz_norm_scores'], {'Category 1': 5.0, 'Category 2': 10.0})
+
+    def test_unfinished_skipped(self):
+        """
+        Responses of quizzes that weren't finished are left unfinished
+        """
+        unfinished = UserResponse.objects.get(response_id=create_user_response(self.quiz.id))
+        out = StringIO()
+        call_command('rescore_responses', self.quiz.id, stdout=out)
+        self.assertIn('1 of 1 responses updated', out.getvalue())
+        unfinished.refresh_from_db()
+        self.assertIsNone(unfinished.response_data)
+        self.assertFalse(unfinished.is_finalized())
+
+
+class FeedbackPDFTests(MediaRootTestCase):
+    def setUp(self):
+        self.quiz = import_quiz_csv(QUIZ_CSV.splitlines())
+
+    @override_settings(QUIZ_PDF_RUNNER='sync')
+    def test_pdf_rendered_once(self):
+        """
+        The pdf is rendered when the quiz is finished and served from storage with its content hash as ETag
+        """
+        response = take_whole_quiz(self.client, self.quiz, lambda question: question.answers[0])
+        user = UserResponse.objects.get(response_id=response.url.split('/')[-2])
+        self.assertTrue(user.feedback_pdf)
+
+        url = reverse('quizzes:get_feedback_pdf', args=(user.response_id,))
+        with mock.patch('quizzes.pdfs.html_to_pdf') as html_to_pdf:
+            response = self.client.get(url)
+            html_to_pdf.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertEqual(response['ETag'], '"%s"' % user.feedback_pdf_hash)
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    @override_settings(QUIZ_PDF_RUNNER='command')
+    def test_pdf_pending(self):
+        """
+        Until the pdf is rendered the page answers 202 with the url to poll
+        """
+        response = take_whole_quiz(self.client, self.quiz, lambda question: question.answers[0])
+        user_id = int(response.url.split('/')[-2])
+        url = reverse('quizzes:get_feedback_pdf', args=(user_id,))
+        response = self.client.get(url, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json(), {'status': 'pending', 'poll_url': url})
+        self.assertEqual(self.client.post(url).status_code, 202)
+
+        call_command('render_feedback_pdfs', stdout=StringIO())
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+
+    @override_settings(QUIZ_PDF_RUNNER='sync')
+    def test_pdf_failed(self):
+        """
+        A pdf that can't be rendered is an error until the response changes, it isn't rendered on every request
+        """
+        with mock.patch('quizzes.pdfs.html_to_pdf', side_effect=PDFRenderError) as html_to_pdf:
+            response = take_whole_quiz(self.client, self.quiz, lambda question: question.answers[0])
+            url = response.url + 'pdf/'
+            self.assertEqual(self.client.get(url).status_code, 400)
+            self.assertEqual(self.client.get(url).status_code, 400)
+            self.assertEqual(html_to_pdf.call_count, 1)
+        user = UserResponse.objects.get(response_id=response.url.split('/')[-2])
+        self.assertTrue(user.feedback_pdf_failed)
+
+        discard_feedback_pdfs([user.pk])
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_unfinished_response(self):
+        """
+        A response that was started but not finished has no pdf
+        """
+        user_id = create_user_response(self.quiz.id)
+        self.assertEqual(self.client.get(reverse('quizzes:get_feedback_pdf', args=(user_id,))).status_code, 404)
+
+
+@override_settings(QUIZ_PDF_RUNNER='command')
+class ExportFeedbackPDFsTests(MediaRootTestCase):
+    def setUp(self):
+        self.quiz = import_quiz_csv(QUIZ_CSV.splitlines())
+        self.response_ids = [
+            int(take_whole_quiz(Client(), self.quiz, lambda question: question.answers[pick]).url.split('/')[-2])
+            for pick in (0, 1, 0)
+        ]
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+        self.url = reverse('quizzes:export_feedback_pdfs', args=(self.quiz.id,))
+
+    def test_zip_export(self):
+        """
+        Every finished response gets its pdf in the streamed ZIP, rendered pdfs are stored for next time
+        """
+        create_user_response(self.quiz.id)
+        response = self.client.get(self.url)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        archive = zipfile.ZipFile(BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(archive.namelist(), ['feedback_%s.pdf' % response_id for response_id in self.response_ids])
+        self.assertTrue(archive.read(archive.namelist()[0]).startswith(b'%PDF'))
+        self.assertEqual(UserResponse.objects.exclude(feedback_pdf_hash=None).count(), 3)
+
+    def test_merged_cohort_export(self):
+        """
+        ?ids= picks the responses, ?format=pdf merges their pdfs into one
+        """
+        from pypdf import PdfReader
+        ids = ','.join(str(response_id) for response_id in self.response_ids[:2])
+        response = self.client.get(self.url, {'ids': ids, 'format': 'pdf'})
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        merged = PdfReader(BytesIO(b''.join(response.streaming_content)))
+        single = PdfReader(UserResponse.objects.get(response_id=self.response_ids[0]).feedback_pdf.open('rb'))
+        self.assertEqual(len(merged.pages), len(single.pages) * 2)
+
+        # Larger cohorts go in a ZIP archive
+        with mock.patch('quizzes.views.QUIZ_PDF_MERGE_MAX_RESPONSES', 2):
+            self.assertEqual(self.client.get(self.url, {'format': 'pdf'}).status_code, 400)
+            self.assertEqual(self.client.get(self.url, {'ids': ids, 'format': 'pdf'}).status_code, 200)
+
+    def test_export_needs_permission(self):
+        """
+        Only staff can export, unknown formats are refused
+        """
+        self.client.logout()
+        self.assertEqual(self.client.get(self.url).status_code, 302)
+        self.client.force_login(User.objects.get(username='admin'))
+        self.assertEqual(self.client.get(self.url, {'format': 'doc'}).status_code, 400)
+
+
+class FeedbackReportTests(TestCase):
+    def test_report_matches_by_name(self):
+        """
+        Scores and feedback are matched to categories and questions by name, whatever order they were stored in
+        """
+        report = build_feedback_report({
+            'quiz_data': {'Sleep': {'Q1': 'A1', 'Q2': 'A2'}, 'Diet': {'Q3': 'A3'}, 'Focus': {'Q4': 'A4'}},
+            'quiz_norm_scores': {'Focus': 7.5, 'Diet': 2.0, 'Sleep': None},
+            'feedback_data': {'Diet': {'Q3': 'Eat more greens'}, 'Sleep': {'Q1': None}, 'Focus': {}},
+        })
+        self.assertEqual([(category.name, category.score) for category in report.categories],
+                         [('Sleep', None), ('Diet', 2.0), ('Focus', 7.5)])
+        self.assertEqual([category.name for category in report.lowest_categories], ['Diet', 'Focus'])
+        sleep = report.categories[0]
+        self.assertEqual([(item.question, item.answer, item.feedback, item.has_feedback_entry)
+                          for item in sleep.questions], [('Q1', 'A1', None, True), ('Q2', 'A2', None, False)])
+        self.assertEqual([item.feedback for item in report.categories[1].questions_with_feedback()],
+                         ['Eat more greens'])
+
+    def test_feedback_page(self):
+        """
+        The feedback page shows the feedback of the lowest scoring categories
+        """
+        quiz = import_quiz_csv(QUIZ_CSV.splitlines())
+        response = take_whole_quiz(self.client, quiz, lambda question: question.answers[1])
+        response = self.client.get(response.url)
+        self.assertContains(response, '<h2>Category 1: 0.0</h2>')
+        self.assertContains(response, '<li>Answer 2 feedback</li>', count=2)
+        self.assertContains(response, 'Answer 2 feedback, with a comma')
+
+
+class FeedbackPageCacheTests(TestCase):
+    def setUp(self):
+        self.quiz = import_quiz_csv(QUIZ_CSV.splitlines())
+        self.url = take_whole_quiz(self.client, self.quiz, lambda question: question.answers[0]).url
+
+    def test_cached_per_response(self):
+        """
+        The page is rendered once per response, the session still expires on every visit
+        """
+        first = self.client.get(self.url)
+        session = self.client.session
+        session.set_expiry(None)
+        session.save()
+        with mock.patch('quizzes.views.render_to_string') as render_to_string:
+            second = self.client.get(self.url)
+            render_to_string.assert_not_called()
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(self.client.session.get_expiry_age(), 1)
+
+    def test_revalidation(self):
+        """
+        Browsers revalidate the page with its ETag or Last-Modified
+        """
+        response = self.client.get(self.url)
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(
+            self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+
+    def test_rescore_invalidates(self):
+        """
+        A rescored response gets its page rendered again
+        """
+        self.assertContains(self.client.get(self.url), 'Category 1: 10.0')
+        answer = Answer.objects.get(parent_question__question_text='Question 1', answer_text='Answer 2')
+        answer.answer_weight = 2
+        answer.save()
+        call_command('rescore_responses', stdout=StringIO())
+        self.assertContains(self.client.get(self.url), 'Category 1: 5.0')
+
+    def test_unfinished_response(self):
+        """
+        A response that was started but not finished has no feedback page
+        """
+        user_id = create_user_response(self.quiz.id)
+        self.assertEqual(self.client.get(reverse('quizzes:feedback', args=(user_id,))).status_code, 404)
+
+
+@override_settings(QUIZ_PDF_RUNNER='sync')
+class InstrumentationTests(MediaRootTestCase):
+    def setUp(self):
+        self.quiz = import_quiz_csv(QUIZ_CSV.splitlines())
+        instrumentation.aggregate.clear()
+
+    def test_disabled(self):
+        """
+        Without QUIZ_INSTRUMENTATION nothing is measured
+        """
+        response = take_whole_quiz(self.client, self.quiz, lambda question: question.answers[0])
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(instrumentation.aggregate.percentiles(), {})
+
+    @override_settings(QUIZ_INSTRUMENTATION=True)
+    def test_server_timing(self):
+        """
+        Every request reports its database, template, pdf and session costs, the report gives percentiles per view
+        """
+        client = Client()
+        response = take_whole_quiz(client, self.quiz, lambda question: question.answers[0])
+        self.assertRegex(response['Server-Timing'], r'db;dur=[\d.]+;desc="[1-9]\d* queries"')
+        self.assertRegex(response['Server-Timing'], r'pdf;dur=[1-9]')
+        self.assertRegex(response['Server-Timing'], r'session;desc="read [1-9]\d* B, write [1-9]\d* B"')
+        self.assertRegex(client.get(response.url)['Server-Timing'], r'template;dur=(0\.0[1-9]|0\.[1-9]|[1-9])')
+
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        client.force_login(admin)
+        report = client.get(reverse('quizzes:instrumentation_report')).json()
+        self.assertEqual(report['quizzes:select_answer']['requests'], 3)
+        self.assertEqual(report['quizzes:take_quiz']['queries'], {'p50': 0, 'p90': 0, 'p99': 0})
+        self.assertGreater(report['quizzes:select_answer']['session_write']['p99'], 0)
+
+
+@override_settings(QUIZ_PDF_RUNNER='command')
+class QuizAPITests(MediaRootTestCase):
+    def setUp(self):
+        self.quiz = import_quiz_csv(QUIZ_CSV.splitlines())
+        self.tree = get_quiz_tree(self.quiz.id)
+        self.url = reverse('quizzes:quiz_api', args=(self.quiz.id,))
+        self.submit_url = reverse('quizzes:submit_quiz_api', args=(self.quiz.id,))
+
+    def submit(self, answers, client=None, **extra):
+        return (client or self.client).post(self.submit_url, json.dumps({'answers': answers}),
+                                            content_type='application/json', **extra)
+
+    def test_whole_quiz(self):
+        """
+        The whole quiz comes in one response without weights or feedback, revalidated with its version
+        """
+        response = self.client.get(self.url)
+        data = response.json()
+        self.assertEqual([category['name'] for category in data['categories']], ['Category 1', 'Category 2'])
+        self.assertEqual(data['categories'][1]['questions'][0]['answers'][1],
+                         {'id': self.tree.questions[2].answers[1].id, 'text': 'Answer 2'})
+        self.assertNotIn('feedback', response.content.decode())
+        self.assertEqual(data['submit_url'], self.submit_url + '?version=' + data['version'])
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_submit(self):
+        """
+        Submitting every answer at once stores the same finalized response as the per-question pages
+        """
+        pages = take_whole_quiz(Client(), self.quiz, lambda question: question.answers[1])
+        expected = UserResponse.objects.get(response_id=pages.url.split('/')[-2]).response_data
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.submit({str(question.id): question.answers[1].id for question in self.tree.questions})
+        self.assertEqual(response.status_code, 201)
+        # 2 of them write the selection rows, 5 add the response to the analytics of the quiz, 2 open and commit
+        # the transaction they are written in
+        self.assertLessEqual(len(queries), 12)
+        data = response.json()
+        user = UserResponse.objects.get(response_id=data['response_id'])
+        self.assertTrue(user.is_finalized())
+        self.assertEqual(user.response_data, expected)
+        self.assertEqual(data['scores'], expected['quiz_norm_scores'])
+        self.assertContains(self.client.get(data['feedback_url']), 'Answer 2 feedback, with a comma')
+        self.assertEqual(self.client.get(data['pdf_url']).status_code, 202)
+
+    def test_invalid_submissions(self):
+        """
+        Submissions with unknown or missing answers, or that aren't JSON, are refused
+        """
+        first, second, third = self.tree.questions
+        response = self.submit({str(first.id): first.answers[0].id, str(second.id): third.answers[0].id,
+                                'nope': 1})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['unknown_questions'], [str(second.id), 'nope'])
+        self.assertEqual(response.json()['missing_questions'], [second.id, third.id])
+        response = self.client.post(self.submit_url, 'answers', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(self.submit_url).status_code, 405)
+        self.assertFalse(UserResponse.objects.exists())
+
+    def test_csrf(self):
+        """
+        The quiz sets the CSRF cookie the submission has to send back
+        """
+        client = Client(enforce_csrf_checks=True)
+        answers = {str(question.id): question.answers[0].id for question in self.tree.questions}
+        self.assertEqual(self.submit(answers, client).status_code, 403)
+        token = client.get(self.url).cookies['csrftoken'].value
+        self.assertEqual(self.submit(answers, client, HTTP_X_CSRFTOKEN=token).status_code, 201)
+
+
+class AsyncURLConf:
+    urlpatterns = [
+        path('quizzes/', include((quiz_urlpatterns(use_async=True), 'quizzes'))),
+        path('upload-csv/', quiz_upload, name='quiz_upload'),
+    ]
+
+
+@override_settings(ROOT_URLCONF=AsyncURLConf, QUIZ_PDF_RUNNER='sync')
+class AsyncViewsTests(MediaRootTestCase):
+    def setUp(self):
+        self.quiz = import_quiz_csv(QUIZ_CSV.splitlines())
+
+    def test_async_routes(self):
+        """
+        With the async URLs the quiz-taking and feedback pages are coroutines
+        """
+        question = get_quiz_tree(self.quiz.id).questions[0]
+        for url in (reverse('quizzes:index'), reverse('quizzes:quiz_detail', args=(self.quiz.id,)),
+                    reverse('quizzes:take_quiz', args=(self.quiz.id, question.category_id, question.id)),
+                    reverse('quizzes:select_answer', args=(self.quiz.id, question.category_id, question.id)),
+                    reverse('quizzes:feedback', args=(1,)), reverse('quizzes:get_feedback_pdf', args=(1,))):
+            self.assertTrue(asyncio.iscoroutinefunction(resolve(url).func), url)
+
+    def test_quiz_flow(self):
+        """
+        A quiz taken through the async views gives the same response, feedback page and pdf as the sync ones
+        """
+        response = take_whole_quiz(self.client, self.quiz, lambda question: question.answers[1])
+        user = UserResponse.objects.get(response_id=response.url.split('/')[-2])
+        self.assertEqual(user.response_data['feedback_data']['Category 2'],
+                         {'Question 3': 'Answer 2 feedback, with a comma'})
+
+        page = self.client.get(response.url)
+        self.assertContains(page, 'Answer 2 feedback, with a comma')
+        self.assertEqual(self.client.get(response.url, HTTP_IF_NONE_MATCH=page['ETag']).status_code, 304)
+
+        pdf = self.client.get(response.url + 'pdf/')
+        self.assertEqual(pdf['ETag'], '"%s"' % user.feedback_pdf_hash)
+        self.assertTrue(pdf.content.startswith(b'%PDF'))
+        self.assertEqual(self.client.get(response.url + 'pdf/', HTTP_IF_NONE_MATCH=pdf['ETag']).status_code, 304)
+
+    def test_missing_answer(self):
+        """
+        Submitting without an answer shows the question again, a quiz that was not started is a 404
+        """
+        question = get_quiz_tree(self.quiz.id).questions[0]
+        url = reverse('quizzes:select_answer', args=(self.quiz.id, question.category_id, question.id))
+        self.assertEqual(self.client.post(url, {'answer': question.answers[0].id}).status_code, 404)
+        self.client.get(reverse('quizzes:start_new_quiz', args=(self.quiz.id, 0)))
+        self.assertContains(self.client.post(url), "You didn&#x27;t select an answer.")
+
+    async def test_asgi_pages(self):
+        """
+        The index, detail and question pages are served through the ASGI handler
+        """
+        question = (await sync_to_async(get_quiz_tree)(self.quiz.id)).questions[0]
+        response = await self.async_client.get(reverse('quizzes:index'))
+        self.assertContains(response, 'Upload quiz')
+        response = await self.async_client.get(reverse('quizzes:quiz_detail', args=(self.quiz.id,)))
+        self.assertContains(response, 'Question 3')
+        response = await self.async_client.get(
+            reverse('quizzes:take_quiz', args=(self.quiz.id, question.category_id, question.id)))
+        self.assertContains(response, question.answers[0].text)
+
+
+@override_settings(QUIZ_PDF_RUNNER='command', QUIZ_WRITE_BEHIND=True)
+class WriteBehindTests(MediaRootTestCase):
+    def setUp(self):
+        self.quiz = import_quiz_csv(QUIZ_CSV.splitlines())
+        self.tree = get_quiz_tree(self.quiz.id)
+        self.spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.spool_dir, ignore_errors=True)
+        self.buffer = ResponseBuffer(self.spool_dir, interval=None)
+        patcher = mock.patch.object(writebehind, '_buffer', self.buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.buffer.close)
+
+    def test_buffered_until_flush(self):
+        """
+        Finishing a quiz writes nothing to the response table, its pages are served from the buffer until it's written
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = take_whole_quiz(self.client, self.quiz, lambda question: question.answers[1])
+        writes = [query['sql'] for query in queries if query['sql'].startswith(('UPDATE', 'INSERT'))]
+        self.assertEqual(len([sql for sql in writes if '"%s"' % UserResponse._meta.db_table in sql]), 1)
+        user = UserResponse.objects.get()
+        self.assertFalse(user.is_finalized())
+
+        self.assertContains(self.client.get(response.url), 'Answer 2 feedback, with a comma')
+        self.assertEqual(self.client.get(response.url + 'pdf/').status_code, 202)
+
+        self.assertEqual(self.buffer.flush(), 1)
+        user.refresh_from_db()
+        self.assertEqual(user.response_data['feedback_data']['Category 2'],
+                         {'Question 3': 'Answer 2 feedback, with a comma'})
+        self.assertIsNone(self.buffer.get(user.response_id))
+        self.assertEqual(self.buffer.flush(), 0)
+        self.assertContains(self.client.get(response.url), 'Answer 2 feedback, with a comma')
+
+    def test_batched_writes(self):
+        """
+        Responses created by the API and finalized by the pages are written with a fixed number of queries
+        """
+        answers = {str(question.id): question.answers[0].id for question in self.tree.questions}
+        response_ids = [self.client.post(reverse('quizzes:submit_quiz_api', args=(self.quiz.id,)),
+                                         json.dumps({'answers': answers}),
+                                         content_type='application/json').json()['response_id'] for i in range(5)]
+        take_whole_quiz(self.client, self.quiz, lambda question: question.answers[0])
+        self.assertEqual(UserResponse.objects.filter(response_data__isnull=False).count(), 0)
+
+        finalized = []
+        response_finalized.connect(lambda sender, response, **kwargs: finalized.append(response.response_id),
+                                   weak=False, dispatch_uid='test_batched_writes')
+        self.addCleanup(response_finalized.disconnect, dispatch_uid='test_batched_writes')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.buffer.flush(), 6)
+        # 2 of them write the selection rows, 10 create and update the analytics rows of the quiz
+        self.assertLessEqual(len(queries), 20)
+        self.assertEqual(UserResponse.objects.filter(response_data__isnull=False).count(), 6)
+        self.assertEqual(set(response_ids) - set(finalized), set())
+
+    def test_spool_recovery(self):
+        """
+        Responses buffered by a process that died are written by the next buffer created
+        """
+        with override_settings(QUIZ_PROGRESS_BACKEND='signed'):
+            response = take_whole_quiz(self.client, self.quiz, lambda question: question.answers[0])
+        response_id = int(response.url.split('/')[-2])
+        self.assertEqual(len(os.listdir(self.spool_dir)), 1)
+        # The process dies, its spool file stays behind unlocked
+        self.buffer.spool.close()
+        self.buffer.spool = None
+
+        recovered = ResponseBuffer(self.spool_dir, interval=None)
+        self.assertIsNotNone(recovered.get(response_id))
+        self.assertEqual(recovered.flush(), 1)
+        self.assertTrue(UserResponse.objects.get(response_id=response_id).is_finalized())
+        recovered.close()
+        self.assertEqual(os.listdir(self.spool_dir), [])
+
+    def test_takeover_of_rewritten_spool(self):
+        """
+        A spool file replaced by its process between being opened and locked by another one is left alone
+        """
+        response_id = self.buffer.add(self.quiz.id, None, {'quiz_data': {}})
+        lock_spool = writebehind.lock_spool
+
+        def rewrite_then_lock(spool_file):
+            # The live process rewrites its spool, closing and unlocking the file that was just opened
+            if spool_file.name == self.buffer.spool_path:
+                with self.buffer.lock:
+                    self.buffer.rewrite_spool()
+            return lock_spool(spool_file)
+
+        with mock.patch.object(writebehind, 'lock_spool', side_effect=rewrite_then_lock):
+            other = ResponseBuffer(self.spool_dir, interval=None)
+        self.addCleanup(other.close)
+        self.assertIsNone(other.get(response_id))
+        self.assertTrue(os.path.exists(self.buffer.spool_path))
+        self.assertEqual(self.buffer.flush(), 1)
+
+    def test_buffered_by_another_process(self):
+        """
+        Responses buffered by another process are served from its spool, or wait for it while only their row exists
+        """
+        other = ResponseBuffer(self.spool_dir, interval=None)
+        self.addCleanup(other.close)
+        progress = QuizProgress(self.tree, None)
+        for question in self.tree.questions:
+            progress.select(question, question.answers[1])
+        response_data = progress.response_data(get_scorer(self.tree))
+        response_id = other.add(self.quiz.id, None, response_data)
+        url = reverse('quizzes:feedback', args=(response_id,))
+        self.assertContains(self.client.get(url), 'Answer 2 feedback, with a comma')
+        self.assertEqual(self.client.get(url + 'pdf/').status_code, 202)
+
+        # A response started in the session, held in memory only
+        session_response_id = create_user_response(self.quiz.id)
+        session_url = reverse('quizzes:feedback', args=(session_response_id,))
+        self.assertEqual(self.client.get(session_url).status_code, 202)
+        self.assertEqual(self.client.get(session_url + 'pdf/').status_code, 202)
+        self.assertEqual(self.client.get(reverse('quizzes:feedback', args=(1,))).status_code, 404)
+
+        other.add(self.quiz.id, session_response_id, response_data)
+        self.assertEqual(other.flush(), 2)
+        self.assertContains(self.client.get(url), 'Answer 2 feedback, with a comma')
+        self.assertContains(self.client.get(session_url), 'Answer 2 feedback, with a comma')
+
+
+    def test_dead_letter(self):
+        """
+        A response that can't be written doesn't hold back the others, it is moved to the dead-letter file after
+        max_attempts flushes. So is a response whose id was taken by another quiz
+        """
+        write_selections = writebehind.write_selections
+
+        def fail_bad_responses(quiz_id, rows, **kwargs):
+            if any('bad' in response_data for pk, response_data in rows):
+                raise ValueError('Bad response')
+            return write_selections(quiz_id, rows, **kwargs)
+
+        other_quiz = import_quiz_csv(QUIZ_CSV.replace('Upload quiz', 'Other quiz').splitlines())
+        taken_id = create_user_response(other_quiz.id)
+        bad_id = self.buffer.add(self.quiz.id, None, {'bad': True})
+        self.buffer.add(self.quiz.id, taken_id, {'quiz_data': {}})
+        good_id = self.buffer.add(self.quiz.id, None, {'quiz_data': {}})
+        self.buffer.max_attempts = 2
+        with mock.patch.object(writebehind, 'write_selections', side_effect=fail_bad_responses), \
+                self.assertLogs('quizzes.writebehind', 'ERROR'):
+            self.assertEqual(self.buffer.flush(), 1)
+            self.assertTrue(UserResponse.objects.filter(response_id=good_id).exists())
+            self.assertIsNotNone(self.buffer.get(bad_id))
+            self.assertEqual(self.buffer.flush(), 0)
+        self.assertEqual(self.buffer.pending, {})
+        with open(os.path.join(self.spool_dir, writebehind.DEAD_LETTER_FILE)) as dead_letter_file:
+            self.assertEqual([json.loads(line)[0] for line in dead_letter_file], [taken_id, bad_id])
+        self.assertIsNone(UserResponse.objects.get(response_id=taken_id).response_data)
+
+class AnalyticsTests(TestCase):
+    def setUp(self):
+        self.quiz = import_quiz_csv(QUIZ_CSV.splitlines())
+        self.tree = get_quiz_tree(self.quiz.id)
+        take_whole_quiz(Client(), self.quiz, lambda question: question.answers[0])
+        take_whole_quiz(Client(), self.quiz, lambda question: question.answers[1])
+        # A quiz that was started but not finished counts for nothing
+        create_user_response(self.quiz.id)
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+        self.url = reverse('quizzes:quiz_analytics_report', args=(self.quiz.id,))
+
+    def test_finalized_responses_counted(self):
+        """
+        Finished quizzes are counted as they are finalized, the report never reads the responses
+        """
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(self.url).json()
+        self.assertFalse([query for query in queries if '"%s"' % UserResponse._meta.db_table in query['sql']])
+        self.assertEqual(data['completions'], 2)
+        self.assertEqual(data['bucket_starts'][:3], [0.0, 1.0, 2.0])
+        category_1, category_2 = data['categories']
+        self.assertEqual((category_1['responses'], category_1['average']), (2, 5.0))
+        self.assertEqual(category_1['histogram'], [1, 0, 0, 0, 0, 0, 0, 0, 0, 1])
+        self.assertEqual(category_2['histogram'], [1, 0, 0, 0, 0, 0, 0, 0, 0, 1])
+        question = data['questions'][0]
+        self.assertEqual([answer['picks'] for answer in question['answers']], [1, 1])
+
+        take_whole_quiz(Client(), self.quiz, lambda question: question.answers[1])
+        data = self.client.get(self.url).json()
+        self.assertEqual(data['completions'], 3)
+        self.assertEqual(data['questions'][2]['most_picked'], self.tree.questions[2].answers[1].id)
+        self.assertEqual(self.client.get(reverse('quizzes:quiz_analytics_report', args=(0,))).status_code, 404)
+
+    def test_rescore_and_rebuild(self):
+        """
+        Rescoring moves responses between buckets, a rebuild from the responses gives the same aggregates
+        """
+        Answer.objects.filter(parent_question__question_text='Question 1', answer_text='Answer 2').update(
+            answer_weight=2)
+        call_command('rescore_responses', self.quiz.id, stdout=StringIO())
+        self.assertEqual(UserResponse.objects.filter(response_data__isnull=True).count(), 1)
+        data = self.client.get(self.url).json()
+        self.assertEqual(data['completions'], 2)
+        self.assertEqual(data['categories'][0]['histogram'], [0, 0, 0, 0, 0, 2, 0, 0, 0, 0])
+
+        out = StringIO()
+        call_command('rebuild_quiz_analytics', self.quiz.id, stdout=out)
+        self.assertIn('2 finished responses counted', out.getvalue())
+        self.assertEqual(self.client.get(self.url).json(), data)
+
+    def test_admin_view(self):
+        """
+        The admin lists completions per quiz and shows the analytics of a quiz
+        """
+        changelist = self.client.get(reverse('admin:quizzes_quiz_changelist'))
+        self.assertContains(changelist, reverse('admin:quizzes_quiz_analytics', args=(self.quiz.id,)))
+        page = self.client.get(reverse('admin:quizzes_quiz_analytics', args=(self.quiz.id,)))
+        self.assertContains(page, '2 completed responses')
+        self.assertContains(page, '<strong>Answer 1</strong>')
+
+
+class ResponseTablesTests(TestCase):
+    def setUp(self):
+        self.quiz = import_quiz_csv(QUIZ_CSV.splitlines())
+        self.tree = get_quiz_tree(self.quiz.id)
+        take_whole_quiz(self.client, self.quiz, lambda question: question.answers[1])
+        self.response = UserResponse.objects.get(parent_quiz=self.quiz)
+
+    def test_rows_written(self):
+        """
+        Finishing a quiz writes its answers and scores as rows, the response data can be derived from them
+        """
+        self.assertEqual(list(self.response.answers.order_by('question_id').values_list('answer_id', 'weight')),
+                         [(question.answers[1].id, question.answers[1].weight) for question in self.tree.questions])
+        self.assertEqual(dict(self.response.category_scores.values_list('category__category_name', 'score')),
+                         {'Category 1': 0.0, 'Category 2': 0.0})
+        derived = derive_response_data(self.tree, [self.response.pk])
+        self.assertEqual(derived, {self.response.pk: self.response.response_data})
+
+        # A submission through the API is written the same way
+        self.client.post(reverse('quizzes:submit_quiz_api', args=(self.quiz.id,)),
+                         json.dumps({'answers': {str(question.id): question.answers[1].id
+                                                 for question in self.tree.questions}}),
+                         content_type='application/json')
+        self.assertEqual(ResponseAnswer.objects.filter(answer_id=self.tree.questions[0].answers[1].id).count(), 2)
+
+    def test_rescore_replaces_rows(self):
+        """
+        Rescoring writes the rows of the changed responses again
+        """
+        Answer.objects.filter(parent_question__question_text='Question 1', answer_text='Answer 2').update(
+            answer_weight=2)
+        call_command('rescore_responses', self.quiz.id, stdout=StringIO())
+        self.assertEqual(ResponseAnswer.objects.count(), 3)
+        self.assertEqual(ResponseAnswer.objects.get(question_id=self.tree.questions[0].id).weight, 2)
+        self.assertEqual(ResponseCategoryScore.objects.get(category__category_name='Category 1').score, 5.0)
+
+    def test_build_command(self):
+        """
+        Responses without rows get them from their response data
+        """
+        ResponseAnswer.objects.all().delete()
+        ResponseCategoryScore.objects.all().delete()
+        out = StringIO()
+        call_command('build_response_tables', stdout=out)
+        self.assertIn('1 finished responses written', out.getvalue())
+        self.assertEqual(derive_response_data(self.tree, [self.response.pk])[self.response.pk],
+                         self.response.response_data)
+
+
+class ExportResponsesTests(TestCase):
+    def setUp(self):
+        self.quiz = import_quiz_csv(QUIZ_CSV.splitlines())
+        self.tree = get_quiz_tree(self.quiz.id)
+        take_whole_quiz(Client(), self.quiz, lambda question: question.answers[0])
+        take_whole_quiz(Client(), self.quiz, lambda question: question.answers[1])
+        create_user_response(self.quiz.id)
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+        self.url = reverse('quizzes:export_responses', args=(self.quiz.id,))
+
+    def export(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def test_csv(self):
+        """
+        Finished responses are streamed one row per response or one row per answer
+        """
+        rows = list(csv.reader(StringIO(self.export().decode())))
+        self.assertEqual(rows[0][:4], ['response_id', 'updated_at', 'Category 1 score', 'Category 2 score'])
+        self.assertEqual(rows[0][4:], ['Category 1 / Question 1', 'Category 1 / Question 2', 'Category 2 / Question 3'])
+        self.assertEqual([row[2:] for row in rows[1:]], [
+            ['10.0', '10.0', 'Answer 1', 'Answer 1', 'Answer 1'],
+            ['0.0', '0.0', 'Answer 2', 'Answer 2', 'Answer 2'],
+        ])
+
+        rows = list(csv.DictReader(StringIO(self.export(layout='answers').decode())))
+        self.assertEqual(len(rows), 6)
+        self.assertEqual((rows[5]['category'], rows[5]['question'], rows[5]['answer'], rows[5]['weight']),
+                         ('Category 2', 'Question 3', 'Answer 2', '0.5'))
+        self.assertEqual(self.client.get(self.url, {'layout': 'questions'}).status_code, 400)
+
+    @skipIf(exports.pyarrow is None, 'pyarrow is not installed')
+    def test_parquet(self):
+        """
+        With pyarrow the same rows come as a Parquet file
+        """
+        table = exports.pyarrow.parquet.read_table(BytesIO(self.export(format='parquet', layout='answers')))
+        self.assertEqual(table.num_rows, 6)
+        self.assertEqual(table.column('weight').to_pylist(), [1.0, 1.0, 1.0, 0.0, 0.0, 0.5])
+
+    def test_command(self):
+        """
+        The command streams the same export to stdout or a file
+        """
+        out = StringIO()
+        call_command('export_responses', self.quiz.id, stdout=out)
+        self.assertEqual(out.getvalue().encode(), self.export())
+        with mock.patch.object(exports, 'pyarrow', None):
+            self.assertEqual(self.client.get(self.url, {'format': 'parquet'}).status_code, 400)
+
+
+def large_quiz_csv(categories, questions, answers):
+    """CSV lines of a quiz with `questions` questions in each category"""
+    lines = ['Large quiz,2020-08-26,A quiz with many questions']
+    for category in range(categories):
+        for question in range(questions):
+            for answer in range(answers):
+                lines.append('Large quiz,Category %d,Question %d,Answer %d,%d,Feedback %d' % (
+                    category, question, answer, answer, answer))
+    return lines
+
+
+class LargeQuizAdminTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.quiz = import_quiz_csv(large_quiz_csv(20, 100, 2))
+        cls.small_quiz = import_quiz_csv(QUIZ_CSV.splitlines())
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def get(self, url, max_queries):
+        # The compiled quiz is built and cached by the first request, like after any edit
+        get_quiz_tree(self.quiz.id)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(queries), max_queries, url)
+        return response
+
+    def test_quiz_change_page(self):
+        """
+        A quiz of 2,000 questions is edited a category at a time, small quizzes keep every question inline
+        """
+        page = self.get(reverse('admin:quizzes_quiz_change', args=(self.quiz.id,)), 8)
+        self.assertNotContains(page, 'question_set-')
+        self.assertContains(page, '2000 questions')
+        self.assertContains(page, reverse('admin:quizzes_category_change', args=(
+            Category.objects.filter(parent_quiz=self.quiz).first().id,)))
+        page = self.get(reverse('admin:quizzes_quiz_change', args=(self.small_quiz.id,)), 30)
+        self.assertContains(page, 'question_set-')
+
+    def test_changelists(self):
+        """
+        The flat admins take the same few queries per page however many rows there are
+        """
+        for model in ('quiz', 'category', 'question', 'answer', 'feedback', 'userresponse'):
+            page = self.get(reverse('admin:quizzes_%s_changelist' % model), 6)
+            self.assertLessEqual(len(page.context['cl'].result_list), 100)
+        search = '?q=%%22Question+99%%22&parent_quiz__id__exact=%d' % self.quiz.id
+        page = self.get(reverse('admin:quizzes_question_changelist') + search, 6)
+        self.assertEqual(page.context['cl'].result_count, 20)
+
+    def test_change_pages(self):
+        """
+        Related rows are picked with raw id widgets instead of select boxes of every question or answer
+        """
+        question = Question.objects.filter(parent_quiz=self.quiz).first()
+        answer = Answer.objects.filter(parent_quiz=self.quiz).first()
+        feedback = Feedback.objects.filter(parent_quiz=self.quiz).first()
+        for url in (reverse('admin:quizzes_category_change', args=(question.parent_category_id,)),
+                    reverse('admin:quizzes_question_change', args=(question.id,)),
+                    reverse('admin:quizzes_answer_change', args=(answer.id,)),
+                    reverse('admin:quizzes_feedback_change', args=(feedback.id,))):
+            page = self.get(url, 10)
+            self.assertContains(page, 'vForeignKeyRawIdAdminField')
+            self.assertLess(len(page.content), 100000, url)
+
+
+class QuizSnapshotTests(TestCase):
+    def setUp(self):
+        self.quiz = import_quiz_csv(QUIZ_CSV.splitlines())
+
+    def test_publish_snapshots(self):
+        """
+        Every change of a quiz publishes a numbered snapshot, saving without changes keeps the version
+        """
+        tree = get_quiz_tree(self.quiz.id)
+        self.assertEqual(tree.version.split('.')[0], '1')
+        with committed():
+            self.quiz.save()
+        self.assertEqual(get_quiz_tree(self.quiz.id).version, tree.version)
+
+        answer = Answer.objects.get(parent_question__question_text='Question 1', answer_text='Answer 2')
+        answer.answer_text = 'Answer 2, edited'
+        with committed():
+            answer.save()
+        new_tree = get_quiz_tree(self.quiz.id)
+        self.assertEqual(new_tree.version.split('.')[0], '2')
+        self.assertEqual(QuizSnapshot.objects.filter(quiz=self.quiz).count(), 2)
+
+        # Older versions are read back from their snapshot, unknown versions give the current one
+        compiled.load_quiz_tree.cache_clear()
+        compiled.tree_cache().clear()
+        self.assertEqual(get_quiz_tree(self.quiz.id, tree.version), tree)
+        self.assertEqual(get_quiz_tree(self.quiz.id, '1.000000000000'), new_tree)
+        self.assertEqual(get_quiz_tree(self.quiz.id, 'latest'), new_tree)
+
+    def test_read_during_publish(self):
+        """
+        A version read from the snapshots before a publish committed never becomes current
+        """
+        latest_snapshot = compiled.latest_snapshot
+        reads = []
+
+        def read_then_publish(quiz_id):
+            latest = latest_snapshot(quiz_id)
+            reads.append(latest)
+            if len(reads) == 1:
+                # The quiz is edited and published while this reader is still reading
+                question = Question.objects.get(question_text='Question 3')
+                question.question_text = 'Question 3, edited'
+                with committed():
+                    question.save()
+            return latest
+
+        with mock.patch.object(compiled, 'latest_snapshot', side_effect=read_then_publish):
+            stale = get_quiz_tree(self.quiz.id)
+        self.assertIn('Question 3', [question.text for question in stale.questions])
+        tree = get_quiz_tree(self.quiz.id)
+        self.assertNotEqual(tree.version, stale.version)
+        self.assertIn('Question 3, edited', [question.text for question in tree.questions])
+
+    def test_reads_dont_publish(self):
+        """
+        The pages and the admin only read snapshots, a quiz that was never published is built without storing one
+        """
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+        QuizSnapshot.objects.all().delete()
+        compiled.tree_cache().clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(reverse('admin:quizzes_quiz_change', args=(self.quiz.id,))).status_code,
+                             200)
+            response = self.client.get(reverse('quizzes:start_new_quiz', args=(self.quiz.id, 0)))
+            self.assertContains(self.client.get(response.url), 'Question 1')
+        self.assertFalse(QuizSnapshot.objects.exists())
+        self.assertFalse([query for query in queries if '"quiz_snapshot"' in query['sql']
+                          and not query['sql'].startswith('SELECT')])
+
+        call_command('publish_quizzes', stdout=StringIO())
+        self.assertEqual(get_quiz_tree(self.quiz.id).version.split('.')[0], '1')
+
+    def test_in_flight_taker(self):
+        """
+        A quiz uploaded again while it is being taken is finished on the version it was started on
+        """
+        changed_csv = '\n'.join(line.replace('Answer 2 feedback', 'New feedback')
+                                for line in QUIZ_CSV.splitlines() if 'Question 2' not in line)
+        for backend in ('session', 'signed'):
+            with override_settings(QUIZ_PROGRESS_BACKEND=backend):
+                self.quiz = import_quiz_csv(QUIZ_CSV.splitlines())
+                response = self.client.get(reverse('quizzes:start_new_quiz', args=(self.quiz.id, 0)))
+                page = self.client.get(response.url)
+                question = page.context['question']
+                response = self.client.post(
+                    reverse('quizzes:select_answer', args=(self.quiz.id, question.category_id, question.id)),
+                    {'answer': question.answers[1].id, 'progress': page.context['progress_token'] or ''})
+
+                import_quiz_csv(changed_csv.splitlines())
+                response = take_whole_quiz(self.client, self.quiz, lambda question: question.answers[1], response)
+                user = UserResponse.objects.get(response_id=response.url.split('/')[-2])
+                self.assertEqual(user.response_data['feedback_data']['Category 1'],
+                                 {'Question 1': 'Answer 2 feedback', 'Question 2': 'Answer 2 feedback'})
+                # Answers are counted on the quiz as it is now
+                self.assertEqual(set(user.answers.values_list('question__question_text', flat=True)),
+                                 {'Question 1', 'Question 3'})
+                import_quiz_csv(QUIZ_CSV.splitlines())
+
+    def test_collect_snapshots(self):
+        """
+        Superseded snapshots are deleted once they are older than the retention, the current one is kept
+        """
+        get_quiz_tree(self.quiz.id)
+        Question.objects.filter(question_text='Question 3').update(question_text='Question 3, edited')
+        with committed():
+            compiled.invalidate_quiz_tree(self.quiz.id)
+        current = get_quiz_tree(self.quiz.id)
+        out = StringIO()
+        call_command('collect_quiz_snapshots', stdout=out)
+        self.assertEqual(QuizSnapshot.objects.filter(quiz=self.quiz).count(), 2)
+
+        QuizSnapshot.objects.update(created=timezone.now() - datetime.timedelta(days=30))
+        call_command('collect_quiz_snapshots', stdout=out)
+        self.assertIn('1 superseded snapshot deleted', out.getvalue())
+        self.assertEqual(list(QuizSnapshot.objects.values_list('number', flat=True)), [2])
+        self.assertEqual(get_quiz_tree(self.quiz.id), current)
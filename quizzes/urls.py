@@ -1,33 +1,79 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import api, views
 
 app_name = 'quizzes'
 
-urlpatterns = [
-    # ex: /quizzes/
-    # Shows all quizzes
-    path('', views.IndexView.as_view(), name='index'),
 
-    # ex: /quizzes/1/
-    # Shows all categories and questions of quiz
-    # The 'name' value as called by the {% url %} template tag
-    path('<int:pk>/', views.QuizDetailView.as_view(), name='quiz_detail'),
+def quiz_urlpatterns(use_async=False):
+    """
+    The quizzes URLs. With `use_async` the quiz-taking and feedback pages are served by the async_views module,
+    which needs the project to run under ASGI to pay off.
+    """
+    if use_async:
+        from . import async_views
+        index, quiz_detail = async_views.index, async_views.quiz_detail
+        take_quiz, select_answer = async_views.take_quiz, async_views.select_answer
+        feedback, get_feedback_pdf = async_views.feedback, async_views.get_feedback_pdf
+    else:
+        index, quiz_detail = views.IndexView.as_view(), views.QuizDetailView.as_view()
+        take_quiz, select_answer = views.take_quiz, views.select_answer
+        feedback, get_feedback_pdf = views.feedback, views.get_feedback_pdf
+    return [
+        # ex: /quizzes/
+        # Shows all quizzes
+        path('', index, name='index'),
 
-    # ex: /quizzes/1/1/question/1
-    # Pages through the quiz questions
-    path('<int:quiz_id>/<int:category_id>/<int:question_id>/', views.take_quiz, name='take_quiz'),
+        # ex: /quizzes/1/
+        # Shows all categories and questions of quiz
+        # The 'name' value as called by the {% url %} template tag
+        path('<int:pk>/', quiz_detail, name='quiz_detail'),
 
-    # ex: /quizzes/1/1/question/1/select_answer
-    path('<int:quiz_id>/<int:category_id>/<int:question_id>/select_answer/', views.select_answer, name='select_answer'),
+        # ex: /quizzes/1/1/question/1
+        # Pages through the quiz questions
+        path('<int:quiz_id>/<int:category_id>/<int:question_id>/', take_quiz, name='take_quiz'),
 
-    # nothing is rendered on this page, just a quick jump between the index and take_quiz
-    path('<int:quiz_id>/<int:category_id>/startquiz/', views.start_new_quiz, name='start_new_quiz'),
+        # ex: /quizzes/1/1/question/1/select_answer
+        path('<int:quiz_id>/<int:category_id>/<int:question_id>/select_answer/', select_answer, name='select_answer'),
 
-    # ex: /quizzes/feedback/user_id
-    # Shows the user the feedback for their quiz
-    path('feedback/<int:user_id>/', views.feedback, name='feedback'),
+        # nothing is rendered on this page, just a quick jump between the index and take_quiz
+        path('<int:quiz_id>/<int:category_id>/startquiz/', views.start_new_quiz, name='start_new_quiz'),
 
-    # ex: /quizzes/feedback/user_id/pdf
-    # Shows the user the feedback for their quiz
-    path('feedback/<int:user_id>/pdf/', views.get_feedback_pdf, name='get_feedback_pdf'),
-]
\ No newline at end of file
+        # ex: /quizzes/feedback/user_id
+        # Shows the user the feedback for their quiz
+        path('feedback/<int:user_id>/', feedback, name='feedback'),
+
+        # ex: /quizzes/feedback/user_id/pdf
+        # Shows the user the feedback for their quiz
+        path('feedback/<int:user_id>/pdf/', get_feedback_pdf, name='get_feedback_pdf'),
+
+        # ex: /quizzes/1/export/pdfs/?format=zip
+        # Streams the feedback pdfs of every finished response to a quiz
+        path('<int:quiz_id>/export/pdfs/', views.export_feedback_pdfs, name='export_feedback_pdfs'),
+
+        # ex: /quizzes/1/export/responses/?format=parquet&layout=answers
+        # Streams the finished responses of a quiz as CSV or Parquet
+        path('<int:quiz_id>/export/responses/', views.export_responses, name='export_responses'),
+
+        # ex: /quizzes/1/analytics/
+        # Completions, answer picks and category score histograms of a quiz as JSON
+        path('<int:quiz_id>/analytics/', views.quiz_analytics_report, name='quiz_analytics_report'),
+
+        # ex: /quizzes/api/1/
+        # The whole quiz as JSON, to take it in one page
+        path('api/<int:quiz_id>/', api.quiz_api, name='quiz_api'),
+
+        # ex: /quizzes/api/1/submit/
+        # Scores all answers of a quiz posted as JSON at once and finalizes the response
+        path('api/<int:quiz_id>/submit/', api.submit_quiz_api, name='submit_quiz_api'),
+
+        # Percentiles of the per-request measurements of this process, when QUIZ_INSTRUMENTATION is enabled
+        path('instrumentation/', views.instrumentation_report, name='instrumentation_report'),
+
+        # ex: /quizzes/import/1/
+        # Reports the progress of a quiz CSV import job as JSON
+        path('import/<int:job_id>/', views.import_status, name='import_status'),
+    ]
+
+
+urlpatterns = quiz_urlpatterns(getattr(settings, 'QUIZ_ASYNC_VIEWS', False))
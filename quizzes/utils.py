@@ -0,0 +1,13 @@
+from itertools import islice
+
+# Keeps `id__in` queries under SQLite's limit on query parameters
+ID_BATCH_SIZE = 500
+
+
+def iter_batches(rows, batch_size):
+    """Yields lists of up to `batch_size` items of an iterable, reading it lazily"""
+    rows = iter(rows)
+    batch = list(islice(rows, batch_size))
+    while batch:
+        yield batch
+        batch = list(islice(rows, batch_size))
@@ -1,21 +1,43 @@
-import csv, io, datetime
+from calendar import timegm
 from django.contrib.auth.decorators import permission_required
-from django.views.decorators.cache import cache_page
+from django.views.decorators.http import condition
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
 from django.contrib import messages
-from django.http import HttpResponseRedirect
+from django.http import (FileResponse, Http404, HttpResponse, HttpResponseBadRequest, HttpResponseRedirect,
+                         JsonResponse, StreamingHttpResponse)
 from django.shortcuts import render, get_object_or_404
+from django.template.loader import render_to_string
 from django.urls import reverse
 from django.views import generic
-from django.utils import timezone
-from .models import Quiz, Category, Question, Answer, Feedback, UserResponse
-from .render import Render
-from django.core.exceptions import ObjectDoesNotExist
-from random import choice
+from django.db import IntegrityError, transaction
+from .models import Quiz, UserResponse, ImportJob
+from .analytics import quiz_analytics, update_analytics
+from .compiled import get_quiz_tree, get_quiz_tree_or_404
+from .exports import CONTENT_TYPES, EXPORT_LAYOUTS, export_formats, stream_export
+from .progress import QuizProgress, load_progress, progress_backend, progress_query
+from .scoring import get_scorer
+from .selections import write_selections
+from .reports import build_feedback_report, cache_feedback_page, get_cached_feedback_page, invalidate_feedback_pages
+from .importer import QuizImportError
+from .jobs import dispatch_pending, enqueue_import, import_runner
+from .pdfs import (QUIZ_PDF_MERGE_MAX_RESPONSES, get_pools, iter_feedback_pdfs, iter_responses, pdf_runner,
+                   queue_feedback_pdf, stream_merged_pdf, stream_pdf_zip)
+from .signals import response_finalized
+from .writebehind import get_buffer, pending_response, write_behind_enabled
+from . import instrumentation
 
 
 # Built following alongside Django Software Foundation's Writing your first Django app Tutorial
 # https://docs.djangoproject.com/en/3.0/intro/tutorial01/
 
+# Number of random response_ids tried before giving up on creating a UserResponse
+RESPONSE_ID_ATTEMPTS = 5
+
+# Seconds a client is asked to wait before polling for a feedback pdf that is still being rendered
+PDF_RETRY_AFTER = 2
+
+
 class IndexView(generic.ListView):
     template_name = 'quizzes/index.html'
     context_object_name = 'latest_quiz_list'
@@ -55,169 +77,63 @@ def quiz_upload(request):
 
     # Check if the submitted file is .csv format
     if not csv_file.name.endswith('.csv'):
-        messages.error(request, template, 'This is not a csv file')
-
-    quiz_contents = csv_file.read().decode('UTF-8')
-    io_string = io.StringIO(quiz_contents)
+        messages.error(request, 'This is not a csv file')
+        return render(request, template, prompt)
 
-    # Create/Update Quiz using first row of csv, check for proper format
-    csv_header = next(csv.reader(io_string, delimiter=',', quotechar="|"))
+    # The file is imported by a background job, only the header is checked in the request.
+    # A bad row leaves no half-written quiz behind.
     try:
-        # Added an extra layer of error catching, this will try to enter the time in the full datetime format
-        # if not in datetime %Y-%m-%d %H:%M:%S.%f', then it will just try the date given
-        try:
-            quiz_obj, quiz_created = Quiz.objects.update_or_create(
-                name=csv_header[0],
-                pub_date=datetime.datetime.strptime(csv_header[1], '%Y-%m-%d %H:%M:%S.%f'),
-                description=csv_header[2],
-                active_quiz=True,
-            )
-        except ValueError:
-            quiz_obj, quiz_created = Quiz.objects.update_or_create(
-                name=csv_header[0],
-                pub_date=csv_header[1],
-                description=csv_header[2],
-                active_quiz=True,
-            )
-
-    # If there is an Index Error, the created object is deleted and the page is reloaded with the error message
-    except IndexError:
-        try:
-            Quiz.objects.filter(quiz_name=quiz_obj.quiz_name).delete()
-        except ObjectDoesNotExist:
-            pass
-        render(request, template, prompt)
-        messages.error(request, error_msg)
-
-    # Creating sets to check old upload vs new upload
-    if quiz_created is False:
-        categories = quiz_obj.category_set.all()
-        questions = quiz_obj.question_set.all()
-        answers = quiz_obj.answer_set.all()
-        feedback_set = quiz_obj.feedback_set.all()
-        quiz_c_old = set(c.category_name for c in categories)
-        quiz_c_new = set()
-        quiz_q_old = set(q.question_text for q in questions)
-        quiz_q_new = set()
-        quiz_a_old = set((a.answer_text, a.answer_weight) for a in answers)
-        quiz_a_new = set()
-        quiz_f_old = set(f.feedback_text for f in feedback_set)
-        quiz_f_new = set()
-
-    # Now create the rest of the Quiz elements, u
-    for row in csv.reader(io_string, delimiter=',', quotechar="|"):
-        try:
-            category_obj, created = Category.objects.update_or_create(
-                parent_quiz=quiz_obj,
-                category_name=row[1],
-                order=0,
-                description='',
-                score=0
-            )
-            question_obj, created = Question.objects.update_or_create(
-                parent_quiz=quiz_obj,
-                parent_category=category_obj,
-                question_text=row[2]
-            )
-            answer_obj, created = Answer.objects.update_or_create(
-                parent_quiz=quiz_obj,
-                parent_category=category_obj,
-                parent_question=question_obj,
-                answer_text=row[3],
-                answer_selected=False,
-                answer_weight=row[4]
-            )
-            feedback_obj, created = Feedback.objects.update_or_create(
-                parent_quiz=quiz_obj,
-                parent_category=category_obj,
-                parent_question=question_obj,
-                parent_answer=answer_obj,
-                feedback_type='',
-                feedback_text=row[5]
-            )
-            if quiz_created is False:
-                quiz_c_new.add(category_obj.category_name)
-                quiz_q_new.add(question_obj.question_text)
-                quiz_a_new.add((answer_obj.answer_text, answer_obj.answer_weight))
-                quiz_f_new.add(feedback_obj.feedback_text)
-
-        # If there is an error in the format of the CSV, Error raised.
-        # Anything that was created relating to the quiz is deleted and the page is reloaded with an error message
-        except IndexError or ValueError:
-            try:
-                Feedback.objects.filter(parent_quiz=quiz_obj).delete()
-                Answer.objects.filter(parent_quiz=quiz_obj).delete()
-                Question.objects.filter(parent_quiz=quiz_obj).delete()
-                Category.objects.filter(parent_quiz=quiz_obj).delete()
-                Quiz.objects.filter(quiz_name=quiz_obj.quiz_name).delete()
-            except ObjectDoesNotExist:
-                pass
-            render(request, template, prompt)
-            messages.error(request, error_msg)
-
-    # Checking what was removed between uploads
-    if quiz_created is False:
-        removed_c = quiz_c_old.difference(quiz_c_new)
-        removed_q = quiz_q_old.difference(quiz_q_new)
-        removed_a = quiz_a_old.difference(quiz_a_new)
-        removed_f = quiz_f_old.difference(quiz_f_new)
-
-        # Removing anything that was not in the new csv
-        if removed_c:
-            for i in removed_c:
-                category = Category.objects.filter(parent_quiz=quiz_obj, category_name=str(i)).get()
-                Feedback.objects.filter(parent_quiz=quiz_obj, parent_category=category).delete()
-                Answer.objects.filter(parent_quiz=quiz_obj, parent_category=category).delete()
-                Question.objects.filter(parent_quiz=quiz_obj, parent_category=category).delete()
-                Category.objects.filter(parent_quiz=quiz_obj, category_name=str(i)).delete()
-        if removed_q:
-            for i in removed_q:
-                try:
-                    question = Question.objects.filter(parent_quiz=quiz_obj, question_text=str(i)).get()
-                    Feedback.objects.filter(parent_quiz=quiz_obj, parent_question=question).delete()
-                    Answer.objects.filter(parent_quiz=quiz_obj, parent_question=question).delete()
-                    Question.objects.filter(parent_quiz=quiz_obj, question_text=str(i)).delete()
-                except ObjectDoesNotExist:
-                    pass
-        if removed_a:
-            for i in removed_a:
-                try:
-                    answer = Answer.objects.filter(parent_quiz=quiz_obj, answer_text=str(i[0]), answer_weight=i[1]).get()
-                    Feedback.objects.filter(parent_quiz=quiz_obj, parent_answer=answer).delete()
-                    Answer.objects.filter(parent_quiz=quiz_obj, answer_text=str(i[0]), answer_weight=i[1]).delete()
-                except ObjectDoesNotExist:
-                    pass
-        if removed_f:
-            for i in removed_f:
-                try:
-                    Feedback.objects.filter(parent_quiz=quiz_obj, feedback_text=str(i)).delete()
-                except ObjectDoesNotExist:
-                    pass
-
-    context = {
-        "success": 'The quiz was uploaded successfully',
-        'headerorder': 'Order of the CSV header should be Quiz name, pub_date, description',
-        'order': 'Order for rest of CSV should be Quiz name, '
-                 'category_name, question_text, answer_text, answer_weight, feedback_text',
-        'feedbacknote': 'If you do not plan on including feedback for an answer put No Feedback for feedback_text',
-    }
+        job = enqueue_import(csv_file)
+    except UnicodeDecodeError:
+        messages.error(request, error_msg + ': the file is not UTF-8 encoded')
+        return render(request, template, prompt)
+    except QuizImportError as e:
+        messages.error(request, '%s: %s' % (error_msg, e))
+        return render(request, template, prompt)
+
+    # Jobs run by the 'sync' runner are already finished here
+    job.refresh_from_db()
+    if job.status == ImportJob.FAILED:
+        messages.error(request, '%s: %s' % (error_msg, job.error_message))
+        return render(request, template, prompt)
+
+    context = dict(prompt)
+    if job.status == ImportJob.DONE:
+        context['success'] = 'The quiz was uploaded successfully'
+    else:
+        context['success'] = 'The quiz is being imported'
+        context['status_url'] = reverse('quizzes:import_status', args=(job.id,))
 
     return render(request, template, context)
 
 
-def generate_new_id(quiz_id):
-    range_low = quiz_id*1000
-    range_high = range_low + 999
-    ids = set(range(range_low, range_high))
-    used_ids = set(UserResponse.objects.values_list('response_id', flat=True))
-    return choice(list(ids - used_ids))
+@permission_required('admin.can_add_log_entry')
+def import_status(request, job_id):
+    """
+    Reports the status and progress of a quiz import job as JSON.
+    With the 'thread' runner a job that was lost in a restart of the web process is dispatched again.
+    """
+    job = get_object_or_404(ImportJob, pk=job_id)
+    if not job.is_finished() and import_runner() == 'thread':
+        dispatch_pending(job.quiz_name)
+        job.refresh_from_db()
+    return JsonResponse({
+        'id': job.id,
+        'quiz_name': job.quiz_name,
+        'quiz_id': job.quiz_id,
+        'status': job.status,
+        'rows_processed': job.rows_processed,
+        'rows_total': job.rows_total,
+        'error_message': job.error_message,
+    })
 
 
 def create_user_response(quiz_id, *args):
     """
     Function to create a new response database entry,
     response_id is left default to be produced with the
-    UserResponse class's generate_new_id function
+    generate_response_id function of the models module.
+    An id that is already taken is caught by the unique index and a new one is drawn.
 
     Returns the UserResponse object response_id
     """
@@ -230,79 +146,116 @@ def create_user_response(quiz_id, *args):
         )
         return response_obj.response_id
     else:
-        response_obj, created = UserResponse.objects.update_or_create(
-            parent_quiz=quiz,
-            response_id=generate_new_id(quiz_id),
-        )
+        return new_user_response(quiz.id).response_id
 
-        return response_obj.response_id
+
+def new_user_response(quiz_id, response_data=None):
+    """
+    Creates a UserResponse with a random response_id, a new id is drawn when the first one is taken.
+    Passing the response_data of a finished quiz creates the response finalized.
+
+    Returns the UserResponse
+    """
+    for attempt in range(RESPONSE_ID_ATTEMPTS):
+        try:
+            with transaction.atomic():
+                return UserResponse.objects.create(parent_quiz_id=quiz_id, response_data=response_data)
+        except IntegrityError:
+            continue
+    raise IntegrityError('Could not allocate a unique response_id')
+
+
+def store_finished_response(quiz_id, response_id, response_data):
+    """
+    Stores the response data of a finished quiz on its UserResponse and in the selection tables,
+    counts it in the quiz analytics and sends response_finalized.
+    A response_id of None creates the response. With QUIZ_WRITE_BEHIND the response is handed to the
+    write-behind buffer instead and written to the database later, see the writebehind module.
+
+    Returns the response_id
+    """
+    if write_behind_enabled():
+        return get_buffer().add(quiz_id, response_id, response_data)
+    previous_data = None
+    # The response, its selection rows and the analytics are written together or not at all
+    with transaction.atomic():
+        if response_id is None:
+            user = new_user_response(quiz_id, response_data)
+        else:
+            # Updating session's UserResponse, the analytics take out what it counted for before
+            user = UserResponse.objects.filter(parent_quiz_id=quiz_id, response_id=response_id).first()
+            if user is None:
+                create_user_response(quiz_id, {'user_id': response_id, 'quiz_dictionary': response_data})
+                user = UserResponse.objects.get(response_id=response_id)
+            else:
+                previous_data = user.response_data
+                user.response_data = response_data
+                user.save(update_fields=['response_data', 'updated_at'])
+            invalidate_feedback_pages([user.pk])
+        write_selections(quiz_id, [(user.pk, response_data)], replace=previous_data is not None)
+        update_analytics(quiz_id, [(previous_data, response_data)])
+    response_finalized.send(sender=UserResponse, response=user)
+    return user.response_id
 
 
 def save_user_feedback(request, user_id):
-    user = UserResponse.objects.filter(response_id=user_id).get()
-    quiz = user.parent_quiz
+    """
+    Finalizes the UserResponse of a finished quiz.
+    The text-keyed dictionaries of the response data are only built here, from the id-based session progress.
+    """
+    quiz_id = UserResponse.objects.filter(response_id=user_id).values_list('parent_quiz_id', flat=True).get()
+    quiz, progress = get_session_data(request, quiz_id)
+    store_finished_response(quiz.id, user_id, progress.response_data(get_scorer(quiz)))
+
 
-    # Get session variables for rendering
-    quiz_data = request.session[quiz.session_quiz_data()]
-    feed_dict = request.session[quiz.session_feedback()]
-    norm_scores_dict = request.session[quiz.session_norm_data()]
+def finish_quiz(request, quiz, progress):
+    """
+    Finalizes the UserResponse of a finished quiz. With signed progress the response is only created here.
+
+    Returns the response_id
+    """
+    return store_finished_response(quiz.id, progress.response_id, progress.response_data(get_scorer(quiz)))
 
-    # Updating session's UserResponse to
-    create_user_response(quiz.id, {'user_id': user_id, 'quiz_dictionary': {'quiz_data': quiz_data,
-                                                                           'quiz_norm_scores': norm_scores_dict,
-                                                                           'feedback_data': feed_dict}})
+
+def take_quiz_url(quiz, question, progress):
+    return reverse('quizzes:take_quiz', args=(quiz.id, question.category_id, question.id)) + progress_query(progress)
 
 
 def start_new_quiz(request, quiz_id, category_id):
     """
     Function to create a new quiz session variables when "Take Quiz" button is selected.
+    With signed progress the session is left alone and the progress starts in the url of the first question.
     """
-    quiz = get_object_or_404(Quiz, pk=quiz_id)
-    quiz_id = quiz.id
-    categories = quiz.get_quiz_categories()
-    category_id = quiz.category_set.first().id
-    questions = quiz.get_quiz_questions()
-    question_id = quiz.question_set.first().id
-    question_list = [q.id for q in questions]
-
-    # Set session variables for quiz
-    request.session.flush()
-    request.session[quiz.session_question_list()] = question_list
-
-    # Quiz data dictionary formatted:
-    # {category_name: {question_name : answer_selected} }
-    data = {}
-    for i in range(len(categories)):
-        innerdict = {}
-        category = categories[i]
-        cat_questions = category.question_set.all()
-        for j in range(len(cat_questions)):
-            question_list_item = cat_questions[j]
-            innerdict.update({question_list_item.question_text: None})
-        data.update({category.category_name: innerdict})
-    request.session[quiz.session_quiz_data()] = data
-
-    category_score_data = {categories[i].category_name: None for i in range(len(categories))}
-    request.session[quiz.session_cat_data()] = category_score_data
-    request.session[quiz.session_norm_data()] = category_score_data
-
-    # # Create new new user response
-    user_id = create_user_response(quiz_id)
-    request.session[quiz.session_response_id()] = user_id
-
-    return HttpResponseRedirect(
-        reverse('quizzes:take_quiz', args=(quiz.id, category_id, question_id)))
+    quiz = get_quiz_tree_or_404(quiz_id)
+    if not quiz.questions:
+        raise Http404('This quiz has no questions.')
+    first_question = quiz.questions[0]
+
+    if progress_backend() == 'signed':
+        progress = QuizProgress(quiz, None)
+    else:
+        # Set session variables for quiz, with a new user response
+        request.session.flush()
+        progress = QuizProgress(quiz, create_user_response(quiz.id))
+        progress.save(request.session)
+
+    return HttpResponseRedirect(take_quiz_url(quiz, first_question, progress))
 
 
 def take_quiz(request, quiz_id, category_id, question_id):
     """
-    View Function that is responsible for rendering the question pages of the quiz
+    View Function that is responsible for rendering the question pages of the quiz.
+    The page is rendered from the compiled quiz, so it needs no database queries.
+    The url carries the quiz version the taker started on as `v`.
     """
-    # Get vars
-    quiz = get_object_or_404(Quiz, pk=quiz_id)
-    question_id = Question.objects.get_subclass(id=question_id)
-    return render(request, 'quizzes/take_quiz.html',
-                  {'quiz': quiz.id, 'category': category_id, 'question': question_id})
+    quiz = get_quiz_tree_or_404(quiz_id, request.GET.get('v'))
+    question = quiz.get_question(question_id)
+    if question is None:
+        raise Http404('No Question matches the given query.')
+    return render(request, 'quizzes/take_quiz.html', {
+        'quiz': quiz, 'category': category_id, 'question': question,
+        'progress_token': request.GET.get('progress'),
+    })
 
 
 def select_answer(request, quiz_id, category_id, question_id):
@@ -312,181 +265,298 @@ def select_answer(request, quiz_id, category_id, question_id):
     """
 
     # Get vars
-    quiz = get_object_or_404(Quiz, pk=quiz_id)
-    category = get_object_or_404(Category, pk=category_id)
-    category_name = category.category_name
-    question = get_object_or_404(Question, pk=question_id)
-    question_text = question.question_text
-    last_question = request.session[quiz.session_question_list()][-1]
+    quiz, progress = get_session_data(request, quiz_id)
+    question = quiz.get_question(question_id)
+    if question is None:
+        raise Http404('No Question matches the given query.')
 
     try:  # Check if an answer is selected
-        selected_answer = question.answer_set.get(pk=request.POST['answer'])
-    except (KeyError, Answer.DoesNotExist):
+        selected_answer = question.get_answer(int(request.POST['answer']))
+    except (KeyError, ValueError):
+        selected_answer = None
+    if selected_answer is None:
         # Redisplay the question if answer is not selected
         return render(request, 'quizzes/take_quiz.html', {
             'quiz': quiz,
             'question': question,
             'error_message': "You didn't select an answer.",
+            'progress_token': request.POST.get('progress'),
         })
+
+    # Update session variables based on selection
+    progress.select(question, selected_answer)
+    if progress_backend() == 'session':
+        progress.save(request.session)
+
+    # Continue with quiz, or redirect to feedback when on last question
+    next_question = quiz.next_question(question)
+    if next_question is None:  # Finished Answering Questions for quiz, redirect to feedback
+        response_id = finish_quiz(request, quiz, progress)
+        return HttpResponseRedirect(reverse('quizzes:feedback', args=(response_id,)))
     else:
-        # Update session variables based on selection
-        question_data = request.session[quiz.session_quiz_data()]
-        question_data[str(category_name)][str(question_text)] = selected_answer.answer_text
-        category_score = request.session[quiz.session_cat_data()]
-        answer_score = selected_answer.answer_weight
-        if category_score[str(category_name)] is None:
-            category_score[str(category_name)] = answer_score
-        elif category_score[str(category_name)] is not None:
-            category_score[str(category_name)] = category_score[str(category_name)] + answer_score
-
-        # Save session variables
-        request.session[quiz.session_cat_data()] = category_score
-        request.session[quiz.session_quiz_data()] = question_data
-
-        # Continue with quiz, or redirect to feedback when on last question
-        if question_id == last_question:  # Finished Answering Questions for quiz, redirect to feedback
-            normalize_scores(request, quiz_id)
-            get_session_feedback(request, quiz_id)
-            user_id = request.session[quiz.session_response_id()]
-            save_user_feedback(request, user_id)
-            return HttpResponseRedirect(reverse('quizzes:feedback', args=(user_id,)))
-        else:
-            return HttpResponseRedirect(reverse('quizzes:take_quiz', args=(quiz_id, category_id, question_id + 1)))
+        return HttpResponseRedirect(take_quiz_url(quiz, next_question, progress))
 
 
 def get_session_data(request, quiz_id):
     """
     Helper function that takes the request and quiz_id as arguments and returns
-    useful variables
+    the QuizProgress stored in the session, or in the signed progress token,
+    and the version of the compiled quiz it is pinned to
     """
-    quiz = get_object_or_404(Quiz, pk=quiz_id)
-    quiz_data = request.session[quiz.session_quiz_data()]
-    category_score_dict = request.session[quiz.session_cat_data()]
-    norm_score_dict = request.session[quiz.session_norm_data()]
-    questions_list = request.session[quiz.session_question_list()]
-    return quiz, quiz_data, category_score_dict, norm_score_dict, questions_list
+    progress = load_progress(request, get_quiz_tree_or_404(quiz_id))
+    if progress is None:
+        raise Http404('This quiz was not started.')
+    return progress.quiz, progress
 
 
 def normalize_scores(request, quiz_id):
     """
-    This is a function to normalize the category scores to a scale of 0-10. I have assumed that the max weight
-    for each question is 1, and the min is 0. I will need to update this to adapt to the varying max and min
-    weights from each question, as well as adapting to admin defined score ranges.
+    This is a function to normalize the category scores onto the score range, 0-10 unless QUIZ_SCORE_RANGE is set.
+    The range of each category runs from the sum of the lowest to the sum of the highest answer weights
+    of its questions, see the scoring module.
 
     Dictionary format: {category_name : normalized score}
     """
-    quiz, quiz_data, category_score_dict, norm_score_dict, questions_list = get_session_data(request, quiz_id)
-    categories = quiz.get_quiz_categories()
-
-    # Creating a list of the max score for each section, needed to normalize to a score range of 0 - 10
-    old_max_list = []
-    for i in range(len(category_score_dict)):
-        category = categories[i]
-        old_max_list.append(len(quiz_data[str(category.category_name)]))
-
-    # Normalizing the old scores and populating the session variable session_norm_data, round to 2 decimal places
-    norm_score_list = [
-        round((
-                (10 / (old_max_list[i] - 0)) *
-                (category_score_dict[str(categories[i].category_name)] - old_max_list[i]) + 10
-            ), 2
-        )
-        for i in range(len(category_score_dict))
-    ]
-
-    for i in range(len(category_score_dict)):
-        category = categories[i]
-        if norm_score_list[i] is not None:
-            norm_score_dict[str(category.category_name)] = norm_score_list[i]
-    request.session[quiz.session_norm_data()] = norm_score_dict
-    return request.session[quiz.session_norm_data()]
+    quiz, progress = get_session_data(request, quiz_id)
+    return get_scorer(quiz).score(progress.answers)
 
 
 def get_session_feedback(request, quiz_id):
     """
-    Function to create a dictionary of feedback for the session
+    Function to create a dictionary of feedback for the session.
+    Feedback is looked up by the ids of the selected answers in the compiled quiz,
+    so no queries are made per question.
     Returns a dictionary formatted:
     {category_name: {question_text : feedback_text} }
     """
-    quiz, quiz_data, category_score_dict, norm_score_dict, questions_list = get_session_data(request, quiz_id)
-    categories = quiz.get_quiz_categories()
-
-    # Creating the feedback dictionary to populate the session variable session_feedback
-    feedback_set = {}
-    for i in range(len(categories)):
-        innerdict = {}
-        category = categories[i]
-        category_name = category.category_name
-        cat_questions = category.question_set.all()
-        for j in range(len(cat_questions)):
-            question = cat_questions[j]
-            question = Question.objects.filter(id=question.id).get()
-            question_text = question.question_text
-            answer_text = quiz_data[str(category_name)][str(question_text)]
-            if answer_text is not None:
-                answer = Answer.objects.filter(parent_quiz=quiz, answer_text=answer_text).get()
-                check_feedback = answer.get_quiz_feedback().get()
-                if answer.answer_weight < 1:
-                    answer_feedback = check_feedback.feedback_text
-                    innerdict.update({question_text: answer_feedback})
-                if answer.answer_weight == 1:
-                    answer_feedback = check_feedback.feedback_text
-                    if answer_feedback == "No Feedback":
-                        answer_feedback = None
-                    innerdict.update({question_text: answer_feedback})
-        feedback_set.update({category_name: innerdict})
-    request.session[quiz.session_feedback()] = feedback_set
-    return request.session[quiz.session_feedback()]
-
-
-@cache_page(60 * 15)
+    quiz, progress = get_session_data(request, quiz_id)
+    return progress.feedback_data()
+
+
+def feedback_validators(user_id, updated_at):
+    """Returns the ETag and the Last-Modified timestamp of the feedback page of a response"""
+    etag = '"%s-%s"' % (user_id, updated_at.timestamp() if updated_at else 0)
+    last_modified = timegm(updated_at.utctimetuple()) if updated_at else None
+    return etag, last_modified
+
+
+def finished_response_validators(user_id):
+    """Returns the pk and updated_at of a finished response, a 404 when the response doesn't exist or isn't finished"""
+    row = UserResponse.objects.filter(response_id=user_id, response_data__isnull=False).values_list(
+        'pk', 'updated_at').first()
+    if row is None:
+        raise Http404('This quiz was not finished.')
+    return row
+
+
+def feedback_page(response_pk, updated_at, user_id):
+    """Returns the rendered feedback page of a response, from the shared feedback cache when it is current"""
+    page = get_cached_feedback_page(response_pk, updated_at)
+    if page is None:
+        user = UserResponse.objects.select_related('parent_quiz').get(pk=response_pk)
+        page = render_to_string('quizzes/feedback.html', {
+            'quiz': user.parent_quiz,
+            'report': build_feedback_report(user.response_data),
+            'user_id': user_id
+        })
+        cache_feedback_page(response_pk, updated_at, page)
+    return page
+
+
+def feedback_page_response(page, etag, last_modified):
+    response = HttpResponse(page)
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def pending_feedback_response(user_id, spooled=False):
+    """
+    The feedback page of a response still waiting in the write-behind buffer, or None.
+    With `spooled` the responses buffered by other processes are looked up as well
+    """
+    pending = pending_response(user_id, spooled)
+    if pending is None:
+        return None
+    response = HttpResponse(render_to_string('quizzes/feedback.html', {
+        'quiz': get_quiz_tree(pending.quiz_id),
+        'report': build_feedback_report(pending.response_data),
+        'user_id': user_id
+    }))
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def unwritten_feedback_response(request, user_id):
+    """
+    The answer for a response that isn't finished in the database while the write-behind buffer is on:
+    its feedback page when a process has it buffered, a page to wait for it when it is a response started
+    in the session, None when there is no such response
+    """
+    if not write_behind_enabled():
+        return None
+    response = pending_feedback_response(user_id, spooled=True)
+    if response is None and UserResponse.objects.filter(response_id=user_id).exists():
+        response = wait_for_response(request, reverse('quizzes:feedback', args=(user_id,)))
+    return response
+
+
 def feedback(request, user_id):
     """
     This is the feedback page that users will see once they are done with a quiz.
-    This page is cached and uses the UserResponse Model to show a limited amount of feedback
-    """
-    request.session.set_expiry(1)
-    user = UserResponse.objects.filter(response_id=user_id).get()
-    quiz = user.parent_quiz
-
-    # Get session variables for rendering
-    quiz_data = user.response_data['quiz_data']
-    norm_scores_dict = user.response_data['quiz_norm_scores']
-    feed_dict = user.response_data['feedback_data']
-    number_of_sections = 2
-    sorted_scores_limited = {k: v
-                             for k, v in sorted(norm_scores_dict.items(), key=lambda item: item[1])[:number_of_sections]
-                             }
-
-    return render(request, 'quizzes/feedback.html', {
-        'quiz': quiz,
-        'feed_dict': feed_dict,
-        'norm_scores': norm_scores_dict,
-        'sorted_scores_limit': sorted_scores_limited,
-        'user_id': user_id
-    })
+    It uses the UserResponse Model to show a limited amount of feedback. The rendered page is cached per
+    response in the shared feedback cache, and browsers revalidate it with its ETag and Last-Modified.
+    """
+    if progress_backend() == 'session':
+        request.session.set_expiry(1)
+    response = pending_feedback_response(user_id)
+    if response is not None:
+        return response
+    try:
+        response_pk, updated_at = finished_response_validators(user_id)
+    except Http404:
+        response = unwritten_feedback_response(request, user_id)
+        if response is None:
+            raise
+        return response
+    etag, last_modified = feedback_validators(user_id, updated_at)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        return response
+    return feedback_page_response(feedback_page(response_pk, updated_at, user_id), etag, last_modified)
+
+
+def feedback_pdf_etag(request, user_id):
+    return UserResponse.objects.filter(response_id=user_id).values_list('feedback_pdf_hash', flat=True).first()
+
+
+def feedback_pdf_pending(request, user_id):
+    """The 202 answer to a request for a feedback pdf that is still being rendered"""
+    return wait_for_response(request, reverse('quizzes:get_feedback_pdf', args=(user_id,)))
 
 
-@cache_page(60 * 60)
+def feedback_pdf_failed(request, user_id):
+    """The answer for a feedback pdf that couldn't be rendered, it isn't tried again until the response changes"""
+    return HttpResponse("Error Rendering PDF", status=400)
+
+
+def response_unwritten(user_id, exists):
+    """
+    Whether a response that isn't finished in the database may be waiting in the write-behind buffer
+    of any process. `exists` tells whether it has a row
+    """
+    return write_behind_enabled() and (exists or pending_response(user_id, spooled=True) is not None)
+
+
+def wait_for_response(request, poll_url):
+    """The 202 answer to a request for something that is still being prepared, pointing at `poll_url` to poll"""
+    if 'application/json' in request.headers.get('Accept', ''):
+        response = JsonResponse({'status': 'pending', 'poll_url': poll_url}, status=202)
+    else:
+        response = render(request, 'quizzes/feedback_pdf_pending.html', {'poll_url': poll_url}, status=202)
+    response['Retry-After'] = str(PDF_RETRY_AFTER)
+    return response
+
+
+@condition(etag_func=feedback_pdf_etag)
 def get_feedback_pdf(request, user_id):
     """
     This is a feedback page that is rendered as a pdf. Users will be able to access this from the feedback page.
-    This page is cached and uses the response_data object of the UserResponse Model.
-    """
-    today = timezone.now()
-    user = UserResponse.objects.filter(response_id=user_id).get()
-    quiz = user.parent_quiz
-
-    # Get session variables for rendering
-    quiz_data = user.response_data['quiz_data']
-    norm_scores_dict = user.response_data['quiz_norm_scores']
-    feed_dict = user.response_data['feedback_data']
-    context = {
-        'user_id': user_id,
-        'today': today,
-        'quiz': quiz,
-        'quiz_data': quiz_data,
-        'feed_dict': feed_dict,
-        'norm_scores': norm_scores_dict,
-    }
-    return Render.render('quizzes/get_feedback_pdf.html', context)
+    The pdf is rendered once per response outside of the request, see the pdfs module. Until it is ready
+    the response is a 202 that points back at this page to poll.
+    """
+    if pending_response(user_id) is not None:
+        return feedback_pdf_pending(request, user_id)
+    user = UserResponse.objects.filter(response_id=user_id).first()
+    if user is None or not user.is_finalized():
+        if response_unwritten(user_id, user is not None):
+            return feedback_pdf_pending(request, user_id)
+        raise Http404('This quiz was not finished.')
+
+    if not user.feedback_pdf and not user.feedback_pdf_failed:
+        queue_feedback_pdf(user.pk)
+        user.refresh_from_db(fields=['feedback_pdf', 'feedback_pdf_hash', 'feedback_pdf_failed'])
+    if user.feedback_pdf_failed:
+        return feedback_pdf_failed(request, user_id)
+    if not user.feedback_pdf:
+        return feedback_pdf_pending(request, user_id)
+
+    response = FileResponse(user.feedback_pdf.open('rb'), content_type='application/pdf')
+    response['ETag'] = quote_etag(user.feedback_pdf_hash)
+    return response
+
+
+@permission_required('admin.can_add_log_entry')
+def export_feedback_pdfs(request, quiz_id):
+    """
+    Streams the feedback pdfs of every finished response to a quiz as a ZIP archive while they are rendered,
+    or as one merged pdf with ?format=pdf. ?ids= takes a comma separated list of response ids to export
+    only part of the responses, for example one workshop cohort. A merged pdf is built in memory,
+    so it takes at most QUIZ_PDF_MERGE_MAX_RESPONSES responses.
+    """
+    quiz = get_object_or_404(Quiz, pk=quiz_id)
+    responses = UserResponse.objects.filter(parent_quiz=quiz, response_data__isnull=False).order_by('id')
+    if request.GET.get('ids'):
+        try:
+            response_ids = [int(response_id) for response_id in request.GET['ids'].split(',')]
+        except ValueError:
+            return HttpResponseBadRequest('ids must be a comma separated list of response ids')
+        responses = responses.filter(response_id__in=response_ids)
+
+    export_format = request.GET.get('format', 'zip')
+    if export_format not in ('zip', 'pdf'):
+        return HttpResponseBadRequest('format must be zip or pdf')
+
+    response_pks = list(responses.values_list('id', flat=True))
+    if export_format == 'pdf' and len(response_pks) > QUIZ_PDF_MERGE_MAX_RESPONSES:
+        return HttpResponseBadRequest('A merged pdf takes at most %d responses, pick a cohort with ids= or use '
+                                      'format=zip' % QUIZ_PDF_MERGE_MAX_RESPONSES)
+
+    process_pool = get_pools()[0] if pdf_runner() == 'process' else None
+    documents = iter_feedback_pdfs(iter_responses(response_pks), process_pool)
+    if export_format == 'zip':
+        response = StreamingHttpResponse(stream_pdf_zip(documents), content_type='application/zip')
+    else:
+        response = StreamingHttpResponse(stream_merged_pdf(documents), content_type='application/pdf')
+    response['Content-Disposition'] = 'attachment; filename="feedback_%s.%s"' % (quiz.id, export_format)
+    return response
+
+
+@permission_required('admin.can_add_log_entry')
+def export_responses(request, quiz_id):
+    """
+    Streams the finished responses of a quiz as CSV, or as Parquet with ?format=parquet when pyarrow is
+    installed. ?layout=answers gives one row per answer instead of one per response, see the exports module.
+    """
+    quiz = get_quiz_tree_or_404(quiz_id)
+    layout = request.GET.get('layout', 'responses')
+    if layout not in EXPORT_LAYOUTS:
+        return HttpResponseBadRequest('layout must be one of %s' % ', '.join(EXPORT_LAYOUTS))
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in export_formats():
+        return HttpResponseBadRequest('format must be one of %s' % ', '.join(export_formats()))
+
+    response = StreamingHttpResponse(stream_export(quiz, layout, export_format),
+                                     content_type=CONTENT_TYPES[export_format])
+    response['Content-Disposition'] = 'attachment; filename="%s_%s.%s"' % (layout, quiz.id, export_format)
+    return response
+
+
+@permission_required('admin.can_add_log_entry')
+def quiz_analytics_report(request, quiz_id):
+    """
+    Reports the completions, answer picks and category score histograms of a quiz as JSON,
+    read from the aggregates the analytics module keeps up to date
+    """
+    return JsonResponse(quiz_analytics(get_quiz_tree_or_404(quiz_id)))
+
+
+@permission_required('admin.can_add_log_entry')
+def instrumentation_report(request):
+    """
+    Reports the percentiles of the request measurements kept by this process as JSON,
+    see the instrumentation module. Empty unless QUIZ_INSTRUMENTATION is enabled.
+    """
+    return JsonResponse(instrumentation.aggregate.percentiles())
@@ -0,0 +1,395 @@
+import atexit
+import glob
+import json
+import logging
+import os
+import threading
+import uuid
+from typing import NamedTuple
+from collections import defaultdict
+from django.conf import settings
+from django.db import OperationalError, close_old_connections, transaction
+from django.utils import timezone
+from .analytics import update_analytics
+from .models import UserResponse, generate_response_id
+from .reports import invalidate_feedback_pages
+from .selections import write_selections
+from .signals import response_finalized
+from .utils import iter_batches
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Optional write-behind buffer for finished responses, enabled with QUIZ_WRITE_BEHIND = True.
+# Finishing a quiz then only adds the response data to an in-memory buffer, and appends it to a spool file
+# when QUIZ_WRITE_BEHIND_SPOOL_DIR is set. A background thread writes the buffer to the database every
+# QUIZ_WRITE_BEHIND_INTERVAL seconds, or as soon as QUIZ_WRITE_BEHIND_BATCH_SIZE responses are waiting,
+# with one bulk_update and one bulk_create per batch. response_finalized is sent once a response is written.
+#
+# Durability: the buffer is flushed when the process exits normally. With a spool directory a response is on
+# disk before the request that finished it returns. Spool files of processes that died before flushing are
+# taken over by the next buffer created, in any process, or with `manage.py flush_responses`. Taking over
+# another process' spool needs fcntl file locks, so on Windows orphaned spools are left to the command.
+#
+# Responses still in the buffer are served from it: the feedback page reads through the buffer and the
+# feedback pdf answers 202 until the response is written. Other processes find them in the spool files, so
+# with several web processes set QUIZ_WRITE_BEHIND_SPOOL_DIR to a directory they share. A response started
+# in the session that isn't written yet, or not found in any spool, is answered with a page to wait for it.
+#
+# A batch that can't be written is written again a response at a time, so one bad response doesn't hold back
+# the others. A response that keeps failing is moved to the dead-letter file of the spool directory after
+# QUIZ_WRITE_BEHIND_MAX_ATTEMPTS flushes, as is a response whose id was taken by a response of another quiz.
+# Without a spool directory their data is logged instead. Database errors that are likely to pass, like a lost
+# connection or a locked table, are not counted: the flush stops and the buffer is written again later.
+
+QUIZ_WRITE_BEHIND_SPOOL_DIR = getattr(settings, 'QUIZ_WRITE_BEHIND_SPOOL_DIR', None)
+QUIZ_WRITE_BEHIND_BATCH_SIZE = getattr(settings, 'QUIZ_WRITE_BEHIND_BATCH_SIZE', 500)
+QUIZ_WRITE_BEHIND_INTERVAL = getattr(settings, 'QUIZ_WRITE_BEHIND_INTERVAL', 1.0)
+QUIZ_WRITE_BEHIND_MAX_ATTEMPTS = getattr(settings, 'QUIZ_WRITE_BEHIND_MAX_ATTEMPTS', 5)
+
+SPOOL_PATTERN = 'responses-*.jsonl'
+DEAD_LETTER_FILE = 'dead-letter.jsonl'
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+class PendingResponse(NamedTuple):
+    response_id: int
+    quiz_id: int
+    response_data: dict
+
+
+def write_behind_enabled():
+    return getattr(settings, 'QUIZ_WRITE_BEHIND', False)
+
+
+def lock_spool(spool_file):
+    """Takes the lock of a spool file without waiting, returns whether it was free"""
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(spool_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+    return True
+
+
+def same_file(spool_file, path):
+    """
+    Whether an open spool file is still the one at `path`. A process replaces its spool file when rewriting it
+    and unlocks the old one as it closes it, so a lock on a file opened just before is no sign of a dead process.
+    """
+    try:
+        return os.fstat(spool_file.fileno()).st_ino == os.stat(path).st_ino
+    except FileNotFoundError:
+        return False
+
+
+def read_spool(spool_file):
+    """Reads the responses of a spool file, a line cut short by a crash is skipped"""
+    spool_file.seek(0)
+    responses = []
+    for line in spool_file:
+        try:
+            responses.append(PendingResponse(*json.loads(line)))
+        except (ValueError, TypeError):
+            logger.warning('Skipped an incomplete line in spool %s', spool_file.name)
+    return responses
+
+
+class ResponseBuffer:
+    """
+    Finished responses waiting to be written to the database, see the top of this module.
+    Without an `interval` no background thread is started and the buffer is only written by flush().
+    """
+
+    def __init__(self, spool_dir=None, batch_size=QUIZ_WRITE_BEHIND_BATCH_SIZE, interval=QUIZ_WRITE_BEHIND_INTERVAL,
+                 max_attempts=QUIZ_WRITE_BEHIND_MAX_ATTEMPTS):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self.pending = {}
+        # {response_id: flushes that failed to write the response}
+        self.attempts = {}
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = None
+        self.spool = None
+        self.spool_dir = spool_dir
+        if spool_dir:
+            os.makedirs(spool_dir, exist_ok=True)
+            self.spool_path = os.path.join(spool_dir, 'responses-%d-%s.jsonl' % (os.getpid(), uuid.uuid4().hex[:8]))
+            self.spool = open(self.spool_path, 'a+', encoding='utf-8')
+            lock_spool(self.spool)
+            if fcntl is not None:
+                self.take_over_spools()
+
+    def take_over_spools(self):
+        """
+        Moves the responses of spool files nobody holds the lock of into this buffer.
+        Without fcntl every other spool file is taken over.
+        """
+        for path in sorted(glob.glob(os.path.join(self.spool_dir, SPOOL_PATTERN))):
+            if path == self.spool_path:
+                continue
+            try:
+                orphan = open(path, 'r', encoding='utf-8')
+            except FileNotFoundError:  # Removed by its process in the meantime
+                continue
+            with orphan:
+                if not lock_spool(orphan) or not same_file(orphan, path):
+                    continue
+                responses = read_spool(orphan)
+                with self.lock:
+                    for response in responses:
+                        self.append(response)
+                os.remove(path)
+            if responses:
+                logger.info('Took over %d unwritten responses from %s', len(responses), path)
+                self.start()
+
+    def append(self, response):
+        # Called with self.lock held
+        self.pending[response.response_id] = response
+        if self.spool is not None:
+            self.spool.write(json.dumps(response, separators=(',', ':')) + '\n')
+            self.spool.flush()
+            os.fsync(self.spool.fileno())
+
+    def add(self, quiz_id, response_id, response_data):
+        """
+        Adds the data of a finished quiz to the buffer. A response_id of None stands for a response that
+        doesn't exist yet, its id is drawn here and the row is created when the buffer is written.
+
+        Returns the response_id
+        """
+        if response_id is None:
+            response_id = generate_response_id()
+        with self.lock:
+            self.append(PendingResponse(response_id, quiz_id, response_data))
+            full = len(self.pending) >= self.batch_size
+        self.start()
+        if full:
+            self.wake.set()
+        return response_id
+
+    def get(self, response_id):
+        """Returns the PendingResponse of a response that isn't written yet, or None"""
+        return self.pending.get(response_id)
+
+    def find_spooled(self, response_id):
+        """
+        Returns the PendingResponse of a response another process hasn't written yet from its spool file, or None.
+        The spool files are rewritten only after their responses are committed, so a response is always either
+        in the database or in a spool.
+        """
+        if not self.spool_dir:
+            return None
+        prefix = '[%d,' % response_id
+        found = None
+        for path in glob.glob(os.path.join(self.spool_dir, SPOOL_PATTERN)):
+            try:
+                with open(path, 'r', encoding='utf-8') as spool_file:
+                    for line in spool_file:
+                        if line.startswith(prefix):
+                            try:
+                                found = PendingResponse(*json.loads(line))
+                            except (ValueError, TypeError):
+                                continue
+            except FileNotFoundError:  # Rewritten or taken over in the meantime
+                continue
+        return found
+
+    def start(self):
+        if self.interval is None or self.thread is not None:
+            return
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='quiz-write-behind', daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Writing buffered responses failed, they are kept for the next attempt')
+            finally:
+                close_old_connections()
+
+    def flush(self):
+        """
+        Writes every buffered response to the database, batch_size at a time.
+        Returns the number of responses written
+        """
+        with self.flush_lock:
+            with self.lock:
+                responses = list(self.pending.values())
+            written = 0
+            for batch in iter_batches(responses, self.batch_size):
+                users, dropped, failed = self.write_each(batch)
+                retried = set()
+                for response in failed:
+                    attempts = self.attempts.get(response.response_id, 0) + 1
+                    if attempts < self.max_attempts:
+                        self.attempts[response.response_id] = attempts
+                        retried.add(response.response_id)
+                    else:
+                        logger.error('Buffered response %s failed to be written %d times, it is dropped',
+                                     response.response_id, attempts)
+                        dropped.append(response)
+                self.dead_letter(dropped)
+                with self.lock:
+                    for response in batch:
+                        if response.response_id in retried:
+                            continue
+                        self.attempts.pop(response.response_id, None)
+                        if self.pending.get(response.response_id) is response:
+                            del self.pending[response.response_id]
+                    self.rewrite_spool()
+                for user in users:
+                    response_finalized.send(sender=UserResponse, response=user)
+                written += len(users)
+            return written
+
+    def write_each(self, batch):
+        """
+        Writes a batch, or each of its responses on its own when the batch fails.
+        Returns the responses written, the PendingResponses dropped and the PendingResponses that failed
+        """
+        try:
+            users, dropped = self.write_batch(batch)
+            return users, dropped, []
+        except OperationalError:
+            raise
+        except Exception:
+            if len(batch) == 1:
+                logger.exception('Writing buffered response %s failed', batch[0].response_id)
+                return [], [], batch
+        users, dropped, failed = [], [], []
+        for response in batch:
+            written = self.write_each([response])
+            users += written[0]
+            dropped += written[1]
+            failed += written[2]
+        return users, dropped, failed
+
+    def write_batch(self, batch):
+        """
+        Updates the responses that exist and creates the others in one transaction, along with their selection
+        rows and the analytics of their quizzes. Returns them all, and the PendingResponses dropped because their
+        response id is taken by another quiz
+        """
+        now = timezone.now()
+        by_id = {response.response_id: response for response in batch}
+        with transaction.atomic():
+            existing = UserResponse.objects.in_bulk(list(by_id), field_name='response_id')
+            updated = []
+            dropped = []
+            changes = defaultdict(list)
+            for response_id, user in existing.items():
+                response = by_id[response_id]
+                if user.parent_quiz_id != response.quiz_id:
+                    logger.error('Response id %s of quiz %s is taken by quiz %s, the response is dropped',
+                                 response_id, response.quiz_id, user.parent_quiz_id)
+                    dropped.append(response)
+                    continue
+                changes[user.parent_quiz_id].append((user.pk, user.response_data, response.response_data))
+                user.response_data = response.response_data
+                user.updated_at = now
+                updated.append(user)
+            UserResponse.objects.bulk_update(updated, ['response_data', 'updated_at'])
+            UserResponse.objects.bulk_create([
+                UserResponse(response_id=response.response_id, parent_quiz_id=response.quiz_id,
+                             response_data=response.response_data)
+                for response_id, response in by_id.items() if response_id not in existing
+            ])
+            created = UserResponse.objects.in_bulk(
+                [response_id for response_id in by_id if response_id not in existing], field_name='response_id')
+            for user in created.values():
+                changes[user.parent_quiz_id].append((user.pk, None, user.response_data))
+            for quiz_id, quiz_changes in changes.items():
+                write_selections(quiz_id, [(pk, new_data) for pk, old_data, new_data in quiz_changes],
+                                 replace=any(old_data is not None for pk, old_data, new_data in quiz_changes))
+                update_analytics(quiz_id, [(old_data, new_data) for pk, old_data, new_data in quiz_changes])
+        invalidate_feedback_pages([user.pk for user in updated])
+        return updated + list(created.values()), dropped
+
+    def dead_letter(self, responses):
+        """
+        Keeps dropped responses in the dead-letter file of the spool directory, or in the log without one,
+        so they can be looked into and written by hand
+        """
+        if not responses:
+            return
+        lines = [json.dumps(response, separators=(',', ':')) + '\n' for response in responses]
+        if not self.spool_dir:
+            for line in lines:
+                logger.error('Dropped buffered response: %s', line.rstrip())
+            return
+        path = os.path.join(self.spool_dir, DEAD_LETTER_FILE)
+        with open(path, 'a', encoding='utf-8') as dead_letter_file:
+            dead_letter_file.writelines(lines)
+            dead_letter_file.flush()
+            os.fsync(dead_letter_file.fileno())
+        logger.error('Moved %d dropped buffered responses to %s', len(responses), path)
+
+    def rewrite_spool(self):
+        # Called with self.lock held. The new file is locked before it replaces the old one,
+        # so no other process can take it over in between.
+        if self.spool is None:
+            return
+        new_spool = open(self.spool_path + '.tmp', 'w+', encoding='utf-8')
+        lock_spool(new_spool)
+        for response in self.pending.values():
+            new_spool.write(json.dumps(response, separators=(',', ':')) + '\n')
+        new_spool.flush()
+        os.fsync(new_spool.fileno())
+        os.replace(self.spool_path + '.tmp', self.spool_path)
+        self.spool.close()
+        self.spool = new_spool
+
+    def close(self):
+        """Writes what is left in the buffer, the spool file is removed once it is empty"""
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Buffered responses could not be written on shutdown, they are left in the spool')
+        if self.spool is not None:
+            with self.lock:
+                if not self.pending:
+                    os.remove(self.spool_path)
+                self.spool.close()
+                self.spool = None
+
+
+def get_buffer():
+    """The write-behind buffer of this process, created on first use"""
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = ResponseBuffer(QUIZ_WRITE_BEHIND_SPOOL_DIR)
+            atexit.register(_buffer.close)
+        return _buffer
+
+
+def pending_response(response_id, spooled=False):
+    """
+    The PendingResponse of a response waiting in the write-behind buffer, None when it is not buffered.
+    With `spooled` the spool files of the other processes are searched too
+    """
+    if not write_behind_enabled():
+        return None
+    buffer = get_buffer()
+    pending = buffer.get(response_id)
+    if pending is None and spooled:
+        pending = buffer.find_spooled(response_id)
+    return pending